@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+import sys
+
+if sys.version_info < (3, 6):
+    print('Use python >= 3.6', file=sys.stderr)
+    sys.exit(1)
+
+import os
+import re
+import time
+import json
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import textwrap
+import subprocess
+import http.client
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SERVER = """
+import sys
+sys.path.insert(0, {root!r})
+from storage.servernode import Node
+Node(replication={{"write_consistency": "ONE", "read_consistency": "ONE"}},
+     workers={{"port": {internal_port}}}).run_workers(
+    "127.0.0.1", {port}, {workers})
+"""
+
+
+def parse_argument():
+    """Parsing arguments"""
+    parser = argparse.ArgumentParser(
+        prog='benchmark.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+        Throughput of node by number of its workers
+        --------------------------------
+        starts node with empty data for every number of workers
+        and sends /set and /get requests of small values
+        from client processes over keep-alive connections
+        '''))
+    parser.add_argument("-w", "--workers", type=int, nargs="+",
+                        default=[1, 2, 4], help="numbers of workers")
+    parser.add_argument("-c", "--clients", type=int,
+                        default=os.cpu_count(), help="client processes")
+    parser.add_argument("--connections", type=int, default=16,
+                        help="connections of every client process")
+    parser.add_argument("-d", "--duration", type=float, default=10.0,
+                        help="seconds of load for every number of workers")
+    parser.add_argument("-r", "--reads", type=float, default=0.8,
+                        help="part of /get requests")
+    parser.add_argument("-k", "--keys", type=int, default=10000,
+                        help="number of keys")
+    parser.add_argument("-p", "--port", type=int, default=4031,
+                        help="port of node")
+    return parser.parse_args()
+
+
+def call(port: int, method: str, path: str, data: dict = None,
+         token: str = None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = token
+    connection.request(method, path, body=data and json.dumps(data),
+                       headers=headers)
+    response = connection.getresponse()
+    body = json.loads(response.read() or b"null")
+    connection.close()
+    return response.status, body
+
+
+def wait_workers(port: int, workers: int, timeout: float = 30.0):
+    """Wait until every worker accepts connections"""
+    seen = set()
+    deadline = time.monotonic() + timeout
+    while len(seen) < workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"only {len(seen)} workers started")
+        try:
+            status, body = call(port, "GET", "/stats")
+            if status == 200:
+                seen.add(body["worker"]["index"])
+        except OSError:
+            time.sleep(0.2)
+
+
+async def send(reader, writer, path: str, body: bytes, token: str) -> int:
+    """One request over keep-alive connection, :return: http status"""
+    writer.write(b"POST %s HTTP/1.1\r\nHost: node\r\nAuthorization: %s\r\n"
+                 b"Content-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n\r\n"
+                 % (path.encode(), token.encode(), len(body)) + body)
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = re.search(rb"(?i)content-length: *(\d+)", head)
+    await reader.readexactly(int(length.group(1)) if length else 0)
+    return int(head.split(b" ", 2)[1])
+
+
+async def connection_load(port: int, token: str, duration: float,
+                          reads: float, keys: int, counters: dict):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        key = f"key{random.randrange(keys)}"
+        if random.random() < reads:
+            status = await send(reader, writer, "/get", json.dumps(
+                {"db_name": "bench", "keys": [key]}).encode(), token)
+        else:
+            status = await send(reader, writer, "/set", json.dumps(
+                {"db_name": "bench",
+                 "keys": [{"key": key, "value": "x" * 100}]}).encode(),
+                token)
+        counters["done" if status in (200, 404) else "failed"] += 1
+    writer.close()
+
+
+def client(port: int, token: str, connections: int, duration: float,
+           reads: float, keys: int):
+    """Process of client, :return: numbers of done and failed requests"""
+    counters = {"done": 0, "failed": 0}
+
+    async def load():
+        await asyncio.gather(*[
+            connection_load(port, token, duration, reads, keys, counters)
+            for _ in range(connections)])
+
+    asyncio.run(load())
+    return counters["done"], counters["failed"]
+
+
+def measure(args, workers: int) -> float:
+    """Requests per second of node with workers"""
+    data = tempfile.mkdtemp()
+    server = subprocess.Popen(
+        [sys.executable, "-c",
+         SERVER.format(root=ROOT, port=args.port, workers=workers,
+                       internal_port=args.port + 200)],
+        cwd=data, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        wait_workers(args.port, workers)
+        token = call(args.port, "POST", "/auth")[1]["api-key"]
+        for start in range(0, args.keys, 1000):
+            call(args.port, "POST", "/set",
+                 {"db_name": "bench",
+                  "keys": [{"key": f"key{i}", "value": "x" * 100}
+                           for i in range(start,
+                                          min(start + 1000, args.keys))]},
+                 token)
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.starmap(client, [
+                (args.port, token, args.connections, args.duration,
+                 args.reads, args.keys)] * args.clients)
+        done = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        if failed:
+            print(f"{failed} requests failed", file=sys.stderr)
+        return done / args.duration
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(data, ignore_errors=True)
+
+
+def main():
+    """Enter point of program"""
+    args = parse_argument()
+    print(f"{os.cpu_count()} cpus, {args.clients} client processes "
+          f"x {args.connections} connections, {args.reads:.0%} reads")
+    print(f"{'workers':>8} {'requests/s':>12} {'speedup':>8}")
+    base = None
+    for workers in args.workers:
+        rate = measure(args, workers)
+        base = base or rate
+        print(f"{workers:>8} {rate:>12.0f} {rate / base:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
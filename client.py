@@ -27,8 +27,11 @@ def parse_argument():
         --------------------------------
         commands while running:
             auth                                              authorize client
+            revoke                                            revoke api key of client
             set {[-r,--raw],[-f,--file]} db_name key={json_value}  send request to set value by key
             get {[-r,--raw],[-f,--file]} db_name key1&key2    send request get value by key
+            import db_name filename [consistency]  stream file of json lines {"key", "value"} to storage
+            scan db_name [prefix]                             print entries in order of keys
             exit                                              exit client
         '''))
     return parser.parse_args()
@@ -48,7 +51,10 @@ def main():
         conf["cluster_node_host"],
         conf["cluster_node_port"],
         with_checker=conf["with_checker"],
-        debug=conf["debug"])
+        debug=conf["debug"],
+        wire_format=conf.get("wire_format", "json"),
+        hedged_reads=conf.get("hedged_reads", False),
+        near_cache=conf.get("near_cache"))
     client.run()
 
 
@@ -45,7 +45,10 @@ class Window(QWidget):
             conf["cluster_node_port"],
             with_checker=conf["with_checker"],
             debug=conf["debug"],
-            blocking=False)
+            blocking=False,
+            wire_format=conf.get("wire_format", "json"),
+            hedged_reads=conf.get("hedged_reads", False),
+            near_cache=conf.get("near_cache"))
 
         self.connect_handlers_to_client_signals(client)
         return client
@@ -87,7 +90,8 @@ class Window(QWidget):
     def on_console(self, command: str):
         response = self.client.handle_command(command)
         if response is not None:
-            self.print_client_req_result(json.dumps(response.json(), indent=2))
+            self.print_client_req_result(json.dumps(
+                self.client.load_response(response), indent=2))
 
     def closeEvent(self, QCloseEvent):
         if hasattr(self, "client"):
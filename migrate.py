@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import sys
+
+if sys.version_info < (3, 6):
+    print('Use python >= 3.6', file=sys.stderr)
+    sys.exit(1)
+
+import os
+import argparse
+import textwrap
+
+try:
+    from storage.engine import migrate
+except Exception as e:
+    print(f"storage module is not found {str(e)}")
+    sys.exit(1)
+
+
+def parse_argument():
+    """Parsing arguments"""
+    parser = argparse.ArgumentParser(
+        prog='migrate.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+        Migration of KV storage data
+        --------------------------------
+        moves ./data/{token}/{db_name}/{key}.json files
+        to segments of log storage engine
+        '''))
+    parser.add_argument("-d", "--data", default="./data",
+                        help="data directory of node")
+    parser.add_argument("--remove", action="store_true",
+                        help="delete old files after migration")
+    return parser.parse_args()
+
+
+def main():
+    """Enter point of program"""
+    args = parse_argument()
+    if not os.path.exists(args.data):
+        print(f"data directory {args.data} not found")
+        sys.exit(1)
+    migrated = migrate(args.data, remove=args.remove)
+    print(f"migrated keys: {migrated}")
+
+
+if __name__ == '__main__':
+    main()
@@ -44,7 +44,22 @@ def main():
 
     node = Node(seed_host=config_name["seed_host"],
                 seed_port=config_name["seed_port"],
-                debug=config_name["debug"])
+                debug=config_name["debug"],
+                storage_engine=config_name.get("storage_engine", "log"),
+                wal=config_name.get("wal"),
+                cache=config_name.get("cache"),
+                replication=config_name.get("replication"),
+                hinted_handoff=config_name.get("hinted_handoff"),
+                anti_entropy=config_name.get("anti_entropy"),
+                gossip=config_name.get("gossip"),
+                tcp=config_name.get("tcp"),
+                invalidations=config_name.get("invalidations"),
+                bulk_import=config_name.get("bulk_import"),
+                scan=config_name.get("scan"),
+                bloom=config_name.get("bloom"),
+                snapshot=config_name.get("snapshot"),
+                auth=config_name.get("auth"),
+                workers=config_name.get("workers"))
 
     node.run(host=config_name["server_host"],
              port=config_name["server_port"],
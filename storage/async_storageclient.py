@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+import time
+import asyncio
+import threading
+from requests_async import ConnectionError
+from storage.peer_pool import PeerPool
+from storage.hash_ring import HashRing
+from storage.node_health import NodeHealth
+from storage import wire
+
+
+class AsyncStorageClient:
+    """
+    Asyncio client of storage: keep-alive sessions to cluster nodes,
+    keys of one call are split into batches by node which owns them
+    and batches are sent concurrently
+    """
+
+    def __init__(self, serv_host, serv_port, api_key: str = None,
+                 batch_size: int = 100, max_connections: int = 16,
+                 timeout: float = 10.0, wire_format: str = "json",
+                 routing: bool = True, hedged_reads: bool = False):
+        """
+        :param api_key: token of client, it can be taken later by auth()
+        :param batch_size: max number of keys in one request
+        :param max_connections: max number of requests in flight to one node
+        :param timeout: seconds to wait for answer of node
+        :param wire_format: json or msgpack
+        :param routing: send keys directly to their replicas
+                        using partition map of cluster
+        :param hedged_reads: send read to the next node too if the first
+                             one does not answer in its p95 latency
+        """
+        self.cluster_node_address = f"http://{serv_host}:{serv_port}"
+        self.cluster_nodes = {self.cluster_node_address}
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.content_type = wire.content_type(wire_format)
+        self.peers = PeerPool(max_connections, self.content_type)
+        self.routing = routing
+        self.ring = None
+        self.replication_factor = 1
+        self.ring_is_stale = True
+        self.hedged_reads = hedged_reads
+        self.health = NodeHealth()
+
+    async def timed_request(self, method: str, node: str, path: str,
+                            **kwargs):
+        """
+        Send request to node and update its health statistics
+        :return: response or None if node did not answer
+        """
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                self.peers.request(method, node, path, **kwargs),
+                self.timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            self.health.failure(node)
+            return None
+        if response.status_code >= 500:
+            self.health.failure(node)
+        else:
+            self.health.success(node, time.monotonic() - started)
+        return response
+
+    async def hedged_request(self, method: str, nodes: list, path: str,
+                             **kwargs):
+        """
+        Send request to the first node and, if it does not answer
+        in its p95 latency, to the second node too
+        :return: the first response or None and number of tried nodes
+        """
+        loop = asyncio.get_event_loop()
+        tasks = [loop.create_task(
+            self.timed_request(method, nodes[0], path, **kwargs))]
+        done, _ = await asyncio.wait(
+            tasks, timeout=self.health.percentile(nodes[0]))
+        if not done:
+            tasks.append(loop.create_task(
+                self.timed_request(method, nodes[1], path, **kwargs)))
+
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result() is not None:
+                        return task.result(), len(tasks)
+            return None, len(tasks)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def send_request(self, method: str, path: str, data=None,
+                           with_auth: bool = True, nodes: list = None,
+                           hedge: bool = False):
+        """
+        Send request to the first node which answers,
+        nodes are tried from the fastest healthy one
+        :param nodes: nodes to try before other nodes of cluster
+        :param hedge: request is read which can be sent to two nodes
+        :return: response or None if no servers are available
+        """
+        headers = {"Accept": self.content_type}
+        if with_auth:
+            headers["Authorization"] = self.api_key
+        kwargs = {"headers": headers}
+        if data is not None:
+            kwargs["json"] = data
+        nodes = list(nodes or [])
+        nodes += self.health.order(node for node in self.cluster_nodes
+                                   if node not in nodes)
+        if hedge and len(nodes) > 1:
+            response, tried = await self.hedged_request(method, nodes, path,
+                                                        **kwargs)
+            if response is not None:
+                return response
+            nodes = nodes[tried:]
+        for node in nodes:
+            response = await self.timed_request(method, node, path, **kwargs)
+            if response is not None:
+                return response
+        return None
+
+    async def auth(self):
+        """Take new api-key from cluster"""
+        response = await self.send_request("POST", "/auth", with_auth=False)
+        if response is None:
+            return None
+        self.api_key = wire.response_data(response)["api-key"]
+        return self.api_key
+
+    async def cluster_info(self):
+        """Update addresses of cluster nodes"""
+        response = await self.send_request("GET", "/clusterinfo",
+                                           with_auth=False)
+        if response is None:
+            return None
+        self.cluster_nodes.update(wire.response_data(response)["addresses"])
+        return self.cluster_nodes
+
+    async def check_nodes(self):
+        """Update addresses and health statistics of every node"""
+        await self.cluster_info()
+        await asyncio.gather(
+            *[self.timed_request("GET", node, "/clusterinfo")
+              for node in list(self.cluster_nodes)])
+        return self.health.stats()
+
+    async def partition_map(self):
+        """Download hash ring of cluster"""
+        self.ring_is_stale = False
+        response = await self.send_request("GET", "/partitionmap",
+                                           with_auth=False)
+        if response is None or response.status_code != 200:
+            return None
+        data = wire.response_data(response)
+        self.ring = HashRing(data["nodes"], data["vnodes"])
+        self.replication_factor = data["replication_factor"]
+        self.cluster_nodes.update(data["nodes"])
+        return self.ring
+
+    def replicas(self, db_name: str, key: str):
+        """Nodes which keep key according to known partition map"""
+        if self.ring is None:
+            return []
+        return self.ring.preference_list(
+            HashRing.key_id(self.api_key, db_name, key),
+            self.replication_factor)
+
+    def route(self, db_name: str, items: list, key_of):
+        """
+        Split items into batches by the fastest healthy replicas of their keys
+        :param key_of: function which returns key of item
+        :return: list of two preferred nodes (empty if they are unknown)
+                 and batch
+        """
+        groups = {}
+        for item in items:
+            replicas = self.health.order(self.replicas(db_name,
+                                                       key_of(item)))
+            # the second replica takes hedged and retried requests
+            groups.setdefault(tuple(replicas[:2]), []).append(item)
+        return [(list(nodes), group[i:i + self.batch_size])
+                for nodes, group in groups.items()
+                for i in range(0, len(group), self.batch_size)]
+
+    @staticmethod
+    def path(path: str, consistency: str = None):
+        return path if consistency is None \
+            else f"{path}?consistency={consistency}"
+
+    async def send_batches(self, path: str, db_name: str, items: list,
+                           key_of, hedge: bool = False):
+        """
+        Send items to their owners concurrently,
+        other nodes are tried if owner is unreachable
+        :param hedge: batches are reads which can be sent to two nodes
+        :return: list of batch and response, None if batch was not sent
+        """
+        if self.routing and self.ring_is_stale:
+            await self.partition_map()
+        batches = self.route(db_name, items, key_of)
+        responses = await asyncio.gather(
+            *[self.send_request("POST", path,
+                                {"db_name": db_name, "keys": batch},
+                                nodes=nodes, hedge=hedge)
+              for nodes, batch in batches])
+        for response in responses:
+            if response is not None and \
+                    response.headers.get(wire.WRONG_OWNER_HEADER):
+                # cluster changed, partition map is downloaded again
+                self.ring_is_stale = True
+        return [(batch, response)
+                for (_, batch), response in zip(batches, responses)]
+
+    async def get_many(self, db_name: str, keys: list,
+                       consistency: str = None):
+        """
+        Get values of keys, batches are requested concurrently
+        :param consistency: ONE, QUORUM or ALL, default of server if None
+        :return: dict of founded entries, not_found_keys and failed_keys
+                 which were not read because of errors
+        """
+        answers = await self.send_batches(self.path("/get", consistency),
+                                          db_name, list(keys),
+                                          lambda key: key,
+                                          hedge=self.hedged_reads)
+        result = {"entries": {}, "not_found_keys": [], "failed_keys": []}
+        for batch, response in answers:
+            if response is None or response.status_code not in (200, 404):
+                result["failed_keys"].extend(batch)
+                continue
+            data = wire.response_data(response)
+            result["entries"].update(data["entries"])
+            result["not_found_keys"].extend(data["not_found_keys"])
+        return result
+
+    async def set_many(self, db_name: str, items, consistency: str = None):
+        """
+        Set values of keys, batches are sent concurrently
+        :param items: dict of key and value or list of {"key", "value"}
+        :param consistency: ONE, QUORUM or ALL, default of server if None
+        :return: dict of written keys and failed_keys
+        """
+        if isinstance(items, dict):
+            items = [{"key": key, "value": value}
+                     for key, value in items.items()]
+        answers = await self.send_batches(self.path("/set", consistency),
+                                          db_name, items,
+                                          lambda key_data: key_data["key"])
+        result = {"keys": [], "failed_keys": []}
+        for batch, response in answers:
+            keys = [key_data["key"] for key_data in batch]
+            if response is None or response.status_code != 200:
+                result["failed_keys"].extend(keys)
+            else:
+                result["keys"].extend(keys)
+        return result
+
+    async def close(self):
+        await self.peers.close()
+
+
+class SyncStorageClient:
+    """
+    Blocking wrapper of AsyncStorageClient for code without event loop:
+    client lives in event loop of background thread
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Arguments of AsyncStorageClient"""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.client = AsyncStorageClient(*args, **kwargs)
+
+    def call(self, coroutine):
+        """Run coroutine in loop of client and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def auth(self):
+        return self.call(self.client.auth())
+
+    def cluster_info(self):
+        return self.call(self.client.cluster_info())
+
+    def check_nodes(self):
+        return self.call(self.client.check_nodes())
+
+    def get_many(self, db_name: str, keys: list, consistency: str = None):
+        return self.call(self.client.get_many(db_name, keys, consistency))
+
+    def set_many(self, db_name: str, items, consistency: str = None):
+        return self.call(self.client.set_many(db_name, items, consistency))
+
+    def close(self):
+        self.call(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
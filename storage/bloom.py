@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import math
+import base64
+import hashlib
+
+
+class BloomFilter:
+    """
+    Set of keys without false negatives: key which was not added
+    is reported as present with probability about error_rate
+    while filter keeps no more than capacity keys
+    """
+
+    def __init__(self, capacity: int = 1000, error_rate: float = 0.01):
+        """
+        :param capacity: expected number of keys
+        :param error_rate: probability of false positive
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity * math.log(error_rate) /
+                              math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # double hashing: two halves of one digest make all positions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        # keys which are added again do not fill filter
+        if added:
+            self.count += 1
+
+    def __contains__(self, key: str):
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                return False
+        return True
+
+    @property
+    def full(self) -> bool:
+        """Filter keeps more keys than its capacity"""
+        return self.count > self.capacity
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "error_rate": self.error_rate,
+                "count": self.count,
+                "bits": base64.b64encode(bytes(self.bits)).decode()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        bloom = cls(data["capacity"], data["error_rate"])
+        bloom.count = data["count"]
+        bloom.bits = bytearray(base64.b64decode(data["bits"]))
+        return bloom
+
+    @classmethod
+    def union(cls, filters: list):
+        """
+        Filter of keys of all filters. Filters of different sizes
+        can not be merged, then result contains every key
+        """
+        filters = [bloom for bloom in filters if bloom is not None]
+        if not filters:
+            return None
+        first = filters[0]
+        merged = cls(first.capacity, first.error_rate)
+        merged.count = sum(bloom.count for bloom in filters)
+        if any(bloom.size != first.size or bloom.hashes != first.hashes
+               for bloom in filters):
+            merged.bits = bytearray(b"\xff" * len(merged.bits))
+            return merged
+        bits = int.from_bytes(first.bits, "big")
+        for bloom in filters[1:]:
+            bits |= int.from_bytes(bloom.bits, "big")
+        merged.bits = bytearray(bits.to_bytes(len(first.bits), "big"))
+        return merged
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import json
+import itertools
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """
+    Memory tier of NodeInfo: LRU cache of entries
+    limited by approximate size of values in bytes
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param max_bytes: memory budget, None means unlimited
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def entry_size(entry) -> int:
+        """
+        Approximate size of entry: length of key and of string value,
+        only values of other types are serialized
+        """
+        value = entry.get("value")
+        if isinstance(value, str):
+            value_size = len(value)
+        elif value is None or isinstance(value, (bool, int, float)):
+            value_size = 8
+        else:
+            value_size = len(json.dumps(value))
+        return len(entry.get("key", "")) + value_size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def get(self, token: str, db_name: str, key: str):
+        """Return entry and mark it as recently used or None if missing"""
+        item = self._entries.get((token, db_name, key))
+        if item is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((token, db_name, key))
+        self.hits += 1
+        return item[0]
+
+    def peek(self, token: str, db_name: str, key: str):
+        """Return entry without changing order and counters"""
+        item = self._entries.get((token, db_name, key))
+        return None if item is None else item[0]
+
+    def put(self, token: str, db_name: str, key: str, entry: dict):
+        item_key = (token, db_name, key)
+        size = self.entry_size(entry)
+        old = self._entries.pop(item_key, None)
+        if old is not None:
+            self.size -= old[1]
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[item_key] = (entry, size)
+        self.size += size
+        self._evict()
+
+    def pop(self, token: str, db_name: str, key: str):
+        item = self._entries.pop((token, db_name, key), None)
+        if item is None:
+            return None
+        self.size -= item[1]
+        return item[0]
+
+    def hot_keys(self, limit: int = None) -> list:
+        """[token, db_name, key] of recently used entries from the hottest"""
+        return [list(item_key) for item_key in
+                itertools.islice(reversed(self._entries), limit)]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        while self.size > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
@@ -0,0 +1,881 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import heapq
+import bisect
+import struct
+import asyncio
+import threading
+from storage.bloom import BloomFilter
+
+
+# Segment layout
+# ./data/{token}/{db_name}/{segment_id:08d}.seg
+# Every record is a json line:
+# {"key": "key1", "value": "value1", "version": [wall_ms, logical, node]}\n
+#
+# Index schema
+# {"token":
+#   {"db_name":
+#       {"key1": (segment_id, offset, length, version)}
+#   }
+# }
+#
+# SSTable layout of LSMStorageEngine
+# ./data/{token}/{db_name}/{table_id:08d}.sst
+# json lines of records sorted by key, json line of metadata
+# {"index": [[key, offset], ..], "count": .., "bloom": ..}
+# and 8 bytes of offset of the metadata
+
+SEGMENT_SUFFIX = ".seg"
+SSTABLE_SUFFIX = ".sst"
+# offset of sparse index in the end of SSTable
+FOOTER = struct.Struct("!Q")
+
+
+class StorageEngine:
+    """Disk storage used by NodeInfo"""
+
+    # keys which load read from disk after snapshot by (token, db_name),
+    # None if engine was loaded without snapshot
+    scanned_keys = None
+
+    def load(self, snapshot: dict = None):
+        """
+        Prepare engine for work (read indexes etc.)
+        :param snapshot: state returned by snapshot() of previous run
+        """
+
+    def snapshot(self):
+        """State which makes the next load faster or None"""
+        return None
+
+    def write(self, token: str, db_name: str, entries: list):
+        """
+        Write entries to disk
+        :param token: user`s token
+        :param db_name: name of user`s database
+        :param entries: list of {"key": key, "value": value} dicts
+        """
+        raise NotImplementedError
+
+    def read(self, token: str, db_name: str, keys: list) -> dict:
+        """
+        Read entries from disk
+        :param token: user`s token
+        :param db_name: name of user`s database
+        :param keys: list of keys to read
+        :return: dict of founded entries
+        """
+        raise NotImplementedError
+
+    def versions(self, token: str, db_name: str, keys: list) -> dict:
+        """
+        Versions of stored entries
+        :return: dict of key and version, None for entries without version
+        """
+        return {key: entry.get("version")
+                for key, entry in self.read(token, db_name, keys).items()}
+
+    def databases(self):
+        """Iterate over (token, db_name) pairs stored on disk"""
+        raise NotImplementedError
+
+    def keys(self, token: str, db_name: str):
+        """Iterate over keys of database"""
+        raise NotImplementedError
+
+    def scan_keys(self, token: str, db_name: str, start: str = None,
+                  end: str = None, after: str = None,
+                  limit: int = None) -> list:
+        """
+        Keys of database in sorted order
+        :param start: the first key of range
+        :param end: key after the range
+        :param after: cursor, keys are greater than it
+        :param limit: max number of keys
+        """
+        return key_range(sorted(self.keys(token, db_name)),
+                         start, end, after, limit)
+
+    def sync(self):
+        """Flush written data to disk"""
+
+    def checkpoint(self):
+        """
+        Make written data durable before write-ahead log is truncated
+        :return: awaitable if data is written in background, else None
+        """
+        self.sync()
+
+    def close(self):
+        """Release opened files"""
+
+
+class FilePerKeyEngine(StorageEngine):
+    """Old layout: ./data/{token}/{db_name}/{key}.json"""
+
+    def __init__(self, root: str = "./data"):
+        self.root = root
+
+    def write(self, token, db_name, entries):
+        db_path = os.path.join(self.root, token, db_name)
+        os.makedirs(db_path, exist_ok=True)
+        for key_data in entries:
+            with open(os.path.join(db_path, f"{key_data['key']}.json"),
+                      "w") as f:
+                f.write(json.dumps(key_data))
+
+    def read(self, token, db_name, keys):
+        founded = {}
+        db_path = os.path.join(self.root, token, db_name)
+        if not os.path.isdir(db_path):
+            return founded
+        for key in keys:
+            path = os.path.join(db_path, f"{key}.json")
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    founded[key] = json.loads(f.read())
+        return founded
+
+    def databases(self):
+        if not os.path.isdir(self.root):
+            return
+        for token in sorted(os.listdir(self.root)):
+            token_path = os.path.join(self.root, token)
+            if not os.path.isdir(token_path):
+                continue
+            for db_name in sorted(os.listdir(token_path)):
+                if os.path.isdir(os.path.join(token_path, db_name)):
+                    yield token, db_name
+
+    def keys(self, token, db_name):
+        db_path = os.path.join(self.root, token, db_name)
+        if not os.path.isdir(db_path):
+            return
+        for filename in sorted(os.listdir(db_path)):
+            if filename.endswith(".json"):
+                yield filename[:-len(".json")]
+
+    def sync(self):
+        os.sync()
+
+
+class LogStorageEngine(StorageEngine):
+    """
+    Append-only engine: records of each database are appended to
+    segment files, in-memory index keeps (segment, offset, length, version)
+    of the last record of every key
+    """
+
+    def __init__(self, root: str = "./data",
+                 segment_size: int = 64 * 1024 * 1024):
+        self.root = root
+        self.segment_size = segment_size
+        self.index = {}
+        # sorted keys of databases which were scanned, new keys are
+        # appended by writes and sorted by the next scan
+        self._ordered = {}
+        self._unsorted = set()
+        self._active = {}
+        self._readers = {}
+
+    def _db_path(self, token, db_name):
+        return os.path.join(self.root, token, db_name)
+
+    def _segment_path(self, token, db_name, segment_id):
+        return os.path.join(self._db_path(token, db_name),
+                            f"{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def _segments(self, token, db_name):
+        db_path = self._db_path(token, db_name)
+        if not os.path.isdir(db_path):
+            return []
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                      for name in os.listdir(db_path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def load(self, snapshot=None):
+        """
+        Build index by scanning segments, with snapshot only records
+        which were written after it are read
+        """
+        self.index = {}
+        self._ordered = {}
+        self._unsorted = set()
+        self.scanned_keys = None if snapshot is None else {}
+        if not os.path.isdir(self.root):
+            return
+        sizes = (snapshot or {}).get("sizes", {})
+        for token, db_name in FilePerKeyEngine(self.root).databases():
+            segments = self._segments(token, db_name)
+            covered = sizes.get(token, {}).get(db_name)
+            if covered is not None and \
+                    self._covers(token, db_name, segments, covered):
+                self.index.setdefault(token, {})[db_name] = \
+                    snapshot["index"][token][db_name]
+            else:
+                covered = {}
+            for segment_id in segments:
+                keys = self._load_segment(token, db_name, segment_id,
+                                          covered.get(str(segment_id), 0))
+                if self.scanned_keys is not None and keys:
+                    self.scanned_keys.setdefault(
+                        (token, db_name), []).extend(keys)
+
+    def _covers(self, token, db_name, segments, covered):
+        """Segments still have all records which snapshot has seen"""
+        for segment_id, size in covered.items():
+            if int(segment_id) not in segments or size > os.path.getsize(
+                    self._segment_path(token, db_name, int(segment_id))):
+                return False
+        return True
+
+    def _load_segment(self, token, db_name, segment_id, offset=0):
+        """
+        Add records of segment from offset to index
+        :return: list of read keys
+        """
+        db_index = self.index.setdefault(token, {}).setdefault(db_name, {})
+        keys = []
+        path = self._segment_path(token, db_name, segment_id)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                length = len(line)
+                if not line.endswith(b"\n"):
+                    # a torn record at the end of segment is cut,
+                    # otherwise next record is appended to it
+                    os.truncate(path, offset)
+                    break
+                try:
+                    record = json.loads(line)
+                    db_index[record["key"]] = (segment_id, offset, length,
+                                               record.get("version"))
+                    keys.append(record["key"])
+                except (ValueError, KeyError):
+                    pass
+                offset += length
+        return keys
+
+    def snapshot(self):
+        """Index and sizes of segments which it describes"""
+        sizes = {}
+        for token, dbs in self.index.items():
+            for db_name in dbs:
+                sizes.setdefault(token, {})[db_name] = {
+                    str(segment_id): os.path.getsize(
+                        self._segment_path(token, db_name, segment_id))
+                    for segment_id in self._segments(token, db_name)}
+        return {"sizes": sizes, "index": self.index}
+
+    def _active_segment(self, token, db_name):
+        """Return [segment_id, fd, size] of segment opened for appending"""
+        active = self._active.get((token, db_name))
+        if active is not None and active[2] < self.segment_size:
+            return active
+        if active is not None:
+            os.close(active[1])
+            segment_id = active[0] + 1
+        else:
+            os.makedirs(self._db_path(token, db_name), exist_ok=True)
+            segments = self._segments(token, db_name)
+            segment_id = segments[-1] if segments else 0
+        path = self._segment_path(token, db_name, segment_id)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        active = [segment_id, fd, os.fstat(fd).st_size]
+        self._active[(token, db_name)] = active
+        return active
+
+    def write(self, token, db_name, entries):
+        """Append all entries by one write call"""
+        active = self._active_segment(token, db_name)
+        segment_id, fd, offset = active
+        db_index = self.index.setdefault(token, {}).setdefault(db_name, {})
+
+        chunks = []
+        positions = {}
+        for key_data in entries:
+            record = (json.dumps(key_data) + "\n").encode()
+            positions[key_data["key"]] = (segment_id, offset, len(record),
+                                          key_data.get("version"))
+            offset += len(record)
+            chunks.append(record)
+
+        ordered = self._ordered.get((token, db_name))
+        if ordered is not None:
+            added = [key for key in positions if key not in db_index]
+            if added:
+                ordered.extend(added)
+                self._unsorted.add((token, db_name))
+
+        data = b"".join(chunks)
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        active[2] = offset
+        db_index.update(positions)
+
+    def _reader(self, token, db_name, segment_id):
+        path = self._segment_path(token, db_name, segment_id)
+        fd = self._readers.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY)
+            self._readers[path] = fd
+        return fd
+
+    def read(self, token, db_name, keys):
+        founded = {}
+        db_index = self.index.get(token, {}).get(db_name)
+        if not db_index:
+            return founded
+        for key in keys:
+            position = db_index.get(key)
+            if position is None:
+                continue
+            segment_id, offset, length, _ = position
+            fd = self._reader(token, db_name, segment_id)
+            founded[key] = json.loads(os.pread(fd, length, offset))
+        return founded
+
+    def versions(self, token, db_name, keys):
+        db_index = self.index.get(token, {}).get(db_name, {})
+        return {key: db_index[key][3] for key in keys if key in db_index}
+
+    def databases(self):
+        for token, dbs in self.index.items():
+            for db_name in dbs:
+                yield token, db_name
+
+    def keys(self, token, db_name):
+        return iter(list(self.index.get(token, {}).get(db_name, {})))
+
+    def scan_keys(self, token, db_name, start=None, end=None, after=None,
+                  limit=None):
+        ordered = self._ordered.get((token, db_name))
+        if ordered is None:
+            ordered = sorted(self.index.get(token, {}).get(db_name, {}))
+            self._ordered[(token, db_name)] = ordered
+        elif (token, db_name) in self._unsorted:
+            # timsort merges sorted run with short tail of new keys
+            ordered.sort()
+        self._unsorted.discard((token, db_name))
+        return key_range(ordered, start, end, after, limit)
+
+    def sync(self):
+        for _, fd, _ in self._active.values():
+            os.fsync(fd)
+
+    def close(self):
+        for _, fd, _ in self._active.values():
+            os.close(fd)
+        for fd in self._readers.values():
+            os.close(fd)
+        self._active = {}
+        self._readers = {}
+
+
+class SSTable:
+    """
+    Immutable file of json lines sorted by key. The file ends with
+    metadata: sparse index - [key, offset] of every index_interval-th
+    record, number of records and bloom filter of keys,
+    and FOOTER with offset of the metadata
+    """
+
+    def __init__(self, path: str, index: list, data_size: int,
+                 count: int = 0, bloom: BloomFilter = None):
+        self.path = path
+        self.index_keys = [key for key, _ in index]
+        self.index_offsets = [offset for _, offset in index]
+        self.data_size = data_size
+        self.count = count
+        self.bloom = bloom
+        self._fd = None
+
+    @classmethod
+    def write(cls, path: str, entries, index_interval: int = 64,
+              expected: int = 1000, error_rate: float = 0.01):
+        """
+        Write sorted entries to new table, file appears by rename
+        :param entries: iterable of entries in order of keys
+        :param expected: number of entries for size of bloom filter
+        :param error_rate: false positive rate of bloom filter
+        """
+        tmp_path = path + ".tmp"
+        bloom = BloomFilter(expected, error_rate)
+        index = []
+        offset = 0
+        count = 0
+        with open(tmp_path, "wb") as f:
+            for count, entry in enumerate(entries, 1):
+                if (count - 1) % index_interval == 0:
+                    index.append([entry["key"], offset])
+                bloom.add(entry["key"])
+                record = (json.dumps(entry) + "\n").encode()
+                f.write(record)
+                offset += len(record)
+            meta = {"index": index, "count": count, "bloom": bloom.to_dict()}
+            f.write((json.dumps(meta) + "\n").encode())
+            f.write(FOOTER.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+        return cls(path, index, offset, count, bloom)
+
+    @classmethod
+    def open(cls, path: str):
+        with open(path, "rb") as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            footer_offset = f.tell()
+            data_size, = FOOTER.unpack(f.read(FOOTER.size))
+            f.seek(data_size)
+            meta = json.loads(f.read(footer_offset - data_size))
+        return cls(path, meta["index"], data_size, meta["count"],
+                   BloomFilter.from_dict(meta["bloom"]))
+
+    def _reader(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        return self._fd
+
+    def get(self, key: str):
+        """
+        Entry of key or None, only one block of index_interval is read
+        if bloom filter does not tell that key is absent
+        """
+        if self.bloom is not None and key not in self.bloom:
+            return None
+        block = bisect.bisect_right(self.index_keys, key) - 1
+        if block < 0:
+            return None
+        start = self.index_offsets[block]
+        end = self.index_offsets[block + 1] \
+            if block + 1 < len(self.index_offsets) else self.data_size
+        for line in os.pread(self._reader(), end - start, start).splitlines():
+            entry = json.loads(line)
+            if entry["key"] == key:
+                return entry
+            if entry["key"] > key:
+                return None
+        return None
+
+    def entries(self, start: str = None):
+        """Iterate over entries with keys from start in order"""
+        block = 0 if start is None \
+            else max(bisect.bisect_right(self.index_keys, start) - 1, 0)
+        if not self.index_offsets:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.index_offsets[block])
+            offset = self.index_offsets[block]
+            for line in f:
+                if offset >= self.data_size:
+                    return
+                offset += len(line)
+                entry = json.loads(line)
+                if start is None or entry["key"] >= start:
+                    yield entry
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MemtableFlush:
+    """
+    Memtables which are being written to tables,
+    reads use them until the tables are added to engine
+    """
+
+    def __init__(self, memtables: dict, paths: dict):
+        self.memtables = memtables
+        self.paths = paths
+        self.tables = None
+        self.error = None
+        self.future = None
+        self.written = threading.Event()
+
+
+class LSMStorageEngine(StorageEngine):
+    """
+    Log-structured merge tree: entries are written to memtable, which is
+    flushed to immutable SSTables of databases when it grows over
+    memtable_size or on sync. Reads check memtable, memtables which are
+    being flushed and then tables from the newest one. Tables are written
+    and merged (size-tiered compaction, when database has
+    compaction_threshold tables) in executor of event loop
+    """
+
+    def __init__(self, root: str = "./data",
+                 memtable_size: int = 4 * 1024 * 1024,
+                 index_interval: int = 64,
+                 compaction_threshold: int = 4):
+        self.root = root
+        self.memtable_size = memtable_size
+        self.index_interval = index_interval
+        self.compaction_threshold = compaction_threshold
+        self.memtables = {}
+        self.memtable_bytes = 0
+        # tables of (token, db_name) from the oldest one
+        self.tables = {}
+        self.compactions = 0
+        self._compacting = set()
+        self._next_id = {}
+        # MemtableFlush from the oldest one, tables are added in this order
+        self._flushing = []
+        self._lock = threading.Lock()
+    def _db_path(self, token, db_name):
+        return os.path.join(self.root, token, db_name)
+
+    def load(self, snapshot=None):
+        self.tables = {}
+        self._next_id = {}
+        for token, db_name in FilePerKeyEngine(self.root).databases():
+            db_path = self._db_path(token, db_name)
+            ids = []
+            for name in os.listdir(db_path):
+                if SSTABLE_SUFFIX + "." in name:
+                    # table which was not finished before crash
+                    os.remove(os.path.join(db_path, name))
+                elif name.endswith(SSTABLE_SUFFIX):
+                    ids.append(int(name[:-len(SSTABLE_SUFFIX)]))
+            if ids:
+                self.tables[(token, db_name)] = [
+                    SSTable.open(self._table_path(token, db_name, table_id))
+                    for table_id in sorted(ids)]
+                self._next_id[(token, db_name)] = max(ids) + 1
+
+    def _table_path(self, token, db_name, table_id):
+        return os.path.join(self._db_path(token, db_name),
+                            f"{table_id:08d}{SSTABLE_SUFFIX}")
+
+    def write(self, token, db_name, entries):
+        memtable = self.memtables.setdefault((token, db_name), {})
+        for key_data in entries:
+            memtable[key_data["key"]] = key_data
+            self.memtable_bytes += len(key_data["key"]) + \
+                len(json.dumps(key_data.get("value")))
+        if self.memtable_bytes >= self.memtable_size:
+            self.flush()
+
+    def flush(self, compact: bool = True):
+        """
+        Write memtables to new tables, in executor if event loop runs
+        """
+        flush = self._swap()
+        if flush is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_tables(flush)
+            if flush.error is not None:
+                raise flush.error
+            self._install_flushed(compact)
+            return
+        self._start(loop, flush, compact)
+
+    def _swap(self):
+        """Make memtables immutable, :return: MemtableFlush or None"""
+        if not self.memtables:
+            return None
+        memtables, self.memtables = self.memtables, {}
+        self.memtable_bytes = 0
+        paths = {}
+        for token, db_name in memtables:
+            table_id = self._next_id.get((token, db_name), 0)
+            self._next_id[(token, db_name)] = table_id + 1
+            paths[(token, db_name)] = self._table_path(token, db_name,
+                                                       table_id)
+        flush = MemtableFlush(memtables, paths)
+        self._flushing.append(flush)
+        return flush
+
+    def _start(self, loop, flush: MemtableFlush, compact: bool):
+        if flush not in self._flushing:
+            # it was written by sync meanwhile
+            return
+        flush.written.clear()
+        flush.future = loop.run_in_executor(None, self._write_tables, flush)
+        flush.future.add_done_callback(
+            lambda done: self._flushed(loop, flush, compact))
+
+    def _flushed(self, loop, flush: MemtableFlush, compact: bool):
+        if flush.error is not None:
+            print(f"flush of memtables failed: {flush.error}")
+            loop.call_later(1.0, self._start, loop, flush, compact)
+            return
+        self._install_flushed(compact)
+
+    def _write_tables(self, flush: MemtableFlush):
+        try:
+            tables = {}
+            for (token, db_name), memtable in flush.memtables.items():
+                os.makedirs(self._db_path(token, db_name), exist_ok=True)
+                tables[(token, db_name)] = SSTable.write(
+                    flush.paths[(token, db_name)],
+                    (memtable[key] for key in sorted(memtable)),
+                    self.index_interval, len(memtable))
+            flush.tables, flush.error = tables, None
+        except OSError as err:
+            flush.error = err
+        finally:
+            flush.written.set()
+
+    def _install_flushed(self, compact: bool = True):
+        """Add written tables, a flush waits for all older ones"""
+        installed = []
+        with self._lock:
+            while self._flushing and self._flushing[0].tables is not None:
+                flush = self._flushing.pop(0)
+                for key, table in flush.tables.items():
+                    self.tables.setdefault(key, []).append(table)
+                installed.extend(flush.tables)
+        if compact:
+            for token, db_name in installed:
+                self.compact_if_needed(token, db_name)
+
+    def _flush_all(self, compact: bool = True):
+        """Write memtables and wait for tables which are being written"""
+        flush = self._swap()
+        if flush is not None:
+            self._write_tables(flush)
+        for flush in list(self._flushing):
+            flush.written.wait()
+            if flush.error is not None:
+                flush.written.clear()
+                self._write_tables(flush)
+                if flush.error is not None:
+                    raise flush.error
+        self._install_flushed(compact)
+
+    def checkpoint(self):
+        self.flush()
+        return self.flushed()
+
+    async def flushed(self):
+        """Wait until tables of all flushed memtables are added"""
+        for flush in list(self._flushing):
+            while flush in self._flushing:
+                if flush.future is None or flush.future.done():
+                    # failed write is started again later
+                    await asyncio.sleep(0.1)
+                else:
+                    await asyncio.wait([flush.future])
+                    # done callback adds tables
+                    await asyncio.sleep(0)
+
+    def compact_if_needed(self, token, db_name):
+        """Merge tables of database in executor if there are too many"""
+        tables = list(self.tables.get((token, db_name), []))
+        if len(tables) < self.compaction_threshold or \
+                (token, db_name) in self._compacting:
+            return
+        self._compacting.add((token, db_name))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._install(token, db_name, tables,
+                          self._merge(token, db_name, tables))
+            return
+        future = loop.run_in_executor(None, self._merge, token, db_name,
+                                      tables)
+        future.add_done_callback(
+            lambda done: self._compacted(token, db_name, tables, done))
+
+    def _compacted(self, token, db_name, tables, future):
+        if future.exception() is not None:
+            self._compacting.discard((token, db_name))
+            print(f"compaction of {db_name} failed: {future.exception()}")
+            return
+        self._install(token, db_name, tables, future.result())
+
+    def _merge(self, token, db_name, tables):
+        """
+        Merge tables into one, it takes place of the newest of them,
+        so tables flushed during compaction stay newer after restart
+        """
+        # the newest entry of key goes first
+        streams = [tagged_entries(table, -number)
+                   for number, table in enumerate(tables)]
+        entries = (entry for key, _, entry in
+                   unique_keys(heapq.merge(*streams,
+                                           key=lambda item: item[:2])))
+        path = tables[-1].path
+        return SSTable.write(path + ".merged", entries, self.index_interval,
+                             sum(table.count for table in tables))
+
+    def _install(self, token, db_name, compacted, merged):
+        self._compacting.discard((token, db_name))
+        tables = self.tables.get((token, db_name), [])
+        if tables[:len(compacted)] != compacted:
+            # engine was reloaded or closed during compaction
+            merged.remove()
+            return
+        os.rename(merged.path, compacted[-1].path)
+        merged.path = compacted[-1].path
+        for table in compacted[:-1]:
+            table.remove()
+        compacted[-1].close()
+        self.tables[(token, db_name)] = [merged] + tables[len(compacted):]
+        self.compactions += 1
+
+    def _memtables(self, token, db_name) -> list:
+        """Memtable and memtables which are being flushed, the newest first"""
+        memtables = [self.memtables.get((token, db_name), {})]
+        for flush in reversed(self._flushing):
+            memtable = flush.memtables.get((token, db_name))
+            if memtable is not None:
+                memtables.append(memtable)
+        return memtables
+
+    def read(self, token, db_name, keys):
+        founded = {}
+        memtables = self._memtables(token, db_name)
+        tables = self.tables.get((token, db_name), [])
+        for key in keys:
+            entry = None
+            for memtable in memtables:
+                entry = memtable.get(key)
+                if entry is not None:
+                    break
+            for table in reversed(tables):
+                if entry is not None:
+                    break
+                entry = table.get(key)
+            if entry is not None:
+                founded[key] = entry
+        return founded
+
+    def databases(self):
+        flushing = {key for flush in self._flushing for key in flush.memtables}
+        for token, db_name in sorted(set(self.tables) | set(self.memtables)
+                                     | flushing):
+            yield token, db_name
+
+    def keys(self, token, db_name):
+        return iter(self.scan_keys(token, db_name))
+
+    def scan_keys(self, token, db_name, start=None, end=None, after=None,
+                  limit=None):
+        if after is not None and (start is None or after >= start):
+            start = after
+        streams = [[key for key in sorted(memtable)
+                    if start is None or key >= start]
+                   for memtable in self._memtables(token, db_name)]
+        for table in self.tables.get((token, db_name), []):
+            streams.append(entry["key"] for entry in table.entries(start))
+        keys = []
+        for key in heapq.merge(*streams):
+            if keys and keys[-1] == key or key == after:
+                continue
+            if end is not None and key >= end or \
+                    limit is not None and len(keys) >= limit:
+                break
+            keys.append(key)
+        return keys
+
+    def sync(self):
+        self._flush_all()
+
+    def close(self):
+        self._flush_all(compact=False)
+        for tables in self.tables.values():
+            for table in tables:
+                table.close()
+        self.tables = {}
+
+
+def tagged_entries(table: SSTable, tag: int):
+    """(key, tag, entry) of every entry of table"""
+    for entry in table.entries():
+        yield entry["key"], tag, entry
+
+
+def unique_keys(items):
+    """Skip items with key which is equal to key of previous item"""
+    previous = None
+    for item in items:
+        if item[0] != previous:
+            previous = item[0]
+            yield item
+
+
+def key_range(ordered: list, start: str = None, end: str = None,
+              after: str = None, limit: int = None) -> list:
+    """Keys of sorted list in range [start, end) which are after cursor"""
+    low = 0 if start is None else bisect.bisect_left(ordered, start)
+    if after is not None:
+        low = max(low, bisect.bisect_right(ordered, after))
+    high = len(ordered) if end is None else bisect.bisect_left(ordered, end)
+    if limit is not None:
+        high = min(high, low + limit)
+    return ordered[low:high]
+
+
+def prefix_range(prefix: str):
+    """(start, end) of range of keys which start with prefix"""
+    if not prefix:
+        return None, None
+    end = prefix.rstrip(chr(sys.maxunicode))
+    if not end:
+        return prefix, None
+    return prefix, end[:-1] + chr(ord(end[-1]) + 1)
+
+
+ENGINES = {"log": LogStorageEngine,
+           "lsm": LSMStorageEngine,
+           "file": FilePerKeyEngine}
+
+
+def create_engine(name: str = "log", root: str = "./data",
+                  snapshot: dict = None, **kwargs):
+    """
+    Make storage engine by its name from server settings
+    :param snapshot: state of engine saved by previous run
+    """
+    if name not in ENGINES:
+        raise ValueError(f"unknown storage engine: {name}")
+    engine = ENGINES[name](root, **kwargs)
+    engine.load(snapshot)
+    return engine
+
+
+def migrate(root: str = "./data", remove: bool = False,
+            batch_size: int = 1000):
+    """
+    Move data from file-per-key layout to segments of LogStorageEngine
+    :param root: data directory
+    :param remove: delete old {key}.json files after migration
+    :param batch_size: number of keys per one append
+    :return: number of migrated keys
+    """
+    source = FilePerKeyEngine(root)
+    target = create_engine("log", root)
+    migrated = 0
+    try:
+        for token, db_name in list(source.databases()):
+            keys = list(source.keys(token, db_name))
+            for i in range(0, len(keys), batch_size):
+                batch = keys[i:i + batch_size]
+                entries = source.read(token, db_name, batch)
+                target.write(token, db_name,
+                             [entries[key] for key in batch])
+                migrated += len(batch)
+        target.sync()
+    finally:
+        target.close()
+
+    if remove:
+        for token, db_name in list(source.databases()):
+            for key in list(source.keys(token, db_name)):
+                os.remove(os.path.join(root, token, db_name, f"{key}.json"))
+    return migrated
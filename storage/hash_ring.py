@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import bisect
+import hashlib
+
+
+class HashRing:
+    """
+    Consistent hashing ring: every node owns several virtual nodes,
+    key belongs to the first nodes met clockwise from hash of the key
+    """
+
+    def __init__(self, nodes=(), vnodes: int = 64):
+        """
+        :param nodes: urls of nodes
+        :param vnodes: number of virtual nodes of each node
+        """
+        self.vnodes = vnodes
+        self.nodes = set()
+        self._hashes = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    @staticmethod
+    def key_id(token: str, db_name: str, key: str) -> str:
+        """Position of user`s key on the ring"""
+        return f"{token}/{db_name}/{key}"
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = self.hash(f"{node}#{i}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        points = [(point, owner)
+                  for point, owner in zip(self._hashes, self._owners)
+                  if owner != node]
+        self._hashes = [point for point, _ in points]
+        self._owners = [owner for _, owner in points]
+
+    def update(self, nodes):
+        """Make ring consist of given nodes"""
+        nodes = set(nodes)
+        for node in self.nodes - nodes:
+            self.remove(node)
+        for node in nodes - self.nodes:
+            self.add(node)
+
+    def preference_list(self, key: str, n: int) -> list:
+        """
+        Nodes which keep replicas of key
+        :param key: position of key (see key_id)
+        :param n: replication factor
+        :return: list of at most n different nodes
+        """
+        replicas = []
+        if not self._hashes:
+            return replicas
+        n = min(n, len(self.nodes))
+        start = bisect.bisect(self._hashes, self.hash(key))
+        for i in range(len(self._owners)):
+            owner = self._owners[(start + i) % len(self._owners)]
+            if owner not in replicas:
+                replicas.append(owner)
+                if len(replicas) == n:
+                    break
+        return replicas
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import os
+import json
+import asyncio
+from urllib.parse import quote, unquote
+
+
+# Hints of each node are stored in ./data/hints/{quoted node url}.log
+# Every hint is a json line: {"token": .., "db_name": .., "keys": [..]}
+# {quoted node url}.offset keeps position of the first undelivered hint
+
+class HintQueue:
+    """
+    Writes which were not delivered to unreachable nodes:
+    hints of concurrent requests are written to file of node
+    by one write call followed by one fsync outside of event loop
+    """
+
+    def __init__(self, root: str = "./data/hints",
+                 max_bytes: int = 64 * 1024 * 1024,
+                 batch_size: int = 100,
+                 replay_rate: int = 1000,
+                 interval: float = 5.0):
+        """
+        :param root: directory of hint files
+        :param max_bytes: max size of hints of one node,
+                          hints over the limit are dropped
+        :param batch_size: number of hints sent by one request
+        :param replay_rate: max number of hints sent per second
+        :param interval: seconds between attempts to deliver hints
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.replay_rate = replay_rate
+        self.interval = interval
+        self.dropped = 0
+        self.commits = 0
+        # node -> [(record, future)] waiting for the next group
+        self._pending = {}
+        # nodes of the group which is being written
+        self._writing = set()
+        self._committer = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, node, suffix=".log"):
+        return os.path.join(self.root, quote(node, safe="") + suffix)
+
+    async def add(self, node: str, token: str, db_name: str, keys: list):
+        """
+        Save write for node, wait until it is durable
+        :return: False if hints of node are over the limit
+        """
+        path = self._path(node)
+        record = (json.dumps({"token": token, "db_name": db_name,
+                              "keys": keys}) + "\n").encode()
+        pending = self._pending.setdefault(node, [])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        size += sum(len(data) for data, _ in pending)
+        if size + len(record) > self.max_bytes:
+            if not pending:
+                del self._pending[node]
+            self.dropped += 1
+            return False
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        pending.append((record, future))
+        if self._committer is None or self._committer.done():
+            self._committer = loop.create_task(self._commit_loop())
+        await future
+        return True
+
+    async def _commit_loop(self):
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            # let concurrent requests join the group
+            await asyncio.sleep(0)
+            groups, self._pending = self._pending, {}
+            self._writing = set(groups)
+            for node, group in groups.items():
+                data = b"".join(record for record, _ in group)
+                try:
+                    await loop.run_in_executor(None, self._write,
+                                               self._path(node), data)
+                except Exception as err:
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(err)
+                    continue
+                for _, future in group:
+                    if not future.done():
+                        future.set_result(None)
+            self._writing = set()
+
+    def _write(self, path: str, data: bytes):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.commits += 1
+
+    def nodes(self):
+        """Nodes with undelivered hints"""
+        return [unquote(name[:-len(".log")])
+                for name in os.listdir(self.root) if name.endswith(".log")]
+
+    def _offset(self, node):
+        path = self._path(node, ".offset")
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            return int(f.read() or 0)
+
+    def read(self, node: str):
+        """
+        Next batch of hints of node
+        :return: list of hints and position after the batch
+        """
+        hints = []
+        offset = self._offset(node)
+        path = self._path(node)
+        if not os.path.exists(path):
+            return hints, offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                hints.append(json.loads(line))
+                if len(hints) == self.batch_size:
+                    break
+        return hints, offset
+
+    def commit(self, node: str, offset: int):
+        """Mark hints before offset as delivered"""
+        path = self._path(node)
+        # file which is being appended is not removed
+        busy = node in self._pending or node in self._writing
+        if not busy and (not os.path.exists(path)
+                         or offset >= os.path.getsize(path)):
+            if os.path.exists(path):
+                os.remove(path)
+            if os.path.exists(self._path(node, ".offset")):
+                os.remove(self._path(node, ".offset"))
+            return
+        with open(self._path(node, ".offset"), "w") as f:
+            f.write(str(offset))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import time
+
+
+class HybridLogicalClock:
+    """
+    Hybrid logical clock: versions are [wall_ms, logical, node_id],
+    they are close to physical time, never go back and
+    are ordered by python comparison of lists
+    """
+
+    def __init__(self, node_id: str = "", max_drift_ms: int = 60000):
+        """
+        :param node_id: id of node in versions
+        :param max_drift_ms: versions which are ahead of physical time
+                             more than max_drift_ms are not accepted
+        """
+        self.node_id = node_id
+        self.max_drift_ms = max_drift_ms
+        self.wall = 0
+        self.logical = 0
+
+    @staticmethod
+    def physical_time():
+        return int(time.time() * 1000)
+
+    def now(self) -> list:
+        """Version for local event"""
+        physical = self.physical_time()
+        if physical > self.wall:
+            self.wall = physical
+            self.logical = 0
+        else:
+            self.logical += 1
+        return [self.wall, self.logical, self.node_id]
+
+    def drifted(self, version: list) -> bool:
+        """Version is too far ahead of physical time"""
+        return version[0] - self.physical_time() > self.max_drift_ms
+
+    def update(self, version: list):
+        """Move clock forward after receiving version from other node"""
+        wall, logical = version[0], version[1]
+        physical = self.physical_time()
+        if wall - physical > self.max_drift_ms:
+            raise ValueError(f"version {version} is ahead of clock "
+                             f"more than {self.max_drift_ms} ms")
+        if physical > self.wall and physical > wall:
+            self.wall = physical
+            self.logical = 0
+        elif wall > self.wall:
+            self.wall = wall
+            self.logical = logical + 1
+        elif wall == self.wall:
+            self.logical = max(self.logical, logical) + 1
+        else:
+            self.logical += 1
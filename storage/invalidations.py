@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import uuid
+import asyncio
+import itertools
+from collections import deque
+
+
+class InvalidationLog:
+    """
+    Recently written keys, clients remove them from their near caches.
+    Clients wait for new records by long polling
+    """
+
+    def __init__(self, max_size: int = 100000):
+        """
+        :param max_size: number of kept records, client which
+                         fell behind them has to clear its cache
+        """
+        self.max_size = max_size
+        # records of previous run of node are lost
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.records = deque(maxlen=max_size)
+        self._changed = None
+
+    def add(self, token: str, db_name: str, keys: list):
+        for key in keys:
+            self.seq += 1
+            self.records.append((self.seq, token, db_name, key))
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def since(self, token: str, epoch: str, seq: int):
+        """
+        Keys of token written after seq
+        :return: dict of last seq, epoch and list of [db_name, key],
+                 reset is True if records after seq are lost
+        """
+        answer = {"seq": self.seq, "epoch": self.epoch}
+        first = self.records[0][0] if self.records else self.seq + 1
+        if epoch != self.epoch or seq > self.seq or seq + 1 < first:
+            answer["reset"] = True
+            return answer
+        # seqs of records go one by one
+        records = itertools.islice(self.records, seq + 1 - first, None)
+        answer["keys"] = [[db_name, key]
+                          for _, record_token, db_name, key in records
+                          if record_token == token]
+        return answer
+
+    async def wait(self, token: str, epoch: str, seq: int,
+                   timeout: float = 30.0):
+        """Wait for keys written after seq at most timeout seconds"""
+        if epoch == self.epoch and seq == self.seq:
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(token, epoch, seq)
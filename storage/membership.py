@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import math
+import time
+import random
+
+
+ALIVE = "alive"
+SUSPECT = "suspect"
+DEAD = "dead"
+
+
+# Update schema
+# {"node": "http://host:port", "state": "alive", "incarnation": 0}
+
+class Membership:
+    """
+    SWIM membership: states of cluster nodes and updates about them
+    which are piggybacked on ping messages
+    """
+
+    def __init__(self, self_url: str = None,
+                 suspect_timeout: float = 5.0,
+                 on_change=None):
+        """
+        :param self_url: url of this node
+        :param suspect_timeout: seconds before suspected node is dead
+        :param on_change: callback(node, state) called when state changes
+        """
+        self.self_url = self_url
+        self.suspect_timeout = suspect_timeout
+        self.on_change = on_change
+        self.incarnation = 0
+        self.members = {}
+        self._updates = {}
+        self._probe_order = []
+
+    def state(self, node: str):
+        member = self.members.get(node)
+        return None if member is None else member["state"]
+
+    def live_nodes(self) -> set:
+        return {node for node, member in self.members.items()
+                if member["state"] != DEAD}
+
+    def _set(self, node, state, incarnation):
+        member = self.members.get(node)
+        changed = member is None or member["state"] != state
+        self.members[node] = {"state": state, "incarnation": incarnation,
+                              "since": time.monotonic()}
+        self._updates[node] = 0
+        if changed and self.on_change is not None:
+            self.on_change(node, state)
+
+    def join(self, node: str):
+        """Node was added explicitly (by /mkcluster)"""
+        if node == self.self_url:
+            return
+        member = self.members.get(node)
+        if member is None:
+            self._set(node, ALIVE, 0)
+        elif member["state"] == DEAD:
+            self._set(node, ALIVE, member["incarnation"] + 1)
+
+    def alive(self, node: str):
+        """Node answered to ping"""
+        member = self.members.get(node)
+        if member is None:
+            self._set(node, ALIVE, 0)
+        elif member["state"] == SUSPECT:
+            self._set(node, ALIVE, member["incarnation"])
+
+    def suspect(self, node: str):
+        """Node did not answer to direct and indirect pings"""
+        member = self.members.get(node)
+        if member is not None and member["state"] == ALIVE:
+            self._set(node, SUSPECT, member["incarnation"])
+
+    def expire_suspects(self):
+        """Declare dead nodes which were suspected too long"""
+        now = time.monotonic()
+        for node, member in list(self.members.items()):
+            if member["state"] == SUSPECT and \
+                    now - member["since"] > self.suspect_timeout:
+                self._set(node, DEAD, member["incarnation"])
+
+    def apply(self, updates: list):
+        """Apply updates received from other node"""
+        for update in updates:
+            node = update["node"]
+            state = update["state"]
+            incarnation = update["incarnation"]
+            if node == self.self_url:
+                if state != ALIVE and incarnation >= self.incarnation:
+                    # refute suspicion about this node
+                    self.incarnation = incarnation + 1
+                    self._updates[node] = 0
+                continue
+
+            member = self.members.get(node)
+            if member is None:
+                if state != DEAD:
+                    self._set(node, state, incarnation)
+                continue
+            current = member["incarnation"]
+            if state == ALIVE:
+                overrides = incarnation > current
+            elif state == SUSPECT:
+                overrides = incarnation > current or \
+                    (incarnation == current and member["state"] == ALIVE)
+            else:
+                overrides = incarnation >= current and \
+                    member["state"] != DEAD
+            if overrides:
+                self._set(node, state, incarnation)
+
+    def updates(self, limit: int = 8) -> list:
+        """
+        Updates to piggyback on next message, every update is sent
+        about 3 * log(N) times
+        """
+        retransmits = 3 * math.ceil(math.log2(len(self.members) + 2))
+        result = []
+        for node, sent in sorted(self._updates.items(), key=lambda i: i[1]):
+            if len(result) == limit:
+                break
+            if node == self.self_url:
+                result.append({"node": node, "state": ALIVE,
+                               "incarnation": self.incarnation})
+            else:
+                member = self.members[node]
+                result.append({"node": node, "state": member["state"],
+                               "incarnation": member["incarnation"]})
+            if sent + 1 >= retransmits:
+                del self._updates[node]
+            else:
+                self._updates[node] = sent + 1
+        return result
+
+    def self_update(self) -> dict:
+        return {"node": self.self_url, "state": ALIVE,
+                "incarnation": self.incarnation}
+
+    def next_target(self):
+        """Next node to ping: round robin over shuffled live nodes"""
+        while self._probe_order:
+            node = self._probe_order.pop()
+            if self.state(node) in (ALIVE, SUSPECT):
+                return node
+        self._probe_order = list(self.live_nodes())
+        random.shuffle(self._probe_order)
+        return self._probe_order.pop() if self._probe_order else None
+
+    def helpers(self, target: str, count: int) -> list:
+        """Random live nodes to ask for indirect ping of target"""
+        candidates = [node for node, member in self.members.items()
+                      if member["state"] == ALIVE and node != target]
+        return random.sample(candidates, min(count, len(candidates)))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import json
+import hashlib
+
+
+class MerkleTree:
+    """
+    Merkle tree over fixed number of hash buckets:
+    leaf is xor of digests of (key, version) of keys in the bucket,
+    so it is updated in O(1) when key is written
+    """
+
+    def __init__(self, depth: int = 10):
+        """
+        :param depth: tree has 2 ** depth leaves
+        """
+        self.depth = depth
+        self.leaves = [0] * (1 << depth)
+
+    @staticmethod
+    def digest(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def bucket(self, key: str) -> int:
+        return self.digest(key) & (len(self.leaves) - 1)
+
+    def _toggle(self, key: str, version):
+        self.leaves[self.bucket(key)] ^= self.digest(
+            f"{key}\0{json.dumps(version)}")
+
+    def add(self, key: str, version):
+        self._toggle(key, version)
+
+    def remove(self, key: str, version):
+        # xor with the same digest cancels it
+        self._toggle(key, version)
+
+    def levels(self) -> list:
+        """Levels of tree from leaves to root"""
+        levels = [self.leaves]
+        while len(levels[-1]) > 1:
+            level = levels[-1]
+            levels.append([self.digest(f"{level[i]:x}:{level[i + 1]:x}")
+                           for i in range(0, len(level), 2)])
+        return levels
+
+    def root(self) -> str:
+        return f"{self.levels()[-1][0]:x}"
+
+    def hex_leaves(self) -> list:
+        return [f"{leaf:x}" for leaf in self.leaves]
+
+    def _check(self, hex_leaves: list):
+        if (not isinstance(hex_leaves, list)
+                or len(hex_leaves) != len(self.leaves)):
+            raise ValueError(f"tree of depth {self.depth} "
+                             f"has {len(self.leaves)} leaves")
+
+    def merge(self, hex_leaves: list):
+        """Add keys of other tree, trees must not share keys"""
+        self._check(hex_leaves)
+        for i, leaf in enumerate(hex_leaves):
+            self.leaves[i] ^= int(leaf, 16)
+
+    def diff(self, hex_leaves: list) -> list:
+        """Buckets which differ from leaves of other tree"""
+        self._check(hex_leaves)
+        return [i for i, leaf in enumerate(self.hex_leaves())
+                if leaf != hex_leaves[i]]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import time
+import threading
+from collections import OrderedDict
+
+
+class NearCache:
+    """
+    Client side LRU cache of entries keyed by (db_name, key):
+    entries older than ttl are validated by their versions
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 5.0):
+        """
+        :param max_entries: max number of cached entries
+        :param ttl: seconds during which entry is used without validation
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.validations = 0
+        self._entries = OrderedDict()
+        # invalidations come from other threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, db_name: str, keys: list):
+        """
+        Split keys by state of their entries in cache
+        :return: dict of fresh entries, dict of expired entries with version
+                 and list of keys which are not cached
+        """
+        fresh, expired, missing = {}, {}, []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                item = self._entries.get((db_name, key))
+                if item is None or (item[0].get("version") is None and
+                                    item[1] <= now):
+                    missing.append(key)
+                    continue
+                self._entries.move_to_end((db_name, key))
+                if item[1] > now:
+                    fresh[key] = item[0]
+                else:
+                    expired[key] = item[0]
+        self.hits += len(fresh)
+        self.misses += len(missing)
+        self.validations += len(expired)
+        return fresh, expired, missing
+
+    def put(self, db_name: str, key: str, entry: dict):
+        with self._lock:
+            self._entries[(db_name, key)] = (entry,
+                                             time.monotonic() + self.ttl)
+            self._entries.move_to_end((db_name, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, db_name: str, data: dict, expired: dict):
+        """
+        Apply answer of conditional /get to cache
+        :param data: entries, not_found_keys and not_modified_keys
+        :param expired: entries which were validated by the request
+        :return: entries of not modified keys
+        """
+        for key, entry in data["entries"].items():
+            self.put(db_name, key, entry)
+        for key in data["not_found_keys"]:
+            self.invalidate(db_name, key)
+        not_modified = {}
+        for key in data.get("not_modified_keys", []):
+            self.put(db_name, key, expired[key])
+            not_modified[key] = expired[key]
+        return not_modified
+
+    def invalidate(self, db_name: str, key: str):
+        with self._lock:
+            self._entries.pop((db_name, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "validations": self.validations}
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import time
+from collections import deque
+
+
+class NodeHealth:
+    """
+    Client side statistics of cluster nodes: EWMA of latency and
+    error rate, nodes which fail are not tried during exponential backoff
+    """
+
+    def __init__(self, alpha: float = 0.2, max_error_rate: float = 0.5,
+                 backoff: float = 0.5, max_backoff: float = 30.0,
+                 window: int = 100, min_samples: int = 10):
+        """
+        :param alpha: weight of the last request in moving averages
+        :param max_error_rate: node with higher error rate is not healthy
+        :param backoff: seconds to skip node after its first failure,
+                        they are doubled after every next failure
+        :param max_backoff: limit of backoff in seconds
+        :param window: number of last latencies kept for percentiles
+        :param min_samples: number of latencies needed for percentiles
+        """
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.window = window
+        self.min_samples = min_samples
+        self.nodes = {}
+
+    def _node(self, node: str) -> dict:
+        if node not in self.nodes:
+            self.nodes[node] = {"latency": None, "error_rate": 0.0,
+                                "failures": 0, "retry_at": 0.0,
+                                "latencies": deque(maxlen=self.window)}
+        return self.nodes[node]
+
+    def success(self, node: str, latency: float):
+        """Node answered in latency seconds"""
+        stats = self._node(node)
+        stats["latency"] = latency if stats["latency"] is None else \
+            self.alpha * latency + (1 - self.alpha) * stats["latency"]
+        stats["error_rate"] *= 1 - self.alpha
+        stats["failures"] = 0
+        stats["retry_at"] = 0.0
+        stats["latencies"].append(latency)
+
+    def failure(self, node: str):
+        """Node did not answer or answered with server error"""
+        stats = self._node(node)
+        stats["error_rate"] = self.alpha + \
+            (1 - self.alpha) * stats["error_rate"]
+        stats["failures"] += 1
+        delay = min(self.max_backoff,
+                    self.backoff * 2 ** (stats["failures"] - 1))
+        stats["retry_at"] = time.monotonic() + delay
+
+    def available(self, node: str) -> bool:
+        """Backoff of node is over"""
+        return self._node(node)["retry_at"] <= time.monotonic()
+
+    def healthy(self, node: str) -> bool:
+        return self.available(node) and \
+            self._node(node)["error_rate"] <= self.max_error_rate
+
+    def order(self, nodes) -> list:
+        """
+        Nodes in order to try them: healthy nodes from the fastest,
+        nodes with many errors, nodes in backoff from the nearest retry.
+        Nodes without statistics are tried first to learn their latency
+        """
+        def rank(node):
+            stats = self._node(node)
+            if not self.available(node):
+                return 2, stats["retry_at"]
+            if not self.healthy(node):
+                return 1, stats["error_rate"]
+            return 0, stats["latency"] or 0.0
+        return sorted(nodes, key=rank)
+
+    def percentile(self, node: str, percent: float = 95):
+        """
+        Latency percentile of node or None if there are too few requests
+        """
+        latencies = sorted(self._node(node)["latencies"])
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[int(round(percent / 100 * (len(latencies) - 1)))]
+
+    def stats(self) -> dict:
+        return {node: {"latency": stats["latency"],
+                       "error_rate": stats["error_rate"],
+                       "available": self.available(node)}
+                for node, stats in self.nodes.items()}
@@ -1,64 +1,661 @@
 #!/usr/bin/env python3
 import os
-import json
-import aiofiles
+import uuid
+import mmap
+import asyncio
+from storage import wire
+from storage.engine import create_engine
+from storage.wal import WriteAheadLog
+from storage.cache import MemoryCache
+from storage.hash_ring import HashRing
+from storage.hlc import HybridLogicalClock
+from storage.hints import HintQueue
+from storage.merkle import MerkleTree
+from storage.membership import Membership, DEAD
+from storage.invalidations import InvalidationLog
+from storage.bloom import BloomFilter
+from storage.token_log import TokenLog
 
 
-# Storage schema
-# {"token":
-#   {"db_name":
-#       {"key1": {"key": "key1", "value": "value1"}}
-#   }
+# Memory storage schema
+# {("token", "db_name", "key1"):
+#   {"key": "key1", "value": "value1", "version": [wall_ms, logical, node]}
 # }
 
+
+def replace_file(path: str, data: bytes):
+    """Write file atomically: readers see old or new content"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
 class NodeInfo:
     self_url = None
-    storage = {}
+    storage = MemoryCache()
     cluster_nodes = set()
-    api_keys = set()
+    api_keys = TokenLog()
+    # lifetime of new tokens in seconds, None means forever
+    token_ttl = None
+    # created by configure() from snapshot, scanning segments is skipped
+    engine = None
+    wal = None
+    write_consistency = "ONE"
+    read_consistency = "ONE"
+    replication_timeout = 2.0
+    replication_factor = 3
+    ring = HashRing()
+    clock = HybridLogicalClock()
+    hints = None
+    trees = {}
+    # keys of trees by buckets: {(token, db_name): {node: {bucket: {key:
+    # version}}}}, versions are replaced in trees without reading them
+    tree_keys = {}
+    trees_ring = None
+    trees_rebuild = None
+    trees_dirty = None
+    merkle_depth = 10
+    anti_entropy_interval = 60.0
+    anti_entropy_rate = 1000
+    membership = None
+    # cluster_nodes of node with several workers are changed by membership
+    # of worker 0, other workers take its view: [epoch, version]
+    cluster_view = [uuid.uuid4().hex, 0]
+    cluster_changed = None
+    gossip_period = 1.0
+    gossip_timeout = 0.5
+    gossip_indirect_probes = 3
+    invalidations = InvalidationLog()
+    invalidation_timeout = 30.0
+    import_batch_size = 5000
+    scan_page_size = 1000
+    # bloom filters of keys by (token, db_name)
+    filters = {}
+    bloom_error_rate = 0.01
+    bloom_negatives = 0
+    # filters of other nodes by (node, token, db_name): (filter, time)
+    peer_filters = {}
+    bloom_skip_peers = False
+    bloom_max_age = 5.0
+    storage_engine = "log"
+    snapshot_path = "./data/snapshot"
+    snapshot_hot_keys = 10000
+    # hot keys of previous run which are read into memory after start
+    hot_keys = []
+    prewarmed = 0
+    ready = True
 
     @classmethod
     def __init__(cls):
         if not os.path.exists("./data"):
             os.mkdir("./data")
-        if not os.path.exists("./data/api_keys.json"):
-            with open(f'./data/api_keys.json', 'w') as f:
-                f.write(json.dumps({"api_keys": []}))
-        else:
-            with open(f'./data/api_keys.json', 'r') as f:
-                cls.api_keys = set(json.load(f)["api_keys"])
+        if cls.hints is None:
+            cls.hints = HintQueue()
+        if cls.membership is None:
+            cls.membership = Membership(on_change=cls.on_member_change)
+        cls.api_keys.close()
+        cls.api_keys = TokenLog("./data/api_keys.log")
+        cls.api_keys.load(legacy_path="./data/api_keys.json")
+
+    @classmethod
+    def configure(cls, storage_engine: str = "log", wal: dict = None,
+                  cache: dict = None, replication: dict = None,
+                  hinted_handoff: dict = None, anti_entropy: dict = None,
+                  gossip: dict = None, invalidations: dict = None,
+                  bulk_import: dict = None, scan: dict = None,
+                  bloom: dict = None, snapshot: dict = None,
+                  root: str = "./data"):
+        """
+        Apply server settings
+        :param storage_engine: name of disk storage engine
+        :param wal: settings of write-ahead log (see WriteAheadLog)
+        :param cache: settings of memory tier (see MemoryCache)
+        :param replication: write_consistency, read_consistency,
+                            timeout of requests
+                            to other nodes in seconds, replication_factor
+                            and vnodes of hash ring
+                            (max_connections and wire_format
+                            are used by PeerPool), max_clock_drift_ms -
+                            versions ahead of time more than it
+                            are not accepted
+        :param hinted_handoff: settings of hints (see HintQueue)
+        :param anti_entropy: depth of merkle trees, interval in seconds
+                             and rate (keys per second) of repairs
+        :param gossip: protocol period, ping timeout in seconds,
+                       number of indirect probes and suspect_timeout
+        :param invalidations: max_size of log of written keys
+                              for near caches of clients and max timeout
+                              of their long polling in seconds
+        :param bulk_import: batch_size of keys written
+                            by streaming /import
+        :param scan: page_size, number of entries which are requested
+                     from every node by one step of /scan
+        :param bloom: error_rate of filters of keys, skip_peers - do not
+                      ask replicas which certainly do not have key
+                      according to their filters of age up to max_age
+                      seconds
+        :param snapshot: path of snapshot of index, filters and hot keys,
+                         interval of writing it in seconds, number
+                         of hot_keys and prewarm - read them after start
+        :param root: data directory of storage engine
+        """
+        replication = replication or {}
+        cls.write_consistency = replication.get("write_consistency",
+                                                cls.write_consistency)
+        cls.read_consistency = replication.get("read_consistency",
+                                               cls.read_consistency)
+        cls.replication_timeout = replication.get("timeout",
+                                                  cls.replication_timeout)
+        cls.replication_factor = replication.get("replication_factor",
+                                                 cls.replication_factor)
+        cls.ring = HashRing(vnodes=replication.get("vnodes",
+                                                   cls.ring.vnodes))
+        cls.clock.max_drift_ms = replication.get("max_clock_drift_ms",
+                                                 cls.clock.max_drift_ms)
+        cls.required_acks(cls.write_consistency, 1)
+        cls.required_acks(cls.read_consistency, 1)
+
+        anti_entropy = anti_entropy or {}
+        cls.merkle_depth = anti_entropy.get("depth", cls.merkle_depth)
+        cls.anti_entropy_interval = anti_entropy.get(
+            "interval", cls.anti_entropy_interval)
+        cls.anti_entropy_rate = anti_entropy.get("rate",
+                                                 cls.anti_entropy_rate)
+        cls.trees = {}
+        cls.tree_keys = {}
+        cls.trees_ring = None
+        cls.trees_rebuild = None
+        cls.trees_dirty = None
+
+        gossip = gossip or {}
+        cls.gossip_period = gossip.get("period", cls.gossip_period)
+        cls.gossip_timeout = gossip.get("ping_timeout", cls.gossip_timeout)
+        cls.gossip_indirect_probes = gossip.get("indirect_probes",
+                                                cls.gossip_indirect_probes)
+        cls.membership = Membership(
+            cls.self_url,
+            suspect_timeout=gossip.get("suspect_timeout", 5.0),
+            on_change=cls.on_member_change)
+        for node in cls.cluster_nodes:
+            cls.membership.join(node)
+
+        invalidations = invalidations or {}
+        cls.invalidations = InvalidationLog(
+            invalidations.get("max_size", 100000))
+        cls.invalidation_timeout = invalidations.get(
+            "timeout", cls.invalidation_timeout)
+
+        bulk_import = bulk_import or {}
+        cls.import_batch_size = bulk_import.get("batch_size",
+                                                cls.import_batch_size)
+        scan = scan or {}
+        cls.scan_page_size = scan.get("page_size", cls.scan_page_size)
+
+        bloom = bloom or {}
+        cls.bloom_error_rate = bloom.get("error_rate", cls.bloom_error_rate)
+        cls.bloom_skip_peers = bloom.get("skip_peers", cls.bloom_skip_peers)
+        cls.bloom_max_age = bloom.get("max_age", cls.bloom_max_age)
+        cls.peer_filters = {}
+
+        snapshot = snapshot or {}
+        cls.snapshot_path = snapshot.get("path", cls.snapshot_path)
+        cls.snapshot_hot_keys = snapshot.get("hot_keys",
+                                             cls.snapshot_hot_keys)
+        state = cls.read_snapshot() or {}
+        if state.get("storage_engine") != storage_engine:
+            state = {}
+
+        cls.storage = MemoryCache(**(cache or {}))
+        cls.hints = HintQueue(**(hinted_handoff or {}))
+
+        if cls.engine is not None:
+            cls.engine.close()
+        cls.storage_engine = storage_engine
+        os.makedirs(root, exist_ok=True)
+        cls.engine = create_engine(storage_engine, root=root,
+                                   snapshot=state.get("engine"))
+        cls.load_filters(state.get("filters"))
+        cls.hot_keys = state.get("hot_keys", []) \
+            if snapshot.get("prewarm", True) else []
+        cls.prewarmed = 0
+        cls.ready = not cls.hot_keys
+
+        if cls.wal is not None:
+            cls.wal.close()
+        cls.wal = WriteAheadLog(**(wal or {}),
+                                on_checkpoint=cls.engine.checkpoint)
+        cls.recover()
+        cls.wal.open()
+
+    @classmethod
+    def load_filters(cls, saved: list = None):
+        """
+        Build bloom filters of keys stored by engine
+        :param saved: [token, db_name, filter] of snapshot, keys which
+                      were written after snapshot are added to them
+        """
+        cls.filters = {}
+        saved = {(token, db_name): data for token, db_name, data
+                 in saved or []}
+        scanned = cls.engine.scanned_keys
+        for token, db_name in list(cls.engine.databases()):
+            if scanned is None or (token, db_name) not in saved:
+                cls.rebuild_filter(token, db_name)
+                continue
+            bloom = BloomFilter.from_dict(saved[(token, db_name)])
+            cls.filters[(token, db_name)] = bloom
+            cls.add_to_filter(token, db_name,
+                              scanned.get((token, db_name), []))
+
+    @classmethod
+    def read_snapshot(cls):
+        """
+        State saved by write_snapshot, file is mapped to memory and
+        msgpack snapshot is decoded without copying
+        :return: dict or None if there is no valid snapshot
+        """
+        if not os.path.exists(cls.snapshot_path) or \
+                os.path.getsize(cls.snapshot_path) == 0:
+            return None
+        try:
+            with open(cls.snapshot_path, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header_end = data.find(b"\n")
+                content_type = data[:header_end].decode()
+                with memoryview(data) as view, \
+                        view[header_end + 1:] as body:
+                    if content_type != wire.MSGPACK:
+                        return wire.loads(bytes(body), content_type)
+                    return wire.loads(body, content_type)
+        except (ValueError, KeyError, OSError) as err:
+            print(f"snapshot {cls.snapshot_path} is not loaded: {err}")
+            return None
+
+    @classmethod
+    async def write_snapshot(cls):
+        """Save index of engine, bloom filters and hot keys for fast start"""
+        state = {"storage_engine": cls.storage_engine,
+                 "engine": cls.engine.snapshot(),
+                 "filters": [[token, db_name, bloom.to_dict()]
+                             for (token, db_name), bloom
+                             in cls.filters.items()],
+                 "hot_keys": cls.storage.hot_keys(cls.snapshot_hot_keys)}
+        # state is encoded at once, engine changes it by writes
+        content_type = wire.content_type("msgpack")
+        data = content_type.encode() + b"\n" + wire.dumps(state, content_type)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, replace_file, cls.snapshot_path,
+                                   data)
+
+    @classmethod
+    async def prewarm(cls, batch_size: int = 1000):
+        """Read hot keys of previous run into memory tier"""
+        # the hottest key is put the last to be the most recently used
+        hot_keys = cls.hot_keys[::-1]
+        for start in range(0, len(hot_keys), batch_size):
+            groups = {}
+            for token, db_name, key in hot_keys[start:start + batch_size]:
+                if cls.storage.peek(token, db_name, key) is None:
+                    groups.setdefault((token, db_name), []).append(key)
+            for (token, db_name), keys in groups.items():
+                founded = cls.engine.read(token, db_name, keys)
+                for key in keys:
+                    # key could be written while batch was read
+                    if key in founded and \
+                            cls.storage.peek(token, db_name, key) is None:
+                        cls.storage.put(token, db_name, key, founded[key])
+            cls.prewarmed = min(start + batch_size, len(hot_keys))
+            await asyncio.sleep(0)
+        cls.hot_keys = []
+        cls.ready = True
+
+    @classmethod
+    def rebuild_filter(cls, token: str, db_name: str):
+        """Make filter of database with capacity for twice more keys"""
+        keys = list(cls.engine.keys(token, db_name))
+        bloom = BloomFilter(max(2 * len(keys), 1000), cls.bloom_error_rate)
+        for key in keys:
+            bloom.add(key)
+        cls.filters[(token, db_name)] = bloom
+
+    @classmethod
+    def add_to_filter(cls, token: str, db_name: str, keys: list):
+        bloom = cls.filters.get((token, db_name))
+        if bloom is None:
+            bloom = BloomFilter(1000, cls.bloom_error_rate)
+            cls.filters[(token, db_name)] = bloom
+        for key in keys:
+            bloom.add(key)
+        if bloom.full:
+            cls.rebuild_filter(token, db_name)
+
+    @classmethod
+    def filter_dict(cls, token: str, db_name: str):
+        """Bloom filter of database or None if there is no database"""
+        bloom = cls.filters.get((token, db_name))
+        return bloom and bloom.to_dict()
+
+    @classmethod
+    def may_contain(cls, token: str, db_name: str, key: str):
+        """False if key is certainly not stored by this node"""
+        bloom = cls.filters.get((token, db_name))
+        return bloom is not None and key in bloom
+
+    @classmethod
+    def recover(cls):
+        """Replay write-ahead log into storage after crash"""
+        replayed = False
+        for record in cls.wal.replay():
+            cls.apply_keys(record["token"], record["db_name"],
+                           record["keys"])
+            replayed = True
+        if replayed:
+            cls.engine.sync()
+        if os.path.exists(cls.wal.path):
+            os.remove(cls.wal.path)
+
+    @staticmethod
+    def required_acks(level: str, replicas: int):
+        """
+        Number of nodes which must accept request
+        :param level: consistency level: ONE, QUORUM or ALL
+        :param replicas: number of nodes with data
+        """
+        if level == "ONE":
+            return 1
+        if level == "QUORUM":
+            return replicas // 2 + 1
+        if level == "ALL":
+            return replicas
+        raise ValueError(f"unknown consistency level: {level}")
+
+    @staticmethod
+    def newest(entries: list):
+        """
+        Choose the most recent of entries returned by replicas
+        :param entries: list of entries, None for replica without key
+        :return: newest entry or None if no replica has key
+        """
+        founded = [entry for entry in entries if entry is not None]
+        if not founded:
+            return None
+        return max(founded, key=lambda entry: entry.get("version", []))
+
+    @classmethod
+    def set_self_url(cls, url: str):
+        cls.self_url = url
+        cls.clock.node_id = url
+        if cls.membership is not None:
+            cls.membership.self_url = url
+
+    @classmethod
+    def stamp(cls, keys: list):
+        """Set new version to entries written by client"""
+        for key_data in keys:
+            key_data["version"] = cls.clock.now()
+
+    @classmethod
+    def versions(cls, token: str, db_name: str, keys: list):
+        """
+        Versions of stored entries
+        :return: dict of key and version, None for entries without version
+        """
+        versions = {}
+        missing = []
+        for key in keys:
+            entry = cls.storage.peek(token, db_name, key)
+            if entry is None:
+                # new keys do not cost disk reads
+                if cls.may_contain(token, db_name, key):
+                    missing.append(key)
+            else:
+                versions[key] = entry.get("version")
+        if missing:
+            versions.update(cls.engine.versions(token, db_name, missing))
+        return versions
 
     @classmethod
     def get_cluster_nodes(cls):
         return cls.cluster_nodes
 
+    @classmethod
+    def update_ring(cls):
+        """Make ring consist of known cluster nodes"""
+        nodes = set(cls.cluster_nodes)
+        if cls.self_url:
+            nodes.add(cls.self_url)
+        if nodes != cls.ring.nodes:
+            cls.ring.update(nodes)
+        return cls.ring
+
+    @classmethod
+    def replicas(cls, token: str, db_name: str, key: str):
+        """Urls of nodes which keep the key, self_url included"""
+        return cls.update_ring().preference_list(
+            HashRing.key_id(token, db_name, key), cls.replication_factor)
+
+    @classmethod
+    def owns(cls, token: str, db_name: str, keys: list):
+        """True if this node is replica of every key"""
+        return all(cls.self_url in cls.replicas(token, db_name, key)
+                   for key in keys)
+
+    @classmethod
+    def partition_map(cls):
+        """Information which lets clients find replicas of keys"""
+        ring = cls.update_ring()
+        return {"nodes": sorted(ring.nodes), "vnodes": ring.vnodes,
+                "replication_factor": cls.replication_factor}
+
+    @classmethod
+    def shared_peers(cls, token: str, db_name: str, key: str):
+        """Other replicas of key if this node is its replica too"""
+        replicas = cls.replicas(token, db_name, key)
+        if cls.self_url not in replicas:
+            return []
+        return [node for node in replicas if node != cls.self_url]
+
+    @classmethod
+    async def merkle_trees(cls):
+        """
+        Merkle trees of keys shared with other replicas,
+        they are rebuilt from storage engine after membership change
+        :return: {(token, db_name): {node: MerkleTree}}
+        """
+        while cls.trees_ring != cls.update_ring().nodes:
+            if cls.trees_rebuild is None:
+                cls.trees_rebuild = asyncio.ensure_future(
+                    cls.rebuild_trees())
+            # rebuild goes on if one of waiting requests is cancelled
+            await asyncio.shield(cls.trees_rebuild)
+        return cls.trees
+
+    @classmethod
+    async def rebuild_trees(cls):
+        """
+        Build trees in executor from versions of stored keys,
+        keys written meanwhile are put to trees after it
+        """
+        nodes = set(cls.ring.nodes)
+        ring = HashRing(nodes, cls.ring.vnodes)
+        databases = [(token, db_name, cls.engine.versions(
+                          token, db_name, list(cls.engine.keys(token,
+                                                               db_name))))
+                     for token, db_name in list(cls.engine.databases())]
+        cls.trees_dirty = set()
+        loop = asyncio.get_event_loop()
+        try:
+            cls.trees, cls.tree_keys = await loop.run_in_executor(
+                None, cls.build_trees, ring, databases)
+            cls.trees_ring = nodes
+        finally:
+            dirty, cls.trees_dirty = cls.trees_dirty, None
+            cls.trees_rebuild = None
+        written = {}
+        for token, db_name, key in dirty:
+            written.setdefault((token, db_name), []).append(key)
+        for (token, db_name), keys in written.items():
+            versions = cls.engine.versions(token, db_name, keys)
+            cls.update_trees(token, db_name,
+                             [{"key": key, "version": versions.get(key)}
+                              for key in keys if key in versions])
+
+    @classmethod
+    def build_trees(cls, ring: HashRing, databases: list):
+        """
+        :param ring: copy of hash ring, trees are built for it
+        :param databases: list of (token, db_name, {key: version})
+        :return: trees and index of their buckets:
+                 {(token, db_name): {node: {bucket: {key: version}}}}
+        """
+        trees, index = {}, {}
+        for token, db_name, versions in databases:
+            for key, version in versions.items():
+                replicas = ring.preference_list(
+                    HashRing.key_id(token, db_name, key),
+                    cls.replication_factor)
+                if cls.self_url not in replicas:
+                    continue
+                for node in replicas:
+                    if node != cls.self_url:
+                        cls.put_tree_key(trees, index, token, db_name, node,
+                                         key, version)
+        return trees, index
+
+    @classmethod
+    def put_tree_key(cls, trees: dict, index: dict, token: str,
+                     db_name: str, node: str, key: str, version):
+        """Replace version of key in tree shared with node"""
+        db_trees = trees.setdefault((token, db_name), {})
+        if node not in db_trees:
+            db_trees[node] = MerkleTree(cls.merkle_depth)
+        tree = db_trees[node]
+        bucket = index.setdefault((token, db_name), {}).setdefault(
+            node, {}).setdefault(tree.bucket(key), {})
+        if key in bucket:
+            tree.remove(key, bucket[key])
+        tree.add(key, version)
+        bucket[key] = version
+
+    @classmethod
+    async def merkle_leaves(cls, token: str = None, db_name: str = None,
+                            node: str = None):
+        """
+        Leaves of merkle trees, all trees if arguments are not given
+        :return: list of [token, db_name, node, hex leaves]
+        """
+        return [[tree_token, tree_db, tree_node, tree.hex_leaves()]
+                for (tree_token, tree_db), trees
+                in (await cls.merkle_trees()).items()
+                if token in (None, tree_token) and db_name in (None, tree_db)
+                for tree_node, tree in trees.items()
+                if node in (None, tree_node)]
+
+    @classmethod
+    def merkle_tree(cls, token: str, db_name: str, node: str):
+        db_trees = cls.trees.setdefault((token, db_name), {})
+        if node not in db_trees:
+            db_trees[node] = MerkleTree(cls.merkle_depth)
+        return db_trees[node]
+
+    @classmethod
+    def update_trees(cls, token: str, db_name: str, keys: list):
+        """Put written keys to merkle trees"""
+        if cls.trees_ring != cls.update_ring().nodes:
+            # trees will be rebuilt before next comparison,
+            # keys written during running rebuild are added after it
+            if cls.trees_dirty is not None:
+                cls.trees_dirty.update((token, db_name, key_data["key"])
+                                       for key_data in keys)
+            return
+        latest = {key_data["key"]: key_data for key_data in keys}
+        for key, key_data in latest.items():
+            for node in cls.shared_peers(token, db_name, key):
+                cls.put_tree_key(cls.trees, cls.tree_keys, token, db_name,
+                                 node, key, key_data.get("version"))
+
+    @classmethod
+    async def bucket_entries(cls, token: str, db_name: str, node: str,
+                             buckets: list):
+        """Entries shared with node which are in given buckets of tree"""
+        await cls.merkle_trees()
+        node_buckets = cls.tree_keys.get((token, db_name), {}).get(node, {})
+        keys = [key for bucket in set(buckets)
+                for key in node_buckets.get(bucket, {})]
+        return cls.engine.read(token, db_name, keys)
+
     @classmethod
     def add_cluster_urls(cls, urls: list):
         for url in urls:
             if url != cls.self_url:
                 cls.cluster_nodes.add(url)
+                cls.membership.join(url)
+
+    @classmethod
+    def on_member_change(cls, node: str, state: str):
+        """Keep in cluster_nodes only nodes which are not dead"""
+        if state == DEAD:
+            cls.cluster_nodes.discard(node)
+        elif node != cls.self_url:
+            cls.cluster_nodes.add(node)
+        cls.cluster_view = [cls.cluster_view[0], cls.cluster_view[1] + 1]
+        if cls.cluster_changed is not None:
+            cls.cluster_changed.set()
+
+    @classmethod
+    def get_cluster_view(cls) -> dict:
+        return {"nodes": sorted(cls.cluster_nodes), "view": cls.cluster_view}
 
     @classmethod
-    def init_new_keys(cls, token, db_name):
-        if token not in cls.storage:
-            cls.storage[token] = {db_name: {}}
-        if db_name not in cls.storage[token]:
-            cls.storage[token][db_name] = {}
+    def apply_cluster_view(cls, nodes: list, view: list) -> bool:
+        """
+        Take cluster nodes of worker which runs membership,
+        view of older version is ignored
+        :return: True if view was applied
+        """
+        epoch, version = view
+        if epoch == cls.cluster_view[0] and version <= cls.cluster_view[1]:
+            return False
+        cls.cluster_view = list(view)
+        cls.cluster_nodes.clear()
+        cls.cluster_nodes.update(nodes)
+        return True
 
     @classmethod
     async def add_client_api_key(cls, token):
-        """Updating cls.api_keys and api-keys file with new token"""
-        cls.api_keys.add(token)
-        data = ""
-        async with aiofiles.open(f'./data/api_keys.json', 'r') as f:
-            data = json.loads(await f.read())
-        data["api_keys"].append(token)
-        async with aiofiles.open(f'./data/api_keys.json', 'w') as f:
-            await f.write(json.dumps(data))
+        """Updating cls.api_keys and api-keys log with new token"""
+        await cls.add_client_api_keys([token])
+
+    @classmethod
+    async def add_client_api_keys(cls, tokens: list):
+        """Append hashes of new tokens to api-keys log by one write"""
+        return await cls.api_keys.add(tokens, cls.token_ttl)
+
+    @classmethod
+    async def apply_token_records(cls, records: list):
+        """
+        Apply registrations and revocations of tokens
+        :return: records which changed local api keys
+        """
+        return await cls.api_keys.apply(records)
 
     @classmethod
     async def is_valid_token(cls, token):
-        return token in cls.api_keys
+        if token is None:
+            return False
+        if cls.api_keys.valid(token):
+            return True
+        # token could be registered by other worker just now
+        cls.api_keys.refresh(force=True)
+        return cls.api_keys.valid(token)
+
+    @classmethod
+    def tokens_generation(cls) -> int:
+        """Number which changes when any token becomes valid or invalid"""
+        return cls.api_keys.refresh()
 
     @classmethod
     async def add_keys(cls, token: str = None,
@@ -73,23 +670,120 @@ class NodeInfo:
         :return:
         """
 
-        if not os.path.exists(f'./data/{token}'):
-            os.mkdir(f'./data/{token}')
-        if not os.path.exists(f'./data/{token}/{db_name}'):
-            os.mkdir(f'./data/{token}/{db_name}')
-        cls.init_new_keys(token, db_name)
+        for key_data in keys:
+            if "key" not in key_data:
+                raise KeyError("key")
+
+        cls.observe_versions(keys)
+        keys = cls.fresh_keys(token, db_name, keys)
+        if not keys:
+            return
+
+        if cls.wal is not None:
+            await cls.wal.append(
+                {"token": token, "db_name": db_name, "keys": keys})
+        cls.apply_keys(token, db_name, keys)
 
+    @classmethod
+    def import_keys(cls, token: str, db_name: str, keys: list):
+        """
+        Bulk load of keys: they are written straight to storage engine
+        without write-ahead log and without filling memory tier,
+        engine.sync() makes them durable
+        :param token: user`s token
+        :param db_name: name of user`s database
+        :param keys: list of keys:value pairs to add
+        """
+        for key_data in keys:
+            if "key" not in key_data:
+                raise KeyError("key")
+
+        cls.observe_versions(keys)
+        cls.apply_keys(token, db_name, keys, cache=False)
+
+    @classmethod
+    def observe_versions(cls, keys: list):
+        """Move clock after versions of other nodes which are not drifted"""
         for key_data in keys:
-            key = key_data["key"]
-            cls.storage[token][db_name][key] = key_data
-            async with aiofiles.open(
-                    f'./data/{token}/{db_name}/{key}.json', 'w') as f:
-                await f.write(json.dumps(key_data))
+            if "version" in key_data and \
+                    not cls.clock.drifted(key_data["version"]):
+                cls.clock.update(key_data["version"])
 
     @classmethod
-    async def add_keys_from_other_node(cls, token, db_name, entries, **kwargs):
+    def fresh_keys(cls, token: str, db_name: str, keys: list):
+        """
+        Last writer wins: skip entries which are not newer than stored ones
+        and entries with versions too far in the future,
+        entries without version are always written
+        """
+        versions = cls.versions(token, db_name,
+                                [key_data["key"] for key_data in keys
+                                 if "version" in key_data])
+        fresh = []
+        for key_data in keys:
+            if "version" in key_data and \
+                    cls.clock.drifted(key_data["version"]):
+                print(f"entry {key_data['key']} is skipped: version "
+                      f"{key_data['version']} is too far in the future")
+                continue
+            current = versions.get(key_data["key"])
+            if "version" in key_data and current is not None and \
+                    current >= key_data["version"]:
+                continue
+            fresh.append(key_data)
+        return fresh
+
+    @classmethod
+    def apply_keys(cls, token: str, db_name: str, keys: list,
+                   cache: bool = True):
+        """
+        Add key:value to memory and storage engine
+        :param cache: put entries to memory tier, otherwise
+                      their old entries are dropped from it
+        """
+        # requests waiting for write-ahead log could be reordered
+        keys = cls.fresh_keys(token, db_name, keys)
+        if not keys:
+            return
+        for key_data in keys:
+            if cache:
+                cls.storage.put(token, db_name, key_data["key"], key_data)
+            else:
+                cls.storage.pop(token, db_name, key_data["key"])
+        cls.engine.write(token, db_name, keys)
+        cls.add_to_filter(token, db_name,
+                          [key_data["key"] for key_data in keys])
+        cls.update_trees(token, db_name, keys)
+        cls.invalidations.add(token, db_name,
+                              [key_data["key"] for key_data in keys])
+
+    @classmethod
+    async def add_keys_from_other_node(cls, token, db_name, entries,
+                                       bulk=False, **kwargs):
         keys = [key_value[1] for key_value in entries.items()]
-        await cls.add_keys(token, db_name, keys)
+        if bulk:
+            # keys of bulk import skip write-ahead log and memory tier
+            cls.import_keys(token, db_name, keys)
+        else:
+            await cls.add_keys(token, db_name, keys)
+
+    @classmethod
+    async def scan(cls, token: str, db_name: str, start: str = None,
+                   end: str = None, after: str = None, limit: int = None):
+        """
+        Entries of database in order of keys
+        :param token: user`s token
+        :param db_name: name of user`s database
+        :param start: the first key of range
+        :param end: key after the range
+        :param after: cursor, keys of entries are greater than it
+        :param limit: max number of entries
+        :return: list of entries
+        """
+        keys = cls.engine.scan_keys(token, db_name, start, end, after, limit)
+        data = await cls.get_values(token, db_name, keys)
+        return [data["entries"][key] for key in keys
+                if key in data["entries"]]
 
     @classmethod
     def get_values_from_memory(cls, token: str, db_name: str, keys: list):
@@ -102,10 +796,10 @@ class NodeInfo:
         """
         founded = {}
 
-        if token in cls.storage and db_name in cls.storage[token]:
-            for key in keys:
-                if key in cls.storage[token][db_name]:
-                    founded[key] = cls.storage[token][db_name][key]
+        for key in keys:
+            entry = cls.storage.get(token, db_name, key)
+            if entry is not None:
+                founded[key] = entry
 
         not_found = set(keys) - founded.keys()
         return {"entries": founded, "not_found_keys": list(not_found)}
@@ -119,18 +813,13 @@ class NodeInfo:
         :param keys: list of keys to get
         :return: dict of founded values and not_found_keys
         """
-        founded = {}
+        stored = [key for key in keys
+                  if cls.may_contain(token, db_name, key)]
+        cls.bloom_negatives += len(keys) - len(stored)
+        founded = cls.engine.read(token, db_name, stored)
 
-        if os.path.exists(f'./data/{token}') and \
-                os.path.exists(f'./data/{token}/{db_name}'):
-            for key in keys:
-                if os.path.exists(f"./data/{token}/{db_name}/{key}.json"):
-                    cls.init_new_keys(token, db_name)
-                    async with aiofiles.open(
-                            f'./data/{token}/{db_name}/{key}.json', 'r') as f:
-                        data = json.loads(await f.read())
-                        cls.storage[token][db_name][key] = data
-                        founded[key] = data
+        for key, entry in founded.items():
+            cls.storage.put(token, db_name, key, entry)
 
         not_found = set(keys) - founded.keys()
         return {"entries": founded, "not_found_keys": list(not_found)}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import asyncio
+from requests_async import Session
+from storage import wire
+
+
+class PeerPool:
+    """
+    Keep-alive HTTP sessions to other nodes:
+    one session per node with limited number of requests in flight
+    """
+
+    def __init__(self, max_connections: int = 16,
+                 content_type: str = wire.JSON):
+        """
+        :param max_connections: max number of concurrent requests to one node
+        :param content_type: wire format of request bodies and answers
+        """
+        self.max_connections = max_connections
+        self.content_type = content_type
+        # headers of every request, e.g. secret of cluster
+        self.headers = {}
+        self._sessions = {}
+        self._limits = {}
+
+    def _peer(self, node):
+        session = self._sessions.get(node)
+        if session is None:
+            session = Session()
+            self._sessions[node] = session
+            self._limits[node] = asyncio.Semaphore(self.max_connections)
+        return session, self._limits[node]
+
+    async def request(self, method: str, node: str, path: str, **kwargs):
+        """
+        Send request to node through its session
+        :param method: http method
+        :param node: url of node
+        :param path: request part
+        :param kwargs: arguments of session.request,
+                       json data is encoded to content_type of pool
+        """
+        if self.headers:
+            kwargs["headers"] = dict(self.headers, **(kwargs.get("headers")
+                                                      or {}))
+        if "json" in kwargs:
+            kwargs["data"] = wire.dumps(kwargs.pop("json"), self.content_type)
+            kwargs["headers"] = wire.headers(self.content_type,
+                                             kwargs.get("headers"))
+        session, limit = self._peer(node)
+        async with limit:
+            return await session.request(method, f"{node}{path}", **kwargs)
+
+    async def post(self, node: str, path: str, **kwargs):
+        return await self.request("POST", node, path, **kwargs)
+
+    async def get(self, node: str, path: str, **kwargs):
+        return await self.request("GET", node, path, **kwargs)
+
+    async def forget(self, node: str):
+        """Close session of node which left cluster"""
+        session = self._sessions.pop(node, None)
+        self._limits.pop(node, None)
+        if session is not None:
+            await session.close()
+
+    async def close(self):
+        for node in list(self._sessions):
+            await self.forget(node)
@@ -2,143 +2,1159 @@
 from sanic import Sanic
 from storage.node_info import NodeInfo
 from storage.token_auth import SanicTokenAuth
-from sanic.response import json
+from sanic.response import json, raw
 from aioconsole import ainput
-from requests_async import post
+from storage.peer_pool import PeerPool
+from storage.merkle import MerkleTree
+from storage.engine import prefix_range, FilePerKeyEngine
+from storage.bloom import BloomFilter
+from storage.token_log import TokenBatcher
+from storage.shards import Shards, ShardError, ForwardedInvalidations
+from storage.shards import handlers as shard_handlers
+from storage import wire
+from storage.tcp_server import StorageProtocol
 from requests_async import ConnectionError
-import json as _json
+import os
+import sys
 import uuid
+import time
+import heapq
+import socket
+import signal
+import secrets
+import asyncio
+import multiprocessing.connection
 
 app = Sanic(name="node")
 memory = NodeInfo()
-auth = SanicTokenAuth(token_verifier=memory.is_valid_token)
+auth = SanicTokenAuth(token_verifier=memory.is_valid_token,
+                      generation=memory.tokens_generation)
+# requests between nodes which change or read api keys
+# carry secret of cluster (auth.cluster_secret)
+peer_auth = SanicTokenAuth(header="X-Cluster-Secret")
+peers = PeerPool()
+# workers of this node, each of them stores its shard of keys
+shards = Shards()
+background_tasks = set()
+# progress of running bulk imports by their ids
+imports = {}
+# (node, token, db_name) of filters which are being fetched
+fetching_filters = set()
 
 
 @app.route("/auth", methods=["POST"])
 async def auth_key(request):
     token = str(uuid.uuid4())
-    await memory.add_client_api_key(token)
-    await distribute({"token": token}, "/registerkey")
-    return json({"api-key": token}, status=200)
+    record = memory.api_keys.record(token, memory.token_ttl)
+    await token_batcher.add(record)
+    return reply(request, {"api-key": token, "expires": record["expires"]},
+                 status=200)
+
+
+@app.route("/revokekey", methods=["POST"])
+@auth.auth_required
+async def revoke_key(request):
+    """Revoke api key of request on all nodes"""
+    token = request.headers.get(auth.header)
+    records = await memory.api_keys.revoke([token])
+    await refresh_tokens()
+    await distribute({"records": records}, "/registerkey")
+    return reply(request, {"revoked": True}, status=200)
+
+
+async def register_tokens(records: list):
+    """
+    Save hashes of tokens of concurrent /auth requests and send them
+    to other nodes by one request
+    """
+    records = await memory.apply_token_records(records)
+    await distribute({"records": records}, "/registerkey")
+
+
+token_batcher = TokenBatcher(register_tokens)
 
 
 @app.route("/clusterinfo", methods=["GET"])
 async def get_cluster_info(request):
     data = list(memory.get_cluster_nodes())
     data.append(memory.self_url)
-    return json({"addresses": data}, status=200)
+    return reply(request, {"addresses": data}, status=200)
+
+
+@app.route("/partitionmap", methods=["GET"])
+async def get_partition_map(request):
+    """Nodes of hash ring, clients send keys to their replicas directly"""
+    return reply(request, memory.partition_map(), status=200)
+
+
+@app.route("/stats", methods=["GET"])
+async def get_stats(request):
+    return reply(request, {"cache": memory.storage.stats(),
+                           "imports": imports,
+                           "bloom": {"filters": len(memory.filters),
+                                     "negatives": memory.bloom_negatives},
+                           "worker": {"index": shards.index,
+                                      "count": shards.count}},
+                 status=200)
+
+
+@app.route("/health", methods=["GET"])
+async def get_health(request):
+    """
+    Readiness for load balancer: node answers 503 until hot keys
+    of previous run are read into memory
+    """
+    data = {"status": "ready" if memory.ready else "warming",
+            "prewarmed": memory.prewarmed,
+            "hot_keys": len(memory.hot_keys)}
+    return reply(request, data, status=200 if memory.ready else 503)
+
+
+@app.route("/bloom", methods=["GET"])
+@auth.auth_required
+async def get_bloom(request):
+    """Bloom filter of keys of database stored by this node"""
+    try:
+        filters = await shards.each(
+            "filter", memory.filter_dict,
+            {"token": request.headers["authorization"],
+             "db_name": request.args.get("db_name")})
+    except ShardError as err:
+        return reply(request, {"message": f"getting filter failed: {err}"},
+                     status=500)
+    if len(filters) > 1:
+        bloom = BloomFilter.union([BloomFilter.from_dict(data)
+                                   for data in filters if data])
+        filters = [bloom and bloom.to_dict()]
+    return reply(request, {"bloom": filters[0]}, status=200)
 
 
 @app.route("/set", methods=["POST"])
 @auth.auth_required
 async def set_value(request):
     try:
-        json_args = request.json
+        json_args = load_body(request)
         json_args["token"] = request.headers["authorization"]
+        is_endpoint = "is_endpoint" in request.args
+        # versions of entries are set by nodes only, clients could
+        # move clock of node and win last-writer-wins forever
+        if is_endpoint and not await peer_auth.is_authenticated(request):
+            return reply(request, {"message": "cluster secret required"},
+                         status=401)
+        keys = [key_data["key"] for key_data in json_args["keys"]]
+        headers = None if is_endpoint else owner_hint(json_args, keys)
+        data, status = await set_keys(json_args,
+                                      request.args.get("consistency"),
+                                      is_endpoint, "bulk" in request.args)
+        return reply(request, data, status=status, headers=headers)
+    except Exception as err:
+        return reply(request,
+                     {"message": f"setting value failed: {str(err)}"},
+                     status=500)
 
-        await memory.add_keys(**json_args)
 
-        if "is_endpoint" not in request.args:
-            await distribute(
-                json_args,
-                "/set?is_endpoint=True",
-                headers={"Authorization": json_args["token"]})
+@app.route("/import", methods=["POST"], stream=True)
+@auth.auth_required
+async def import_values(request):
+    """
+    Streaming bulk load: body is parsed while it is received, keys are
+    written by batches of import_batch_size, so memory does not depend
+    on size of dataset
+    Body is json lines or concatenated msgpack messages {"key", "value"},
+    db_name and consistency are in query
+    """
+    token = request.headers["authorization"]
+    db_name = request.args.get("db_name")
+    level = request.args.get("consistency", memory.write_consistency)
+    import_id = str(uuid.uuid4())
+    progress = {"db_name": db_name, "bytes": 0, "keys": 0,
+                "failed": 0, "failed_keys": []}
+    imports[import_id] = progress
+    try:
+        if db_name is None:
+            raise KeyError("db_name")
+        decoder = wire.StreamDecoder(request.content_type or wire.NDJSON)
+        batch = []
+        while True:
+            chunk = await request.stream.read()
+            if chunk is None:
+                break
+            progress["bytes"] += len(chunk)
+            batch.extend(decoder.feed(chunk))
+            if len(batch) >= memory.import_batch_size:
+                await import_batch(token, db_name, batch, level, progress)
+                batch = []
+        batch.extend(decoder.close())
+        if batch:
+            await import_batch(token, db_name, batch, level, progress)
+        await shards.each("sync", sync_engine, {})
+        status = 503 if progress["failed"] else 200
+        return reply(request, progress, status=status)
+    except Exception as err:
+        return reply(request,
+                     {"message": f"import failed: {str(err)}",
+                      "keys": progress["keys"]},
+                     status=500)
+    finally:
+        imports.pop(import_id, None)
 
-        return json(json_args, status=200)
+
+async def import_batch(token: str, db_name: str, batch: list, level: str,
+                       progress: dict, max_failed_keys: int = 100):
+    """
+    Write batch of imported keys to their replicas
+    :param progress: counters of import, only first
+                     max_failed_keys of failed keys are kept
+    """
+    data = {"token": token, "db_name": db_name, "keys": batch}
+    memory.stamp(batch)
+    failed = await replicate(data, level, bulk=True)
+    progress["keys"] += len(batch) - len(failed)
+    progress["failed"] += len(failed)
+    free = max_failed_keys - len(progress["failed_keys"])
+    progress["failed_keys"].extend(failed[:max(free, 0)])
+
+
+async def sync_engine():
+    """Make imported keys of this worker durable"""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, memory.engine.sync)
+
+
+@app.route("/scan", methods=["POST"])
+@auth.auth_required
+async def scan_values(request):
+    """
+    Entries of database in order of keys, body is db_name and optional
+    prefix, start, end, cursor (the last received key) and limit
+    Client gets chunked json lines of entries and the last line
+    {"cursor": ..} to resume scan from, it is null when scan is finished.
+    Other nodes get a page of local entries
+    """
+    try:
+        json_args = load_body(request)
+        token = request.headers["authorization"]
+        db_name = json_args["db_name"]
+        start, end = scan_bounds(json_args)
+        cursor, limit = json_args.get("cursor"), json_args.get("limit")
+        if "is_endpoint" in request.args:
+            entries = await scan_local(token, db_name, start, end,
+                                       cursor, limit)
+            return reply(request, {"entries": entries}, status=200)
     except Exception as err:
-        return json({"message": f"setting value failed: {str(err)}"},
-                    status=500)
+        return reply(request, {"message": f"scan failed: {err}"},
+                     status=500)
+
+    response = await request.respond(content_type=wire.NDJSON)
+    try:
+        while limit is None or limit > 0:
+            size = memory.scan_page_size if limit is None \
+                else min(memory.scan_page_size, limit)
+            page = await scan_page(token, db_name, start, end, cursor, size)
+            if page:
+                cursor = page[-1]["key"]
+                await response.send(b"".join(wire.dumps(entry) + b"\n"
+                                             for entry in page))
+            if limit is not None:
+                limit -= len(page)
+            if len(page) < size:
+                cursor = None
+                break
+        await response.send(wire.dumps({"cursor": cursor}) + b"\n")
+    except Exception as err:
+        # without the last line client resumes scan from the last key
+        print(f"scan failed: {err}")
+    await response.eof()
+
+
+def scan_bounds(json_args: dict):
+    """[start, end) range of keys of /scan request narrowed by prefix"""
+    start, end = json_args.get("start"), json_args.get("end")
+    prefix_start, prefix_end = prefix_range(json_args.get("prefix"))
+    if prefix_start is not None:
+        start = prefix_start if start is None else max(start, prefix_start)
+    if prefix_end is not None:
+        end = prefix_end if end is None else min(end, prefix_end)
+    return start, end
+
+
+async def scan_page(token: str, db_name: str, start: str, end: str,
+                    after: str, size: int):
+    """
+    Every node returns its first size entries after cursor,
+    so the first size keys of their union are the first keys of database
+    :return: list of the newest entries
+    """
+    nodes = [memory.self_url, *memory.get_cluster_nodes()]
+    pages = await asyncio.gather(*[
+        scan_node(node, token, db_name, start, end, after, size)
+        for node in nodes])
+    newest = {}
+    for page in pages:
+        for entry in page or []:
+            newest[entry["key"]] = memory.newest(
+                [newest.get(entry["key"]), entry])
+    return [newest[key] for key in sorted(newest)[:size]]
+
+
+async def scan_node(node, token: str, db_name: str, start: str, end: str,
+                    after: str, size: int):
+    """
+    Page of entries of node
+    :return: list of entries or None if node did not answer
+    """
+    if node == memory.self_url:
+        return await scan_local(token, db_name, start, end, after, size)
+    try:
+        response = await asyncio.wait_for(
+            peers.post(node, "/scan?is_endpoint=True",
+                       json={"db_name": db_name, "start": start, "end": end,
+                             "cursor": after, "limit": size},
+                       headers={"Authorization": token}),
+            memory.replication_timeout)
+    except (ConnectionError, asyncio.TimeoutError):
+        return None
+    if response.status_code != 200:
+        return None
+    return wire.response_data(response)["entries"]
 
 
 @app.route("/get", methods=["POST"])
 @auth.auth_required
 async def get_value(request):
     try:
-        json_args = request.json
+        json_args = load_body(request)
         json_args["token"] = request.headers["authorization"]
+        is_endpoint = "is_endpoint" in request.args
+        headers = None if is_endpoint \
+            else owner_hint(json_args, json_args["keys"])
+        data, status = await get_keys(json_args,
+                                      request.args.get("consistency"),
+                                      is_endpoint)
+        return reply(request, data, status=status, headers=headers)
+    except Exception as err:
+        return reply(request, {"message": f"getting value failed: {err}"},
+                     status=500)
+
+
+async def set_keys(json_args: dict, level: str = None,
+                   is_endpoint: bool = False, bulk: bool = False):
+    """
+    Write keys of /set request
+    :param json_args: token, db_name and keys of request
+    :param level: consistency level, write_consistency by default
+    :param is_endpoint: request is sent by other node to its replica
+    :param bulk: replica gets keys of /import, they are written
+                 without write-ahead log and synced before answer
+    :return: answer data and status
+    """
+    if is_endpoint:
+        await store_keys(json_args["token"], json_args["db_name"],
+                         json_args["keys"], bulk)
+        if bulk:
+            await shards.each("sync", sync_engine, {})
+        return json_args, 200
+
+    level = level or memory.write_consistency
+    memory.stamp(json_args["keys"])
+    failed = await replicate(json_args, level)
+    if failed:
+        return {"message": f"consistency level {level} "
+                           f"is not reached for keys: {failed}"}, 503
+    return json_args, 200
+
 
-        data = await memory.get_values(**json_args)
-        if not len(data["not_found_keys"]):
-            return json(data, status=200)
-
-        json_args["keys"] = data["not_found_keys"]
-        if "without_key" not in json_args:
-            json_args["without_key"] = []
-        json_args["without_key"].append(memory.self_url)
-
-        resp = await distribute(json_args, "/get",
-                                headers={"Authorization": json_args["token"]},
-                                is_quorum_get=True)
-        if resp.status == 200:
-            data = _json.loads(resp.body)
-            await memory.add_keys_from_other_node(**json_args, **data)
-        return resp
+async def get_keys(json_args: dict, level: str = None,
+                   is_endpoint: bool = False):
+    """
+    Read keys of /get request
+    :param json_args: token, db_name and keys of request
+    :param level: consistency level, read_consistency by default
+    :param is_endpoint: request is sent by other node to its replica
+    :return: answer data and status
+    """
+    if is_endpoint:
+        data = await load_values(json_args["token"], json_args["db_name"],
+                                 json_args["keys"])
+    else:
+        level = level or memory.read_consistency
+        data, failed = await read_quorum(json_args["token"],
+                                         json_args["db_name"],
+                                         json_args["keys"], level)
+        if failed:
+            return {"message": f"consistency level {level} "
+                               f"is not reached for keys: {failed}"}, 503
+
+    if json_args.get("versions"):
+        not_modified(data, json_args["versions"])
+    if not len(data["not_found_keys"]):
+        return data, 200
+    return data, 404
+
+
+def not_modified(data: dict, versions: dict):
+    """
+    Conditional get: entries which have versions known by client
+    are not sent again, their keys are listed in not_modified_keys
+    """
+    data["not_modified_keys"] = []
+    for key, version in versions.items():
+        entry = data["entries"].get(key)
+        if entry is not None and entry.get("version") == version:
+            del data["entries"][key]
+            data["not_modified_keys"].append(key)
+
+
+@app.route("/invalidations", methods=["GET"])
+@auth.auth_required
+async def get_invalidations(request):
+    """
+    Long polling of keys written after seq of client,
+    clients remove them from their near caches
+    """
+    try:
+        timeout = min(float(request.args.get("timeout",
+                                             memory.invalidation_timeout)),
+                      memory.invalidation_timeout)
+        data = await memory.invalidations.wait(
+            request.headers["authorization"], request.args.get("epoch"),
+            int(request.args.get("since", 0)), timeout)
+        return reply(request, data, status=200)
     except Exception as err:
-        return json({"message": f"getting value failed: {err}"},
-                    status=500)
+        return reply(request,
+                     {"message": f"getting invalidations failed: {str(err)}"},
+                     status=500)
+
+
+async def tcp_set(request: dict):
+    """/set over tcp, answer does not repeat written values"""
+    data, status = await set_keys(request, request.get("consistency"))
+    if status != 200:
+        return data, status
+    return {"keys": [key_data["key"] for key_data in data["keys"]]}, status
+
 
+async def tcp_get(request: dict):
+    """/get over tcp"""
+    return await get_keys(request, request.get("consistency"))
 
-async def distribute(data, url, headers=None, is_quorum_get: bool = False):
+
+tcp_handlers = {"set": tcp_set, "get": tcp_get}
+
+
+def load_body(request):
+    """Body of request encoded in json or msgpack"""
+    return wire.loads(request.body, request.content_type)
+
+
+def reply(request, data, status: int = 200, headers: dict = None):
+    """Answer in format asked by Accept header of request"""
+    content_type = wire.negotiate(request.headers.get("accept"))
+    if content_type == wire.JSON:
+        return json(data, status=status, headers=headers)
+    return raw(wire.dumps(data, content_type), status=status,
+               headers=headers, content_type=content_type)
+
+
+def owner_hint(json_args: dict, keys: list):
+    """
+    Headers which tell client that its partition map is stale:
+    request came to node which is not replica of some keys
     """
-    Send request to available nodes
+    if memory.owns(json_args["token"], json_args["db_name"], keys):
+        return None
+    return {wire.WRONG_OWNER_HEADER: "true"}
+
+
+def run_in_background(task):
+    """Keep reference to task until it is done"""
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def send(node, data, url, headers=None):
+    """
+    Send request to node
+    :return: True if node accepted request
+    """
+    try:
+        response = await asyncio.wait_for(
+            peers.post(node, url, json=data, headers=headers),
+            memory.replication_timeout)
+        return response.status_code < 500
+    except (ConnectionError, asyncio.TimeoutError):
+        return False
+
+
+async def distribute(data, url, headers=None, acks: int = None):
+    """
+    Send request to available nodes concurrently
     :param data: json data to send
     :param url: request part
     :param headers: http headers
-    :param is_quorum_get: flag to wait response after request
-    """
-    unreachable = set()
-    send_to = memory.get_cluster_nodes()
-    if is_quorum_get:
-        send_to = send_to.difference(set(data["without_key"]))
-    response = json(data, status=404)
-    for node in send_to:
-        try:
-            print(f"try send {url} to {node}")
-            response = await post(f"{node}{url}", json=data, headers=headers)
-            if is_quorum_get:
-                response = json(response.json(),
-                                status=response.status_code)
-                break
-        except ConnectionError:
-            unreachable.add(node)
-    memory.cluster_nodes.difference(unreachable)
-    return response
+    :param acks: number of successful responses to wait for,
+                 the rest of requests are finished in background,
+                 None means to wait for all nodes
+    :return: number of successful responses
+    """
+    loop = asyncio.get_event_loop()
+    pending = {loop.create_task(send(node, data, url, headers))
+               for node in memory.get_cluster_nodes()}
+    if acks is None:
+        acks = len(pending)
+
+    succeeded = 0
+    while pending and succeeded < acks:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED)
+        succeeded += sum(task.result() for task in done)
+
+    for task in pending:
+        run_in_background(task)
+    return succeeded
+
+
+async def store_keys(token: str, db_name: str, keys: list,
+                     bulk: bool = False):
+    """
+    Write keys owned by this node, every worker writes keys of its shard
+    :param bulk: keys are imported without write-ahead log
+    """
+    if bulk:
+        await shards.route("import_keys", memory.import_keys, token,
+                           db_name, keys, key=lambda key_data: key_data["key"])
+    else:
+        await shards.route("add_keys", memory.add_keys, token, db_name,
+                           keys, key=lambda key_data: key_data["key"])
+
+
+async def store_local(token: str, db_name: str, keys: list,
+                      bulk: bool = False):
+    """
+    Write keys owned by this node during replication
+    :return: True if keys are written
+    """
+    try:
+        await store_keys(token, db_name, keys, bulk)
+        return True
+    except Exception as err:
+        print(f"local write failed: {err}")
+        return False
+
+
+async def load_values(token: str, db_name: str, keys: list):
+    """
+    Read keys of this node from workers of their shards
+    :return: dict of founded values and not_found_keys
+    """
+    answers = await shards.route("get_values", memory.get_values, token,
+                                 db_name, keys)
+    if len(answers) == 1:
+        return answers[0]
+    data = {"entries": {}, "not_found_keys": []}
+    for answer in answers:
+        data["entries"].update(answer["entries"])
+        data["not_found_keys"].extend(answer["not_found_keys"])
+    return data
+
+
+async def scan_local(token: str, db_name: str, start: str, end: str,
+                     after: str, limit: int):
+    """Entries of this node in order of keys merged from all workers"""
+    pages = await shards.each("scan", memory.scan,
+                              {"token": token, "db_name": db_name,
+                               "start": start, "end": end, "after": after,
+                               "limit": limit})
+    if len(pages) == 1:
+        return pages[0]
+    # workers have different keys, so pages are just merged
+    entries = list(heapq.merge(*pages, key=lambda entry: entry["key"]))
+    return entries if limit is None else entries[:limit]
+
+
+async def add_cluster_urls(urls: list):
+    """Add nodes to membership, it is run by worker 0"""
+    await shards.run(0, "add_cluster_urls", memory.add_cluster_urls,
+                     {"urls": urls})
+
+
+async def deliver(node, token: str, db_name: str, keys: list,
+                  bulk: bool = False):
+    """
+    Write keys to replica, save hint for it if it is unreachable
+    :param bulk: keys of /import are written by replica without
+                 write-ahead log and memory tier
+    :return: True if node accepted keys
+    """
+    url = "/set?is_endpoint=True&bulk=True" if bulk \
+        else "/set?is_endpoint=True"
+    if await send(node, {"db_name": db_name, "keys": keys}, url,
+                  headers={"Authorization": token}):
+        known = memory.peer_filters.get((node, token, db_name))
+        if known is not None:
+            for key_data in keys:
+                known[0].add(key_data["key"])
+        return True
+    await memory.hints.add(node, token, db_name, keys)
+    return False
+
+
+async def replay_hints(node):
+    """Send hints saved for node while it was unreachable"""
+    hints = memory.hints
+    while True:
+        batch, offset = hints.read(node)
+        if not batch:
+            hints.commit(node, offset)
+            return
+        groups = {}
+        for hint in batch:
+            groups.setdefault((hint["token"], hint["db_name"]),
+                              []).extend(hint["keys"])
+        for (token, db_name), keys in groups.items():
+            if not await send(node, {"db_name": db_name, "keys": keys},
+                              "/set?is_endpoint=True",
+                              headers={"Authorization": token}):
+                return
+        hints.commit(node, offset)
+        await asyncio.sleep(len(batch) / hints.replay_rate)
+
+
+async def replicate(data, level: str, bulk: bool = False):
+    """
+    Write keys to nodes which own them
+    :param data: json data of /set request
+    :param level: consistency level: ONE, QUORUM or ALL
+    :param bulk: keys are imported without write-ahead log
+    :return: keys which did not reach consistency level
+    """
+    token, db_name = data["token"], data["db_name"]
+    # the last entry of duplicated key wins, every key is acked once
+    keys = {key_data["key"]: key_data for key_data in data["keys"]}
+    local = []
+    batches = {}
+    needed = {}
+    for key, key_data in keys.items():
+        replicas = memory.replicas(token, db_name, key)
+        needed[key] = memory.required_acks(level, len(replicas))
+        for node in replicas:
+            if node == memory.self_url:
+                local.append(key_data)
+            else:
+                batches.setdefault(node, []).append(key_data)
+
+    loop = asyncio.get_event_loop()
+    tasks = {}
+    for node, batch in batches.items():
+        task = loop.create_task(deliver(node, token, db_name, batch, bulk))
+        tasks[task] = batch
+    # local write goes together with replicas and is acked like them
+    if local:
+        task = loop.create_task(store_local(token, db_name, local, bulk))
+        tasks[task] = local
+
+    pending = set(tasks)
+    while pending and any(count > 0 for count in needed.values()):
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.result():
+                for key_data in tasks[task]:
+                    needed[key_data["key"]] -= 1
+
+    for task in pending:
+        run_in_background(task)
+    return [key for key, count in needed.items() if count > 0]
+
+
+async def fetch(node, token: str, db_name: str, keys: list):
+    """
+    Get keys from node
+    :return: dict of founded entries or None if node did not answer
+    """
+    try:
+        response = await asyncio.wait_for(
+            peers.post(node, "/get?is_endpoint=True",
+                       json={"db_name": db_name, "keys": keys},
+                       headers={"Authorization": token}),
+            memory.replication_timeout)
+    except (ConnectionError, asyncio.TimeoutError):
+        return None
+    if response.status_code not in (200, 404):
+        return None
+    return wire.response_data(response)["entries"]
+
+
+def peer_may_contain(node, token: str, db_name: str, key: str):
+    """
+    False if filter of node, which is not older than bloom_max_age,
+    tells that node does not have key. Stale filter is fetched again
+    """
+    if not memory.bloom_skip_peers:
+        return True
+    known = memory.peer_filters.get((node, token, db_name))
+    if known is None or time.monotonic() - known[1] > memory.bloom_max_age:
+        if (node, token, db_name) not in fetching_filters:
+            fetching_filters.add((node, token, db_name))
+            run_in_background(asyncio.ensure_future(
+                fetch_filter(node, token, db_name)))
+        return True
+    return key in known[0]
+
+
+async def fetch_filter(node, token: str, db_name: str):
+    """Get bloom filter of database from node"""
+    try:
+        response = await asyncio.wait_for(
+            peers.get(node, f"/bloom?db_name={db_name}",
+                      headers={"Authorization": token}),
+            memory.replication_timeout)
+        if response.status_code == 200:
+            data = wire.response_data(response)["bloom"]
+            # node without database has no keys of it
+            bloom = BloomFilter.from_dict(data) if data \
+                else BloomFilter(1, memory.bloom_error_rate)
+            memory.peer_filters[(node, token, db_name)] = (bloom,
+                                                           time.monotonic())
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    finally:
+        fetching_filters.discard((node, token, db_name))
+
+
+async def read_quorum(token: str, db_name: str, keys: list, level: str):
+    """
+    Read keys from their replicas in parallel
+    :param token: user`s token
+    :param db_name: name of user`s database
+    :param keys: list of keys to get
+    :param level: consistency level: ONE, QUORUM or ALL
+    :return: dict of founded values and not_found_keys,
+             keys which did not reach consistency level
+    """
+    local = await load_values(token, db_name, keys)
+    answers = {key: [] for key in keys}
+    needed = {}
+    batches = {}
+    for key in keys:
+        replicas = memory.replicas(token, db_name, key)
+        needed[key] = memory.required_acks(level, len(replicas))
+        if memory.self_url in replicas:
+            answers[key].append((memory.self_url,
+                                 local["entries"].get(key)))
+            needed[key] -= 1
+        peers = [node for node in replicas if node != memory.self_url]
+        maybe = [node for node in peers
+                 if peer_may_contain(node, token, db_name, key)]
+        # filter of replica is not its answer: replicas which filters
+        # miss key are asked only if other replicas are not enough
+        absent = [node for node in peers if node not in maybe]
+        for node in maybe + absent[:max(0, needed[key] - len(maybe))]:
+            batches.setdefault(node, []).append(key)
+
+    loop = asyncio.get_event_loop()
+    tasks = {}
+    for node, batch in batches.items():
+        batch = [key for key in batch if needed[key] > 0]
+        if batch:
+            task = loop.create_task(fetch(node, token, db_name, batch))
+            tasks[task] = (node, batch)
+
+    pending = set(tasks)
+    while pending and any(count > 0 for count in needed.values()):
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            entries = task.result()
+            if entries is None:
+                continue
+            node, batch = tasks[task]
+            for key in batch:
+                answers[key].append((node, entries.get(key)))
+                needed[key] -= 1
+    for task in pending:
+        task.cancel()
+
+    founded = {}
+    repairs = {}
+    for key in keys:
+        # this node may keep value of key which it does not own anymore
+        entries = [entry for _, entry in answers[key]]
+        entries.append(local["entries"].get(key))
+        newest = memory.newest(entries)
+        if newest is None:
+            continue
+        founded[key] = newest
+        for node, entry in answers[key]:
+            if entry is None or memory.newest([entry, newest]) is not entry:
+                repairs.setdefault(node, []).append(newest)
+    await read_repair(token, db_name, repairs)
+
+    not_found = [key for key in keys if key not in founded]
+    failed = [key for key, count in needed.items() if count > 0]
+    return {"entries": founded, "not_found_keys": not_found}, failed
+
+
+async def read_repair(token: str, db_name: str, repairs: dict):
+    """
+    Write newest values to replicas which answered with stale ones
+    :param repairs: dict of node and list of entries to write
+    """
+    local = repairs.pop(memory.self_url, None)
+    if local:
+        await store_keys(token, db_name, local)
+
+    loop = asyncio.get_event_loop()
+    for node, entries in repairs.items():
+        run_in_background(
+            loop.create_task(deliver(node, token, db_name, entries)))
+
+
+@app.route("/merkle", methods=["POST"])
+@auth.auth_required
+async def get_merkle_tree(request):
+    """
+    Merkle tree of keys shared with node from request
+    :return: root of tree and its leaves if they are requested
+    """
+    try:
+        token = request.headers["authorization"]
+        body = load_body(request)
+        trees = await node_trees(token, body["db_name"], body["node"])
+        tree = trees.get((token, body["db_name"]), {}).get(
+            body["node"], MerkleTree(memory.merkle_depth))
+        data = {"root": tree.root()}
+        if body.get("leaves"):
+            data["leaves"] = tree.hex_leaves()
+        return reply(request, data, status=200)
+    except Exception as err:
+        return reply(request, {"message": f"getting tree failed: {str(err)}"},
+                     status=500)
+
+
+@app.route("/merklerange", methods=["POST"])
+@auth.auth_required
+async def get_merkle_range(request):
+    """Entries shared with node from request which are in given buckets"""
+    try:
+        body = load_body(request)
+        entries = await node_bucket_entries(request.headers["authorization"],
+                                            body["db_name"], body["node"],
+                                            body["buckets"])
+        return reply(request, {"entries": entries}, status=200)
+    except Exception as err:
+        return reply(request,
+                     {"message": f"getting range failed: {str(err)}"},
+                     status=500)
+
+
+async def node_trees(token: str = None, db_name: str = None,
+                     node: str = None):
+    """
+    Merkle trees of keys shared with other replicas, trees of workers
+    are merged: xor of leaves makes tree of all their keys
+    :return: {(token, db_name): {node: MerkleTree}}
+    """
+    if shards.count == 1:
+        return await memory.merkle_trees()
+    answers = await shards.each("merkle_leaves", memory.merkle_leaves,
+                                {"token": token, "db_name": db_name,
+                                 "node": node})
+    trees = {}
+    for answer in answers:
+        for tree_token, tree_db, tree_node, leaves in answer:
+            db_trees = trees.setdefault((tree_token, tree_db), {})
+            if tree_node not in db_trees:
+                db_trees[tree_node] = MerkleTree(memory.merkle_depth)
+            db_trees[tree_node].merge(leaves)
+    return trees
+
+
+async def node_bucket_entries(token: str, db_name: str, node: str,
+                              buckets: list):
+    """Entries of all workers shared with node which are in buckets"""
+    answers = await shards.each("bucket_entries", memory.bucket_entries,
+                                {"token": token, "db_name": db_name,
+                                 "node": node, "buckets": buckets})
+    entries = {}
+    for answer in answers:
+        entries.update(answer)
+    return entries
+
+
+async def repair_with(node, token: str, db_name: str, tree: MerkleTree):
+    """
+    Compare merkle trees with node and exchange differing entries
+    :return: number of repaired entries
+    """
+    headers = {"Authorization": token}
+    request = {"db_name": db_name, "node": memory.self_url}
+    response = await peers.post(node, "/merkle", json=request,
+                                headers=headers)
+    if wire.response_data(response)["root"] == tree.root():
+        return 0
+    response = await peers.post(node, "/merkle",
+                                json=dict(request, leaves=True),
+                                headers=headers)
+    buckets = tree.diff(wire.response_data(response)["leaves"])
+
+    repaired = 0
+    for i in range(0, len(buckets), 16):
+        chunk = buckets[i:i + 16]
+        response = await peers.post(node, "/merklerange",
+                                    json=dict(request, buckets=chunk),
+                                    headers=headers)
+        remote = wire.response_data(response)["entries"]
+        local = await node_bucket_entries(token, db_name, node, chunk)
+
+        to_local = [entry for key, entry in remote.items()
+                    if memory.newest([local.get(key), entry]) is entry and
+                    local.get(key) != entry]
+        to_remote = [entry for key, entry in local.items()
+                     if memory.newest([remote.get(key), entry]) is entry and
+                     remote.get(key) != entry]
+        if to_local:
+            await store_keys(token, db_name, to_local)
+        if to_remote:
+            await send(node, {"db_name": db_name, "keys": to_remote},
+                       "/set?is_endpoint=True", headers=headers)
+        repaired += len(to_local) + len(to_remote)
+        # do not take bandwidth of client requests
+        await asyncio.sleep((len(remote) + len(local)) /
+                            memory.anti_entropy_rate)
+    return repaired
 
 
 @app.route("/mkcluster", methods=["POST"])
 async def connect_cluster(request):
     """
-    Send to all nodes information about new node in cluster
+    Add new node to cluster, other nodes learn about it by gossip
     :return: information about cluster nodes
     """
     try:
-        sender = request.json["sender_address"]
-        await distribute({"address": [sender]}, "/registernode")
+        sender = load_body(request)["sender_address"]
         addresses = list(memory.get_cluster_nodes())
         addresses.append(memory.self_url)
         if sender in addresses:
             addresses.remove(sender)
-        memory.add_cluster_urls([sender])
-        return json({"addresses": addresses,
-                     "api-keys": list(memory.api_keys)},
-                    status=200)
+        await add_cluster_urls([sender])
+        return reply(request, {"addresses": addresses}, status=200)
     except Exception as err:
-        return json({"message": f"making cluster failed: {str(err)}"},
-                    status=500)
+        return reply(request,
+                     {"message": f"making cluster failed: {str(err)}"},
+                     status=500)
+
+
+@app.route("/ping", methods=["POST"])
+async def ping(request):
+    """Answer to gossip ping and exchange membership updates"""
+    try:
+        updates = await shards.run(0, "gossip", gossip,
+                                   {"updates": load_body(request)["updates"]})
+    except ShardError as err:
+        return reply(request, {"message": f"ping failed: {err}"}, status=500)
+    return reply(request, {"updates": updates}, status=200)
+
+
+@app.route("/pingreq", methods=["POST"])
+async def ping_request(request):
+    """Ping target on behalf of node which could not reach it"""
+    body = load_body(request)
+    try:
+        data = await shards.run(0, "ping_target", ping_target,
+                                {"updates": body["updates"],
+                                 "target": body["target"]})
+    except ShardError as err:
+        return reply(request, {"message": f"ping failed: {err}"}, status=500)
+    return reply(request, data, status=200)
+
+
+def gossip(updates: list):
+    """
+    Apply membership updates of other node, only worker 0 keeps
+    membership, so workers of node do not disagree about cluster
+    :return: updates of this node
+    """
+    memory.membership.apply(updates)
+    return gossip_updates()
+
+
+async def ping_target(updates: list, target: str):
+    memory.membership.apply(updates)
+    ack = await probe(target)
+    return {"ack": ack, "updates": gossip_updates()}
+
+
+def gossip_updates():
+    return memory.membership.updates() + [memory.membership.self_update()]
+
+
+async def publish_cluster_view():
+    """
+    Send cluster nodes to other workers whenever membership
+    of worker 0 changes, so all workers use the same hash ring
+    """
+    # worker 0 was restarted: nodes known by other workers are kept
+    for index in range(1, shards.count):
+        try:
+            data = await shards.call(index, "cluster_view", {})
+            memory.add_cluster_urls(data["nodes"])
+        except ShardError:
+            pass
+    NodeInfo.cluster_changed = changed = asyncio.Event()
+    while True:
+        changed.clear()
+        view = memory.get_cluster_view()
+        await asyncio.gather(*[
+            send_cluster_view(index, view)
+            for index in range(1, shards.count)])
+        await changed.wait()
+
+
+async def send_cluster_view(index: int, view: dict):
+    try:
+        await shards.call(index, "apply_cluster_view", view)
+    except ShardError as err:
+        # worker which is started again asks for view itself
+        print(f"cluster view is not sent: {err}")
+
+
+async def fetch_cluster_view():
+    """Cluster nodes of started worker are taken from worker 0"""
+    while True:
+        try:
+            memory.apply_cluster_view(**await shards.call(0, "cluster_view",
+                                                          {}))
+            return
+        except ShardError:
+            await asyncio.sleep(memory.gossip_period)
+
+
+async def probe(node):
+    """
+    Ping node directly
+    :return: True if node answered in time
+    """
+    try:
+        response = await asyncio.wait_for(
+            peers.post(node, "/ping", json={"updates": gossip_updates()}),
+            memory.gossip_timeout)
+    except (ConnectionError, asyncio.TimeoutError):
+        return False
+    if response.status_code != 200:
+        return False
+    memory.membership.alive(node)
+    memory.membership.apply(wire.response_data(response)["updates"])
+    return True
+
+
+async def indirect_probe(helper, node):
+    """
+    Ask helper to ping node
+    :return: True if node answered to helper
+    """
+    try:
+        response = await asyncio.wait_for(
+            peers.post(helper, "/pingreq",
+                       json={"target": node, "updates": gossip_updates()}),
+            memory.gossip_timeout * 2)
+    except (ConnectionError, asyncio.TimeoutError):
+        return False
+    if response.status_code != 200:
+        return False
+    data = wire.response_data(response)
+    memory.membership.apply(data["updates"])
+    return data["ack"]
 
 
 @app.route("/registernode", methods=["POST"])
 async def register_node(request):
     """ Add new node address to local list of nodes """
-    memory.add_cluster_urls(request.json["address"])
-    return json(request.json, status=200)
+    body = load_body(request)
+    await add_cluster_urls(body["address"])
+    return reply(request, body, status=200)
 
 
 @app.route("/registerkey", methods=["POST"])
+@peer_auth.auth_required
 async def register_key(request):
-    """Add new api key to local keys storage"""
-    await memory.add_client_api_key(request.json["token"])
-    return json(request.json, status=200)
+    """Apply registrations and revocations of api keys from other node"""
+    body = load_body(request)
+    # nodes of old versions send raw tokens
+    tokens = body.get("tokens", []) + ([body["token"]] if "token" in body
+                                       else [])
+    if tokens:
+        await memory.add_client_api_keys(tokens)
+    records = await memory.apply_token_records(body.get("records", []))
+    if any(record.get("revoked") for record in records):
+        await refresh_tokens()
+    return reply(request, body, status=200)
+
+
+async def refresh_tokens():
+    """Other workers read revocations at once, not after refresh_interval"""
+    if shards.count > 1:
+        await shards.each("refresh_tokens", memory.api_keys.refresh,
+                          {"force": True})
+
+
+@app.route("/tokensync", methods=["POST"])
+@peer_auth.auth_required
+async def token_sync(request):
+    """
+    Compare merkle tree of api keys with tree of other node
+    :return: differing buckets and local records of them
+    """
+    try:
+        buckets = memory.api_keys.tree.diff(load_body(request)["leaves"])
+    except (KeyError, TypeError, ValueError) as err:
+        return reply(request, {"message": f"wrong leaves: {err}"},
+                     status=400)
+    return reply(request, {"buckets": buckets,
+                           "records": memory.api_keys.records(buckets)},
+                 status=200)
+
+
+async def sync_tokens(node):
+    """
+    Exchange api keys of buckets which differ with node,
+    so only a small part of key set is sent
+    :return: number of received and sent records
+    """
+    api_keys = memory.api_keys
+    response = await peers.post(node, "/tokensync",
+                                json={"leaves": api_keys.tree.hex_leaves()})
+    if response.status_code != 200:
+        raise ValueError(f"token sync failed with {response.status_code}")
+    data = wire.response_data(response)
+    # taken before records of node are applied
+    local = api_keys.records(data["buckets"])
+    received = await api_keys.apply(data["records"])
+    if local:
+        await send(node, {"records": local}, "/registerkey")
+    return len(received) + len(local)
+
+
+# operations which workers of node run for each other
+shard_ops = shard_handlers({
+    "add_keys": memory.add_keys,
+    "import_keys": memory.import_keys,
+    "get_values": memory.get_values,
+    "scan": memory.scan,
+    "sync": sync_engine,
+    "filter": memory.filter_dict,
+    "merkle_leaves": memory.merkle_leaves,
+    "bucket_entries": memory.bucket_entries,
+    "add_cluster_urls": memory.add_cluster_urls,
+    "gossip": gossip,
+    "ping_target": ping_target,
+    "cluster_view": memory.get_cluster_view,
+    "apply_cluster_view": memory.apply_cluster_view,
+    "refresh_tokens": lambda force: memory.api_keys.refresh(force),
+    "invalidate": lambda token, db_name, keys:
+        memory.invalidations.add(token, db_name, keys),
+    "invalidations": lambda token, epoch, seq, timeout:
+        memory.invalidations.wait(token, epoch, seq, timeout)})
 
 
 class Node:
@@ -149,8 +1165,33 @@ class Node:
                 ("connections", 1): lambda self: self.print_connections()}
 
     def __init__(self, seed_host: str = None, seed_port: int = None,
-                 debug: bool = False):
+                 debug: bool = False, storage_engine: str = "log",
+                 wal: dict = None, cache: dict = None,
+                 replication: dict = None, hinted_handoff: dict = None,
+                 anti_entropy: dict = None, gossip: dict = None,
+                 tcp: dict = None, invalidations: dict = None,
+                 bulk_import: dict = None, scan: dict = None,
+                 bloom: dict = None, snapshot: dict = None,
+                 auth: dict = None, workers: dict = None):
         self.debug = debug
+        self.storage_engine = storage_engine
+        self.wal = wal
+        self.cache = cache
+        self.replication = replication
+        self.hinted_handoff = hinted_handoff
+        self.anti_entropy = anti_entropy
+        self.gossip = gossip
+        self.tcp = tcp
+        self.invalidations = invalidations
+        self.bulk_import = bulk_import
+        self.scan = scan
+        self.bloom = bloom
+        self.snapshot = snapshot
+        self.auth = auth or {}
+        self.workers = workers or {}
+        self.tcp_server = None
+        self.shard_server = None
+        self.peers = peers
         self.seed_host = seed_host
         self.seed_port = seed_port
         self.__seed_url = None
@@ -167,11 +1208,184 @@ class Node:
 
     def run(self, host: str = None, port: int = None, debug: bool = False,
             access_log: bool = False):
-        """Starting Sanic"""
-        memory.self_url = f"http://{host}:{port}"
-        app.add_task(self.main_loop())
+        """Starting Sanic, node with several workers forks them"""
+        count = self.workers.get("count", 1)
+        self.check_workers(count)
+        if count > 1:
+            self.run_workers(host, port, count, debug, access_log)
+            return
+        self.setup(host, port)
         app.run(host, port, debug=debug, access_log=access_log)
 
+    def run_workers(self, host: str, port: int, count: int,
+                    debug: bool = False, access_log: bool = False):
+        """
+        Fork workers which accept connections of one port (SO_REUSEPORT),
+        every worker stores its shard of keys and sends operations
+        on keys of other shards to their workers.
+        Worker which failed is started again
+        """
+        secret = secrets.token_hex(16)
+        context = multiprocessing.get_context("fork")
+
+        def start(index):
+            process = context.Process(
+                target=self.run_worker,
+                args=(host, port, index, count, secret, debug, access_log))
+            process.start()
+            return process
+
+        processes = {index: start(index) for index in range(count)}
+        # workers are stopped by finally when node is terminated
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            while processes:
+                multiprocessing.connection.wait(
+                    [process.sentinel for process in processes.values()])
+                for index, process in list(processes.items()):
+                    if process.is_alive():
+                        continue
+                    if process.exitcode == 0:
+                        # worker was stopped, node is shutting down
+                        del processes[index]
+                    else:
+                        print(f"worker {index} failed with code "
+                              f"{process.exitcode}, restarting")
+                        processes[index] = start(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes.values():
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def run_worker(self, host: str, port: int, index: int, count: int,
+                   secret: str, debug: bool = False,
+                   access_log: bool = False):
+        """Process of worker, its data is in ./data/worker-{index}"""
+        root = os.path.join("./data", f"worker-{index}")
+        shards.index, shards.count, shards.secret = index, count, secret
+        shards.port = self.workers.get("port", port + 200)
+        if index == 0:
+            # views of restarted worker 0 replace views of the failed one
+            NodeInfo.cluster_view = [uuid.uuid4().hex, 0]
+        # descriptor inherited from parent does not exclude other workers
+        memory.api_keys.close()
+        memory.api_keys.load()
+        self.wal = dict(self.wal or {}, path=os.path.join(root, "wal.log"))
+        self.hinted_handoff = dict(self.hinted_handoff or {},
+                                   root=os.path.join(root, "hints"))
+        self.snapshot = dict(self.snapshot or {},
+                             path=os.path.join(root, "snapshot"))
+        self.setup(host, port, root)
+        # versions written by workers differ by node id
+        memory.clock.node_id = f"{memory.self_url}#{index}"
+        if index != 0:
+            NodeInfo.invalidations = ForwardedInvalidations(shards)
+        sock = socket.create_server((host, port), reuse_port=True)
+        app.run(sock=sock, debug=debug, access_log=access_log,
+                single_process=True)
+
+    @staticmethod
+    def check_workers(count: int, path: str = "./data/workers.json"):
+        """
+        Keys of node are split by number of its workers, data written
+        by other number of workers can not be read
+        """
+        known = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                known = wire.loads(f.read())["count"]
+        elif any(True for _ in FilePerKeyEngine(
+                os.path.dirname(path)).databases()):
+            known = 1
+        if known is not None and known != count:
+            raise SystemExit(f"data of node is written by {known} workers, "
+                             f"it can not be read by {count} workers")
+        with open(path, "wb") as f:
+            f.write(wire.dumps({"count": count}))
+
+    def setup(self, host: str, port: int, root: str = "./data"):
+        """Apply settings and add background tasks of node"""
+        memory.set_self_url(f"http://{host}:{port}")
+        memory.configure(storage_engine=self.storage_engine, wal=self.wal,
+                         cache=self.cache, replication=self.replication,
+                         hinted_handoff=self.hinted_handoff,
+                         anti_entropy=self.anti_entropy,
+                         gossip=self.gossip,
+                         invalidations=self.invalidations,
+                         bulk_import=self.bulk_import,
+                         scan=self.scan, bloom=self.bloom,
+                         snapshot=self.snapshot, root=root)
+        shards.timeout = memory.replication_timeout
+        if self.replication and "max_connections" in self.replication:
+            self.peers.max_connections = self.replication["max_connections"]
+        if self.replication and "wire_format" in self.replication:
+            self.peers.content_type = wire.content_type(
+                self.replication["wire_format"])
+        token_batcher.interval = self.auth.get("batch_interval",
+                                               token_batcher.interval)
+        token_batcher.max_size = self.auth.get("max_batch",
+                                               token_batcher.max_size)
+        NodeInfo.token_ttl = self.auth.get("token_ttl", memory.token_ttl)
+        memory.api_keys.refresh_interval = self.auth.get(
+            "refresh_interval", memory.api_keys.refresh_interval)
+        auth.cache_size = self.auth.get("cache_size", auth.cache_size)
+        peer_auth.secret_key = self.auth.get("cluster_secret")
+        if peer_auth.secret_key is None:
+            print("auth.cluster_secret is not set: api keys are not "
+                  "shared and writes are not replicated to other nodes")
+        else:
+            self.peers.headers[peer_auth.header] = peer_auth.secret_key
+        if shards.index == 0:
+            # admin commands, comparison of merged trees of workers
+            # and membership, other workers use its cluster view
+            app.add_task(self.main_loop())
+            app.add_task(self.anti_entropy_loop())
+            app.add_task(self.gossip_loop())
+            if shards.count > 1:
+                app.add_task(publish_cluster_view())
+        else:
+            app.add_task(fetch_cluster_view())
+        app.add_task(self.handoff_loop())
+        app.add_task(self.snapshot_loop())
+        if not memory.ready:
+            app.add_task(memory.prewarm())
+        if self.tcp:
+            app.add_task(self.serve_tcp(host))
+        if shards.count > 1:
+            app.add_task(self.serve_shards())
+        app.register_listener(self.close_connections, "after_server_stop")
+
+    async def serve_tcp(self, host: str):
+        """Listen pipelined tcp protocol next to http api"""
+        loop = asyncio.get_event_loop()
+        max_pipeline = self.tcp.get("max_pipeline", 1024)
+        self.tcp_server = await loop.create_server(
+            lambda: StorageProtocol(tcp_handlers, memory.is_valid_token,
+                                    max_pipeline=max_pipeline),
+            host, self.tcp["port"], reuse_port=shards.count > 1)
+        self.debug_print(f"tcp protocol on {host}:{self.tcp['port']}")
+
+    async def serve_shards(self):
+        """Listen operations sent by other workers of node"""
+        loop = asyncio.get_event_loop()
+        self.shard_server = await loop.create_server(
+            lambda: StorageProtocol(shard_ops, shards.verify),
+            shards.host, shards.port + shards.index)
+        self.debug_print(f"worker {shards.index} of {shards.count} "
+                         f"on port {shards.port + shards.index}")
+
+    async def close_connections(self, *args):
+        for server in (self.tcp_server, self.shard_server):
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+        shards.close()
+        await self.peers.close()
+        await memory.write_snapshot()
+
     @staticmethod
     async def print_connections():
         print(memory.cluster_nodes)
@@ -190,17 +1404,86 @@ class Node:
         except Exception as e:
             self.debug_print(str(e))
 
+    async def handoff_loop(self):
+        """Deliver hints to nodes which became reachable"""
+        while True:
+            await asyncio.sleep(memory.hints.interval)
+            for node in memory.hints.nodes():
+                if node in memory.get_cluster_nodes():
+                    try:
+                        await replay_hints(node)
+                    except Exception as e:
+                        self.debug_print(f"hints replay failed: {str(e)}")
+
+    async def snapshot_loop(self):
+        """Save index, filters and hot keys for fast restart"""
+        interval = (self.snapshot or {}).get("interval", 300.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await memory.write_snapshot()
+            except Exception as e:
+                self.debug_print(f"snapshot failed: {str(e)}")
+
+    async def gossip_loop(self):
+        """SWIM failure detection: ping one node every protocol period"""
+        membership = memory.membership
+        while True:
+            await asyncio.sleep(memory.gossip_period)
+            membership.expire_suspects()
+            node = membership.next_target()
+            if node is None or await probe(node):
+                continue
+            helpers = membership.helpers(node, memory.gossip_indirect_probes)
+            acks = await asyncio.gather(
+                *[indirect_probe(helper, node) for helper in helpers])
+            if not any(acks):
+                self.debug_print(f"{node} is suspected")
+                membership.suspect(node)
+
+    async def anti_entropy_loop(self):
+        """Compare data with other replicas and repair differences"""
+        while True:
+            await asyncio.sleep(memory.anti_entropy_interval)
+            for node in list(memory.get_cluster_nodes()):
+                try:
+                    synced = await sync_tokens(node)
+                    if synced:
+                        self.debug_print(
+                            f"synced {synced} api keys with {node}")
+                except (ConnectionError, ValueError, KeyError) as e:
+                    self.debug_print(f"api keys sync failed: {str(e)}")
+            try:
+                db_trees = await node_trees()
+            except ShardError as e:
+                self.debug_print(f"repair failed: {str(e)}")
+                continue
+            for (token, db_name), trees in list(db_trees.items()):
+                for node, tree in list(trees.items()):
+                    if node not in memory.get_cluster_nodes():
+                        continue
+                    try:
+                        repaired = await repair_with(node, token, db_name,
+                                                     tree)
+                        if repaired:
+                            self.debug_print(
+                                f"repaired {repaired} keys with {node}")
+                    except (ConnectionError, ValueError, KeyError,
+                            ShardError) as e:
+                        self.debug_print(f"repair failed: {str(e)}")
+
     async def connect_cluster(self):
         """Take information about cluster from seed_node"""
         if not self.seed_url:
             self.debug_print("There is no seed server")
             return None
         try:
-            response = await post(f"{self.seed_url}/mkcluster",
-                                  json={"sender_address": memory.self_url})
-            data = response.json()
-            memory.add_cluster_urls(data["addresses"])
-            memory.api_keys.update(data["api-keys"])
+            response = await self.peers.post(
+                self.seed_url, "/mkcluster",
+                json={"sender_address": memory.self_url})
+            data = wire.response_data(response)
+            await add_cluster_urls(data["addresses"])
+            await sync_tokens(self.seed_url)
             return True
         except ConnectionError:
             self.debug_print(f"Seed node in unreachable")
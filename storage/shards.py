@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import itertools
+from storage import wire
+from storage.tcp_server import encode_frame, read_frame
+
+# Workers of one node split its keys by shard_of(), every worker stores
+# keys of its shard in ./data/worker-{index}. Operations on keys of other
+# shards are sent to their workers by the pipelined tcp protocol
+# (see tcp_server) on 127.0.0.1:{port + index}
+# Request: {"id": 1, "op": "get_values", "token": secret, "args": {..}}
+
+
+def shard_of(token: str, db_name: str, key: str, count: int) -> int:
+    """Index of worker which stores key"""
+    if count == 1:
+        return 0
+    digest = hashlib.md5(f"{token}\0{db_name}\0{key}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class ShardError(Exception):
+    """Other worker did not answer or could not handle operation"""
+
+
+class ShardConnection:
+    """
+    Persistent connection to other worker: requests are pipelined
+    and their answers are matched by id
+    """
+
+    def __init__(self, host: str, port: int,
+                 content_type: str = wire.JSON):
+        self.host = host
+        self.port = port
+        self.content_type = content_type
+        self._ids = itertools.count(1)
+        self._writer = None
+        self._waiters = {}
+        self._lock = None
+
+    async def _connect(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            reader, self._writer = await asyncio.open_connection(
+                self.host, self.port)
+            # waiters of lost connection are not mixed with new ones
+            self._waiters = {}
+            asyncio.ensure_future(self._read_answers(reader, self._writer,
+                                                     self._waiters))
+
+    async def _read_answers(self, reader, writer, waiters: dict):
+        try:
+            while True:
+                answer, _ = await read_frame(reader)
+                future = waiters.pop(answer.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(answer)
+        except (asyncio.IncompleteReadError, OSError, ValueError):
+            pass
+        finally:
+            writer.close()
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(ShardError(
+                        f"connection to worker {self.port} is lost"))
+            waiters.clear()
+
+    async def request(self, message: dict) -> dict:
+        """Send request and wait for its answer"""
+        try:
+            await self._connect()
+        except OSError as err:
+            raise ShardError(f"worker {self.port} is unreachable: {err}")
+        request_id = next(self._ids)
+        waiters = self._waiters
+        future = asyncio.get_event_loop().create_future()
+        waiters[request_id] = future
+        try:
+            self._writer.write(encode_frame(dict(message, id=request_id),
+                                            self.content_type))
+            await self._writer.drain()
+            return await future
+        finally:
+            waiters.pop(request_id, None)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Shards:
+    """Workers of node: index of this worker and connections to others"""
+
+    def __init__(self, index: int = 0, count: int = 1, port: int = None,
+                 secret: str = None, timeout: float = 2.0,
+                 host: str = "127.0.0.1"):
+        """
+        :param index: number of this worker
+        :param count: number of workers of node
+        :param port: worker i listens 127.0.0.1:port + i
+        :param secret: token of requests between workers
+        :param timeout: max time of operation of other worker in seconds
+        """
+        self.index = index
+        self.count = count
+        self.port = port
+        self.secret = secret
+        self.timeout = timeout
+        self.host = host
+        self.content_type = wire.content_type("msgpack")
+        self._connections = {}
+
+    def owner(self, token: str, db_name: str, key: str) -> int:
+        return shard_of(token, db_name, key, self.count)
+
+    def split(self, token: str, db_name: str, items: list,
+              key=lambda item: item) -> dict:
+        """Items grouped by index of worker which owns their keys"""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.owner(token, db_name, key(item)),
+                              []).append(item)
+        return groups
+
+    async def verify(self, secret) -> bool:
+        """Token verifier of tcp protocol between workers"""
+        return self.secret is not None and secret == self.secret
+
+    async def call(self, index: int, op: str, args: dict,
+                   timeout: float = None):
+        """
+        Run operation on other worker
+        :return: data of its answer
+        """
+        connection = self._connections.get(index)
+        if connection is None:
+            connection = ShardConnection(self.host, self.port + index,
+                                         self.content_type)
+            self._connections[index] = connection
+        try:
+            answer = await asyncio.wait_for(
+                connection.request({"op": op, "token": self.secret,
+                                    "args": args}),
+                timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise ShardError(f"worker {index} did not answer {op} in time")
+        if answer["status"] != 200:
+            raise ShardError(f"worker {index} failed {op}: "
+                             f"{answer['data'].get('message')}")
+        return answer["data"]
+
+    async def run(self, index: int, op: str, local, args: dict):
+        """Run operation on this worker by local function or on other one"""
+        if index != self.index:
+            return await self.call(index, op, args)
+        result = local(**args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def each(self, op: str, local, args: dict) -> list:
+        """Results of operation run by every worker"""
+        if self.count == 1:
+            return [await self.run(self.index, op, local, args)]
+        return list(await asyncio.gather(
+            *[self.run(index, op, local, args)
+              for index in range(self.count)]))
+
+    async def route(self, op: str, local, token: str, db_name: str,
+                    items: list, key=lambda item: item) -> list:
+        """
+        Send items to workers which own their keys, every worker gets
+        token, db_name and keys - list of its items
+        :return: results of workers which got items
+        """
+        if self.count == 1:
+            return [await self.run(self.index, op, local,
+                                   {"token": token, "db_name": db_name,
+                                    "keys": items})]
+        groups = self.split(token, db_name, items, key)
+        return list(await asyncio.gather(
+            *[self.run(index, op, local, {"token": token, "db_name": db_name,
+                                          "keys": group})
+              for index, group in groups.items()]))
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections = {}
+
+
+def handlers(methods: dict) -> dict:
+    """Handlers of tcp protocol which call methods with args of request"""
+    def handler(method):
+        async def handle(request: dict):
+            result = method(**request.get("args", {}))
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result, 200
+        return handle
+    return {op: handler(method) for op, method in methods.items()}
+
+
+class ForwardedInvalidations:
+    """
+    Invalidation log kept by other worker: written keys are sent to it
+    and long polling of clients waits for its answer
+    """
+
+    def __init__(self, shards: Shards, owner: int = 0):
+        self.shards = shards
+        self.owner = owner
+        self._tasks = set()
+
+    def add(self, token: str, db_name: str, keys: list):
+        task = asyncio.ensure_future(self.shards.call(
+            self.owner, "invalidate",
+            {"token": token, "db_name": db_name, "keys": keys}))
+        self._tasks.add(task)
+        task.add_done_callback(self._sent)
+
+    def _sent(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"invalidation is not sent: {task.exception()}")
+
+    async def wait(self, token: str, epoch: str, seq: int,
+                   timeout: float):
+        return await self.shards.call(
+            self.owner, "invalidations",
+            {"token": token, "epoch": epoch, "seq": seq,
+             "timeout": timeout},
+            timeout=timeout + self.shards.timeout)
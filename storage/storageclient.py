@@ -2,11 +2,16 @@
 import sys
 import os
 from requests import get, post
-from requests import ConnectionError
+from requests import ConnectionError, Timeout
+from requests.exceptions import ChunkedEncodingError
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import threading
 import time
 import json
 from json.decoder import JSONDecodeError
+from storage import wire
+from storage.node_health import NodeHealth
+from storage.near_cache import NearCache
 from PyQt5.QtCore import QObject, pyqtSignal
 
 
@@ -24,13 +29,28 @@ class ServiceSignal(QObject):
         self.onService.emit(message)
 
 
+class CachedResponse:
+    """Answer of /get assembled from near cache and cluster answer"""
+
+    def __init__(self, data: dict):
+        self.status_code = 404 if data["not_found_keys"] else 200
+        self.content = wire.dumps(data)
+        self.headers = {"content-type": wire.JSON}
+
+    def json(self):
+        return wire.loads(self.content)
+
+
 class StorageClient:
     """Implements client"""
 
     """commands and methods to handle each command"""
     commands = {"auth": lambda self, req: self.do_auth(),
+                "revoke": lambda self, req: self.do_revoke(),
                 "get": lambda self, req: self.do_get(req),
                 "set": lambda self, req: self.do_set(req),
+                "import": lambda self, req: self.do_import(req),
+                "scan": lambda self, req: self.do_scan(req),
                 "exit": lambda self, req: self.exit()}
 
     config_path = "client_conf.json"
@@ -42,7 +62,11 @@ class StorageClient:
                  debug: bool = False,
                  blocking: bool = True,
                  with_checker: bool = True,
-                 checker_interval: int = 20):
+                 checker_interval: int = 20,
+                 wire_format: str = "json",
+                 timeout: float = 10.0,
+                 hedged_reads: bool = False,
+                 near_cache: dict = None):
         self.err_signal = CriticalErrorSignal()
         self.service_signal = ServiceSignal()
 
@@ -53,6 +77,20 @@ class StorageClient:
         self.blocking = blocking
         self.with_checker = with_checker
         self.checker_interval = checker_interval
+        self.content_type = wire.content_type(wire_format)
+        self.timeout = timeout
+        self.hedged_reads = hedged_reads
+        self.health = NodeHealth()
+        self.hedge_pool = ThreadPoolExecutor(max_workers=2) \
+            if hedged_reads else None
+        # near_cache: enabled, max_entries, ttl, invalidations, poll_timeout
+        near_cache = near_cache or {}
+        self.near_cache = NearCache(near_cache.get("max_entries", 10000),
+                                    near_cache.get("ttl", 5.0)) \
+            if near_cache.get("enabled") else None
+        self.invalidations = near_cache.get("invalidations", False)
+        self.poll_timeout = near_cache.get("poll_timeout", 30.0)
+        self.watchers = {}
         self.is_stopping = False
 
     @staticmethod
@@ -127,6 +165,7 @@ class StorageClient:
         if not response_cluster_inf:
             sys.exit(1)
 
+        self.watch_invalidations()
         if self.with_checker:
             checker = threading.Thread(target=self.run_checker)
             checker.start()
@@ -154,6 +193,17 @@ class StorageClient:
         while not self.is_stopping:
             time.sleep(self.checker_interval)
             self.do_cluster_info(checker=True)
+            self.check_nodes()
+            self.watch_invalidations()
+
+    def check_nodes(self):
+        """Measure latency of every node to choose the fastest one"""
+        for node_url in list(self.cluster_nodes):
+            self.timed_request(lambda url, headers:
+                               get(f"{url}/clusterinfo",
+                                   timeout=self.timeout),
+                               node_url, None)
+        return self.health.stats()
 
     def handle_command(self, inp):
         """
@@ -176,32 +226,54 @@ class StorageClient:
 
     def do_auth(self):
         response = self.send_request(lambda url, headers:
-                                     post(f"{url}/auth"), with_auth=False)
+                                     post(f"{url}/auth",
+                                          timeout=self.timeout),
+                                     with_auth=False)
 
         if response is None:
             self.d_print(f"(do_auth) no servers are available")
             return None
 
-        api_key = response.json()["api-key"]
+        api_key = self.load_response(response)["api-key"]
         self.api_key = api_key
         with open(StorageClient.api_key_path, "w") as f:
             f.write(api_key)
 
         return response
 
+    def do_revoke(self):
+        """Revoke api key of client on all nodes"""
+        response = self.send_request(lambda url, headers:
+                                     post(f"{url}/revokekey",
+                                          headers=headers,
+                                          timeout=self.timeout))
+
+        if response is None:
+            self.d_print(f"(do_revoke) no servers are available")
+            return None
+
+        if response.status_code == 200:
+            self.api_key = None
+            if os.path.exists(StorageClient.api_key_path):
+                os.remove(StorageClient.api_key_path)
+
+        return response
+
     def do_cluster_info(self, checker=False):
         if not checker:
             self.d_print("(do_cluster_info) sending")
         response = self.send_request(lambda url, headers:
                                      get(f"{url}/clusterinfo",
-                                         headers=headers), with_auth=False)
+                                         headers=headers,
+                                         timeout=self.timeout),
+                                     with_auth=False)
         if response is None:
             if not checker:
                 self.d_print(
                     f"(do_cluster_info) no servers are available")
             return None
 
-        urls = response.json()["addresses"]
+        urls = self.load_response(response)["addresses"]
         self.cluster_nodes.update(urls)
         if not checker:
             self.d_print(
@@ -233,19 +305,89 @@ class StorageClient:
         except ValueError:
             raise
 
-        response = self.send_request(
-            lambda url, headers: post(f"{url}/get",
-                                      json=json_data,
-                                      headers=headers))
+        if self.near_cache is not None:
+            response = self.cached_get(json_data)
+        else:
+            response = self.send_get(json_data)
         if response is None:
             self.d_print(f"(do_get) no servers are available")
             return None
         self.d_print(
             f"(do_get) response status_code: {response.status_code}")
 
-        print(response.json())
+        print(self.load_response(response))
         return response
 
+    def send_get(self, json_data):
+        return self.send_request(
+            lambda url, headers: post(f"{url}/get",
+                                      data=self.dump_request(json_data),
+                                      headers=headers,
+                                      timeout=self.timeout),
+            hedge=self.hedged_reads)
+
+    def cached_get(self, json_data):
+        """
+        Get keys through near cache: fresh entries are taken from cache,
+        expired ones are requested with their versions and
+        are not sent again if they were not modified
+        :return: response object
+        """
+        db_name = json_data["db_name"]
+        fresh, expired, missing = self.near_cache.lookup(db_name,
+                                                         json_data["keys"])
+        data = {"entries": fresh, "not_found_keys": []}
+        if expired or missing:
+            response = self.send_get(
+                {"db_name": db_name, "keys": list(expired) + missing,
+                 "versions": {key: entry["version"]
+                              for key, entry in expired.items()}})
+            if response is None or response.status_code not in (200, 404):
+                return response
+            answer = self.load_response(response)
+            data["entries"].update(answer["entries"])
+            data["entries"].update(
+                self.near_cache.update(db_name, answer, expired))
+            data["not_found_keys"] = answer["not_found_keys"]
+        return CachedResponse(data)
+
+    def watch_invalidations(self):
+        """Start long polling of invalidations of nodes which are new"""
+        if self.near_cache is None or not self.invalidations:
+            return
+        for node_url in list(self.cluster_nodes):
+            if node_url not in self.watchers:
+                self.watchers[node_url] = threading.Thread(
+                    target=self.run_invalidations, args=(node_url,),
+                    daemon=True)
+                self.watchers[node_url].start()
+
+    def run_invalidations(self, node_url):
+        """Remove keys written on node from near cache"""
+        epoch, seq = "", 0
+        while not self.is_stopping:
+            try:
+                response = get(
+                    f"{node_url}/invalidations",
+                    params={"epoch": epoch, "since": seq,
+                            "timeout": self.poll_timeout},
+                    headers=wire.headers(self.content_type,
+                                         {"Authorization": self.api_key}),
+                    timeout=self.poll_timeout + self.timeout)
+            except (ConnectionError, Timeout):
+                time.sleep(self.checker_interval)
+                continue
+            if response.status_code != 200:
+                time.sleep(self.checker_interval)
+                continue
+            data = self.load_response(response)
+            if data.get("reset"):
+                # writes after seq are unknown
+                self.near_cache.clear()
+            for db_name, key in data.get("keys", []):
+                self.near_cache.invalidate(db_name, key)
+            epoch, seq = data["epoch"], data["seq"]
+
     def do_set(self, args):
         """
         Send POST request to set pairs key:value to storage
@@ -270,10 +412,15 @@ class StorageClient:
         except ValueError:
             raise
 
+        if self.near_cache is not None:
+            for key_data in data["keys"]:
+                self.near_cache.invalidate(data["db_name"], key_data["key"])
+
         response = self.send_request(lambda url, headers:
                                      post(f"{url}/set",
-                                          json=data,
-                                          headers=headers))
+                                          data=self.dump_request(data),
+                                          headers=headers,
+                                          timeout=self.timeout))
         if response is None:
             self.d_print(f"(do_set) no servers are available")
             return None
@@ -281,23 +428,197 @@ class StorageClient:
         self.d_print(
             f"(do_set) response status_code: {response.status_code}")
 
-        print(response.json())
+        print(self.load_response(response))
+        return response
+
+    def do_import(self, args):
+        """
+        Stream file of json lines {"key": .., "value": ..} to /import,
+        file is not loaded in memory
+        :param args: string with schema: db_name filename [consistency]
+        :return: response object
+        """
+        args = args.split(" ")
+        if len(args) < 2:
+            raise ValueError("(do_import) 2 arguments were expected "
+                             "but less given")
+        db_name, filename = args[0], args[1]
+        if not os.path.exists(filename):
+            raise ValueError("file does not exist")
+        url = f"/import?db_name={db_name}"
+        if len(args) > 2:
+            url += f"&consistency={args[2]}"
+
+        if self.near_cache is not None:
+            self.near_cache.clear()
+
+        # every tried node gets the whole file, server answers
+        # when the last batch is written, so there is no read timeout
+        response = self.send_request(
+            lambda node_url, headers: post(
+                f"{node_url}{url}",
+                data=self.read_chunks(filename),
+                headers=dict(headers, **{"Content-Type": wire.NDJSON}),
+                timeout=(self.timeout, None)))
+        if response is None:
+            self.d_print(f"(do_import) no servers are available")
+            return None
+
+        self.d_print(
+            f"(do_import) response status_code: {response.status_code}")
+
+        print(self.load_response(response))
         return response
 
-    def send_request(self, request, with_auth=True):
-        headers = {"Authorization": self.api_key} if with_auth else None
-        response = None
-        for node_url in self.cluster_nodes:
+    def do_scan(self, args):
+        """
+        Print entries of database in order of keys
+        :param args: string with schema: db_name [prefix]
+        """
+        args = args.split(" ")
+        if not args[0]:
+            raise ValueError("(do_scan) db_name was expected")
+        prefix = args[1] if len(args) > 1 else None
+        count = 0
+        for entry in self.scan(args[0], prefix=prefix):
+            print(entry)
+            count += 1
+        self.d_print(f"(do_scan) {count} entries")
+        return count
+
+    def scan(self, db_name, prefix=None, start=None, end=None,
+             limit=None, cursor=None):
+        """
+        Iterate over entries of database in order of keys, entries are
+        read from chunked response one by one. If stream breaks,
+        scan is resumed from the last received key on other node
+        :param prefix: keys start with prefix
+        :param start: the first key of range
+        :param end: key after the range
+        :param limit: max number of entries
+        :param cursor: key to continue previous scan after it
+        """
+        attempts = 0
+        while limit is None or limit > 0:
+            data = {"db_name": db_name, "prefix": prefix, "start": start,
+                    "end": end, "cursor": cursor, "limit": limit}
+            response = self.send_request(
+                lambda url, headers: post(f"{url}/scan",
+                                          data=self.dump_request(data),
+                                          headers=headers, stream=True,
+                                          timeout=self.timeout))
+            if response is None:
+                raise ConnectionError("no servers are available")
+            if response.status_code != 200:
+                raise ValueError(self.load_response(response)["message"])
+            attempts += 1
             try:
-                response = request(node_url, headers)
-                break
-            except ConnectionError:
-                pass
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    if "key" not in entry:
+                        return
+                    attempts = 0
+                    cursor = entry["key"]
+                    if limit is not None:
+                        limit -= 1
+                    yield entry
+            except (ConnectionError, ChunkedEncodingError, Timeout):
+                self.health.failure(response.url.split("/scan")[0])
+            finally:
+                response.close()
+            if attempts > len(self.cluster_nodes):
+                raise ConnectionError("scan is interrupted by every node")
+
+    def read_chunks(self, filename, chunk_size: int = 1024 * 1024):
+        """Read file by chunks and print progress of sending"""
+        size = os.path.getsize(filename)
+        sent = 0
+        with open(filename, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                self.d_print(f"(do_import) sent {sent} of {size} bytes")
+                yield chunk
+
+    def dump_request(self, data) -> bytes:
+        """Encode request body in wire format of client"""
+        return wire.dumps(data, self.content_type)
+
+    @staticmethod
+    def load_response(response):
+        """Decode json or msgpack body of response"""
+        return wire.response_data(response)
+
+    def timed_request(self, request, node_url, headers):
+        """
+        Send request to node and update its health statistics
+        :return: response or None if node did not answer
+        """
+        started = time.monotonic()
+        try:
+            response = request(node_url, headers)
+        except (ConnectionError, Timeout):
+            self.health.failure(node_url)
+            return None
+        if response.status_code >= 500:
+            self.health.failure(node_url)
+        else:
+            self.health.success(node_url, time.monotonic() - started)
         return response
 
+    def hedged_request(self, request, nodes, headers):
+        """
+        Send request to the first node and, if it does not answer
+        in its p95 latency, to the second node too
+        :return: the first response or None and number of tried nodes
+        """
+        futures = [self.hedge_pool.submit(self.timed_request, request,
+                                          nodes[0], headers)]
+        done, _ = wait(futures, timeout=self.health.percentile(nodes[0]))
+        if not done:
+            futures.append(self.hedge_pool.submit(self.timed_request,
+                                                  request, nodes[1],
+                                                  headers))
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result() is not None:
+                    return future.result(), len(futures)
+        return None, len(futures)
+
+    def send_request(self, request, with_auth=True, hedge=False):
+        """
+        Send request to the first node which answers,
+        nodes are tried from the fastest healthy one
+        :param request: function(url, headers) which sends request
+        :param hedge: request is read which can be sent to two nodes
+        :return: response or None if no servers are available
+        """
+        headers = wire.headers(
+            self.content_type,
+            {"Authorization": self.api_key} if with_auth else None)
+        nodes = self.health.order(self.cluster_nodes)
+        if hedge and self.hedge_pool is not None and len(nodes) > 1:
+            response, tried = self.hedged_request(request, nodes, headers)
+            if response is not None:
+                return response
+            nodes = nodes[tried:]
+        for node_url in nodes:
+            response = self.timed_request(request, node_url, headers)
+            if response is not None:
+                return response
+        return None
+
     def exit(self):
         """Stop Client"""
         self.is_stopping = True
+        if self.hedge_pool is not None:
+            self.hedge_pool.shutdown(wait=False)
 
     def d_print(self, message: str):
         """Print message if debug"""
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import asyncio
+import struct
+from storage import wire
+
+
+# Frame: 4 bytes big-endian length of body, 1 byte format of body, body
+# Format 0 is json, 1 is msgpack, answer is encoded like request
+# Request: {"id": 1, "op": "get", "token": "..", "consistency": "ONE",
+#           "db_name": "..", "keys": [..]}
+# Answer: {"id": 1, "status": 200, "data": {..}}
+# Answers of pipelined requests may come in any order, id matches them
+
+HEADER = struct.Struct("!IB")
+FORMATS = [wire.JSON, wire.MSGPACK]
+
+
+def encode_frame(message: dict, content_type: str = wire.JSON) -> bytes:
+    body = wire.dumps(message, content_type)
+    return HEADER.pack(len(body), FORMATS.index(content_type)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """
+    Read one frame from stream
+    :return: decoded message and its content type
+    """
+    length, fmt = HEADER.unpack(await reader.readexactly(HEADER.size))
+    content_type = FORMATS[fmt]
+    return wire.loads(await reader.readexactly(length), content_type), \
+        content_type
+
+
+class StorageProtocol(asyncio.Protocol):
+    """
+    Pipelined request/response protocol over persistent connection:
+    every request is handled in its own task, so one connection
+    keeps many requests in flight
+    """
+
+    def __init__(self, handlers: dict, token_verifier,
+                 max_pipeline: int = 1024,
+                 max_frame: int = 64 * 1024 * 1024):
+        """
+        :param handlers: op name and coroutine(request) -> (data, status)
+        :param token_verifier: coroutine(token) -> True if token is valid
+        :param max_pipeline: max number of requests in flight,
+                             connection is not read while it is reached
+        :param max_frame: max size of request body in bytes
+        """
+        self.handlers = handlers
+        self.token_verifier = token_verifier
+        self.max_pipeline = max_pipeline
+        self.max_frame = max_frame
+        self.transport = None
+        self.tasks = set()
+        self._buffer = bytearray()
+        self._reading = True
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        for task in self.tasks:
+            task.cancel()
+        # let handlers waiting for write see closed transport
+        self._writable.set()
+
+    def pause_writing(self):
+        self._writable.clear()
+
+    def resume_writing(self):
+        self._writable.set()
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= HEADER.size:
+            length, fmt = HEADER.unpack_from(self._buffer)
+            if length > self.max_frame or fmt >= len(FORMATS):
+                self.transport.close()
+                return
+            if len(self._buffer) < HEADER.size + length:
+                break
+            body = bytes(self._buffer[HEADER.size:HEADER.size + length])
+            del self._buffer[:HEADER.size + length]
+            task = asyncio.get_event_loop().create_task(
+                self.handle(body, FORMATS[fmt]))
+            self.tasks.add(task)
+            task.add_done_callback(self._finished)
+
+        if len(self.tasks) >= self.max_pipeline and self._reading:
+            self._reading = False
+            self.transport.pause_reading()
+
+    def _finished(self, task):
+        self.tasks.discard(task)
+        if not self._reading and len(self.tasks) < self.max_pipeline and \
+                not self.transport.is_closing():
+            self._reading = True
+            self.transport.resume_reading()
+
+    async def handle(self, body: bytes, content_type: str):
+        """Answer one request"""
+        request_id = None
+        try:
+            request = wire.loads(body, content_type)
+            request_id = request.get("id")
+            handler = self.handlers.get(request.get("op"))
+            if handler is None:
+                data, status = {"message": f"unknown op: "
+                                           f"{request.get('op')}"}, 400
+            elif not await self.token_verifier(request.get("token")):
+                data, status = {"message": "Auth required."}, 401
+            else:
+                data, status = await handler(request)
+        except Exception as err:
+            data, status = {"message": f"request failed: {str(err)}"}, 500
+
+        await self._writable.wait()
+        if not self.transport.is_closing():
+            # msgpack request is answered in json if msgpack is not installed
+            self.transport.write(encode_frame(
+                {"id": request_id, "status": status, "data": data},
+                wire.negotiate(content_type)))
@@ -1,4 +1,6 @@
+import hmac
 from functools import wraps
+from collections import OrderedDict
 from sanic import exceptions
 
 
@@ -6,18 +8,51 @@ class SanicTokenAuth:
     def __init__(self,
                  header="Authorization",
                  token_verifier=None,
-                 secret_key=None
+                 secret_key=None,
+                 generation=None,
+                 cache_size=10000
                  ):
+        """
+        :param generation: function which returns number changing
+                           whenever result of token_verifier may change,
+                           results are cached only if it is given
+        :param cache_size: max number of cached results
+        """
         self.secret_key = secret_key
         self.header = header
         self.token_verifier = token_verifier
+        self.generation = generation
+        self.cache_size = cache_size
+        # token -> (generation, result of token_verifier)
+        self.cache = OrderedDict()
 
     async def _is_authenticated(self, request):
         token = (request.headers.get(self.header, None) if self.header
                  else request.token)
         if self.token_verifier:
+            return await self._verify(token)
+        # without secret_key nobody is authenticated
+        return (self.secret_key is not None and token is not None
+                and hmac.compare_digest(token, self.secret_key))
+
+    async def _verify(self, token):
+        if self.generation is None or not self.cache_size:
             return await self.token_verifier(token)
-        return token == self.secret_key
+        generation = self.generation()
+        cached = self.cache.get(token)
+        if cached is not None and cached[0] == generation:
+            self.cache.move_to_end(token)
+            return cached[1]
+        result = await self.token_verifier(token)
+        self.cache[token] = (generation, result)
+        self.cache.move_to_end(token)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    async def is_authenticated(self, request) -> bool:
+        """For handlers which need auth only for some requests"""
+        return await self._is_authenticated(request)
 
     def auth_required(self, handler=None):
         @wraps(handler)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+import os
+import json
+import math
+import time
+import fcntl
+import asyncio
+import hashlib
+from storage.merkle import MerkleTree
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenLog:
+    """
+    Append-only log of hashes of api tokens with their expiry and
+    revocation: registration appends lines instead of rewriting the
+    whole file, the log is compacted when most of its lines are not
+    needed. Several processes may share the log, each of them reads
+    records appended by others in refresh()
+    """
+
+    def __init__(self, path: str = "./data/api_keys.log",
+                 compact_min_lines: int = 10000,
+                 refresh_interval: float = 0.1, depth: int = 8):
+        """
+        :param path: file of the log
+        :param compact_min_lines: log shorter than it is not compacted
+        :param refresh_interval: how often (in seconds) the log is checked
+                                 for records of other processes
+        :param depth: depth of merkle tree of hashes used by sync
+        """
+        self.path = path
+        self.compact_min_lines = compact_min_lines
+        self.refresh_interval = refresh_interval
+        self.depth = depth
+        # hash of token -> (expiry time or None, revoked)
+        self.entries = {}
+        self.tree = MerkleTree(depth)
+        # changes when set of valid tokens changes
+        self.generation = 0
+        self.lines = 0
+        self._offset = 0
+        self._inode = None
+        self._checked = 0.0
+        self._next_expiry = math.inf
+        self._fd = None
+        self._lock = None
+
+    @staticmethod
+    def record(token: str, ttl: float = None) -> dict:
+        """Record of new token which expires in ttl seconds"""
+        return {"hash": hash_token(token),
+                "expires": None if ttl is None else time.time() + ttl}
+
+    def valid(self, token: str) -> bool:
+        """Token was registered, is not revoked and is not expired"""
+        entry = self.entries.get(hash_token(token))
+        if entry is None or entry[1]:
+            return False
+        return entry[0] is None or entry[0] > time.time()
+
+    def __contains__(self, token):
+        return self.valid(token)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, legacy_path: str = None):
+        """
+        Read records from the log
+        :param legacy_path: api_keys.json of old versions, its tokens
+                            are moved to the log
+        """
+        self._reset()
+        legacy = self._read() if os.path.exists(self.path) else False
+        if legacy_path is not None and os.path.exists(legacy_path):
+            with open(legacy_path, "r") as f:
+                for token in json.load(f)["api_keys"]:
+                    self._apply(self.record(token))
+            legacy = True
+        self.open()
+        if legacy:
+            self.compact()
+        else:
+            self._truncate_torn()
+        if legacy_path is not None and os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def _truncate_torn(self):
+        """Cut a torn record, otherwise next record is appended to it"""
+        self._lock_file()
+        try:
+            self._read()
+            if os.path.getsize(self.path) > self._offset:
+                os.truncate(self.path, self._offset)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.entries = {}
+        self.tree = MerkleTree(self.depth)
+        self.lines = 0
+        self._offset = 0
+        self._inode = None
+        self._next_expiry = math.inf
+        self.generation += 1
+
+    def _read(self) -> bool:
+        """
+        Apply records appended after the last read one
+        :return: True if log has records of old versions with raw tokens
+        """
+        legacy = False
+        changed = False
+        with open(self.path, "rb") as f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._offset)
+            for line in f:
+                # a torn record at the end of log is ignored
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                self.lines += 1
+                record = json.loads(line)
+                if "token" in record:
+                    legacy = True
+                    record = self.record(record["token"])
+                changed |= self._apply(record)
+        if changed:
+            self.generation += 1
+        return legacy
+
+    def _apply(self, record: dict) -> bool:
+        """
+        Merge record into entries: revocation wins over registration
+        :return: True if entries were changed
+        """
+        expires = record.get("expires")
+        if expires is not None and expires <= time.time():
+            return False
+        token_hash = record["hash"]
+        revoked = bool(record.get("revoked"))
+        old = self.entries.get(token_hash)
+        if old is not None:
+            if old[1] or not revoked:
+                return False
+            self.tree.remove(token_hash, list(old))
+            expires = old[0]
+        self.entries[token_hash] = (expires, revoked)
+        self.tree.add(token_hash, [expires, revoked])
+        if expires is not None:
+            self._next_expiry = min(self._next_expiry, expires)
+        return True
+
+    def _purge(self, now: float):
+        """Forget expired tokens, they are not written by compaction"""
+        expired = [token_hash for token_hash, (expires, _)
+                   in self.entries.items()
+                   if expires is not None and expires <= now]
+        for token_hash in expired:
+            self.tree.remove(token_hash, list(self.entries.pop(token_hash)))
+        self._next_expiry = min((expires for expires, _
+                                 in self.entries.values()
+                                 if expires is not None), default=math.inf)
+        self.generation += 1
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Apply records written by other processes and drop expired tokens
+        :param force: check the log even if it was checked recently
+        :return: generation, it changes when any token becomes
+                 valid or invalid
+        """
+        now = time.time()
+        if now >= self._next_expiry:
+            self._purge(now)
+        if not force and now - self._checked < self.refresh_interval:
+            return self.generation
+        self._checked = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.generation
+        if stat.st_ino != self._inode:
+            # log was compacted by other process
+            self._reset()
+            self._read()
+        elif stat.st_size > self._offset:
+            self._read()
+        return self.generation
+
+    def open(self):
+        self._fd = os.open(self.path,
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _lock_file(self):
+        """
+        Lock the log against compaction by other processes, log which
+        was replaced by compaction is reopened
+        """
+        while True:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_ino == os.stat(self.path).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self.close()
+            self.open()
+
+    async def add(self, tokens: list, ttl: float = None) -> list:
+        """Register tokens which expire in ttl seconds"""
+        return await self.apply([self.record(token, ttl)
+                                 for token in tokens])
+
+    async def revoke(self, tokens: list) -> list:
+        """Revoke tokens, revocation is kept until token expires"""
+        records = []
+        for token in tokens:
+            token_hash = hash_token(token)
+            entry = self.entries.get(token_hash)
+            records.append({"hash": token_hash,
+                            "expires": entry[0] if entry else None,
+                            "revoked": True})
+        return await self.apply(records)
+
+    async def apply(self, records: list) -> list:
+        """
+        Append records which change known tokens by one write and fsync
+        :param records: dicts with hash, expires and optional revoked
+        :return: applied records, other nodes should get them
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self.refresh()
+            fresh = [record for record in records if self._apply(record)]
+            if not fresh:
+                return []
+            self.generation += 1
+            data = "".join(json.dumps(self._line(record)) + "\n"
+                           for record in fresh).encode()
+            self._lock_file()
+            try:
+                written = 0
+                while written < len(data):
+                    written += os.write(self._fd, data[written:])
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, os.fsync, self._fd)
+            # own records are read back with records of other processes
+            self.refresh(force=True)
+            if self.lines > max(self.compact_min_lines,
+                                2 * len(self.entries)):
+                self.compact()
+            return [self._line(record) for record in fresh]
+
+    @staticmethod
+    def _line(record: dict) -> dict:
+        line = {"hash": record["hash"], "expires": record.get("expires")}
+        if record.get("revoked"):
+            line["revoked"] = True
+        return line
+
+    def records(self, buckets: list = None) -> list:
+        """
+        Records of known tokens
+        :param buckets: only tokens of these buckets of merkle tree
+        """
+        wanted = None if buckets is None else set(buckets)
+        return [self._line({"hash": token_hash, "expires": expires,
+                            "revoked": revoked})
+                for token_hash, (expires, revoked) in self.entries.items()
+                if wanted is None or self.tree.bucket(token_hash) in wanted]
+
+    def compact(self):
+        """Rewrite log with one line per known token"""
+        if self._fd is not None:
+            self._lock_file()
+            if os.path.getsize(self.path) > self._offset:
+                self._read()
+        self._purge(time.time())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for record in self.records():
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+            inode = os.fstat(f.fileno()).st_ino
+        os.rename(tmp_path, self.path)
+        self.lines = len(self.entries)
+        self._offset = size
+        self._inode = inode
+        if self._fd is not None:
+            # processes waiting for the lock reopen the new log
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self.close()
+            self.open()
+
+
+class TokenBatcher:
+    """
+    Tokens of concurrent requests are handled by one call
+    of flush(tokens) in at most interval seconds
+    """
+
+    def __init__(self, flush, interval: float = 0.005, max_size: int = 1000):
+        """
+        :param flush: coroutine function which gets list of tokens
+        :param interval: max delay of the first token of batch
+        :param max_size: batch of this size is flushed at once
+        """
+        self.flush = flush
+        self.interval = interval
+        self.max_size = max_size
+        self._batch = []
+        self._future = None
+        self._timer = None
+        self._tasks = set()
+
+    async def add(self, token: str):
+        """Wait until batch with token is flushed"""
+        loop = asyncio.get_event_loop()
+        if self._future is None:
+            self._future = loop.create_future()
+            self._batch = []
+            self._timer = loop.call_later(self.interval, self._start)
+        future = self._future
+        self._batch.append(token)
+        if len(self._batch) >= self.max_size:
+            self._timer.cancel()
+            self._start()
+        await future
+
+    def _start(self):
+        batch, future = self._batch, self._future
+        self._batch, self._future = [], None
+        task = asyncio.ensure_future(self.flush(batch))
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finish(done, future))
+
+    def _finish(self, task, future):
+        self._tasks.discard(task)
+        if task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(None)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import os
+import json
+import asyncio
+
+
+# WAL record is a json line:
+# {"token": "token", "db_name": "db_name", "keys": [{"key": .., "value": ..}]}
+
+FSYNC_POLICIES = ("always", "interval", "os")
+
+
+class WriteAheadLog:
+    """
+    Log of /set requests with group commit:
+    records appended by concurrent requests are written
+    by one write call followed by one fsync
+    """
+
+    def __init__(self, path: str = "./data/wal.log",
+                 fsync: str = "always",
+                 fsync_interval_ms: int = 100,
+                 checkpoint_size: int = 16 * 1024 * 1024,
+                 on_checkpoint=None):
+        """
+        :param path: file of the log
+        :param fsync: "always" - fsync every group before answering,
+                      "interval" - fsync not often than fsync_interval_ms,
+                      "os" - let OS decide when to flush
+        :param fsync_interval_ms: interval for "interval" policy
+        :param checkpoint_size: size of log to make checkpoint
+        :param on_checkpoint: callback to make applied data durable
+                              before the log is truncated, it may return
+                              awaitable
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.checkpoint_size = checkpoint_size
+        self.on_checkpoint = on_checkpoint
+        self.commits = 0
+        self._fd = None
+        self._size = 0
+        self._pending = []
+        self._committer = None
+        self._syncer = None
+        self._dirty = False
+
+    def open(self):
+        self._fd = os.open(self.path,
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._syncer is not None:
+            self._syncer.cancel()
+            self._syncer = None
+
+    def replay(self):
+        """Iterate over records of the log, torn tail is skipped"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+    def truncate(self):
+        """Drop records which are already durable in storage engine"""
+        os.ftruncate(self._fd, 0)
+        os.fsync(self._fd)
+        self._size = 0
+        self._dirty = False
+
+    async def append(self, record: dict):
+        """Wait until the record is written according to fsync policy"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append(((json.dumps(record) + "\n").encode(), future))
+        if self._committer is None or self._committer.done():
+            self._committer = loop.create_task(self._commit_loop())
+        if self.fsync == "interval" and \
+                (self._syncer is None or self._syncer.done()):
+            self._syncer = loop.create_task(self._sync_loop())
+        await future
+
+    async def _commit_loop(self):
+        loop = asyncio.get_event_loop()
+        while self._pending:
+            # let concurrent requests join the group
+            await asyncio.sleep(0)
+            group, self._pending = self._pending, []
+            data = b"".join(record for record, _ in group)
+            try:
+                await loop.run_in_executor(None, self._write, data)
+            except Exception as err:
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(err)
+                continue
+            for _, future in group:
+                if not future.done():
+                    future.set_result(None)
+
+            if self._size >= self.checkpoint_size:
+                # writers of the group apply their records right after
+                # waking up, so one loop iteration is enough to see them
+                await asyncio.sleep(0)
+                if self.on_checkpoint is not None:
+                    durable = self.on_checkpoint()
+                    if durable is not None:
+                        await durable
+                self.truncate()
+
+    async def _sync_loop(self):
+        loop = asyncio.get_event_loop()
+        while self._fd is not None:
+            await asyncio.sleep(self.fsync_interval)
+            if self._dirty:
+                self._dirty = False
+                await loop.run_in_executor(None, os.fsync, self._fd)
+
+    def _write(self, data: bytes):
+        written = 0
+        while written < len(data):
+            written += os.write(self._fd, data[written:])
+        self._size += len(data)
+        self.commits += 1
+        if self.fsync == "always":
+            os.fsync(self._fd)
+        elif self.fsync == "interval":
+            self._dirty = True
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+
+FORMATS = {"json": JSON, "msgpack": MSGPACK}
+
+# header of answer of node which is not replica of requested keys
+WRONG_OWNER_HEADER = "X-Wrong-Owner"
+
+
+def content_type(name: str = "json") -> str:
+    """
+    Content type of wire format, msgpack falls back to json
+    if it is not installed
+    :param name: json or msgpack
+    """
+    if name not in FORMATS:
+        raise ValueError(f"unknown wire format: {name}")
+    if FORMATS[name] == MSGPACK and msgpack is None:
+        return JSON
+    return FORMATS[name]
+
+
+def _mime(header) -> str:
+    return (header or "").split(";")[0].strip().lower()
+
+
+def negotiate(accept: str) -> str:
+    """Content type of response to request with given Accept header"""
+    accepted = [_mime(item) for item in (accept or "").split(",")]
+    if msgpack is not None and MSGPACK in accepted:
+        return MSGPACK
+    return JSON
+
+
+def dumps(data, content_type: str = JSON) -> bytes:
+    if content_type == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data).encode()
+
+
+def loads(body: bytes, content_type: str = JSON):
+    """
+    Decode message body, everything except msgpack is parsed as json
+    :param content_type: value of Content-Type header
+    """
+    if not body:
+        return None
+    if _mime(content_type) == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return json.loads(body)
+
+
+def headers(content_type: str, headers: dict = None) -> dict:
+    """Headers of request with body in content_type, answer is asked in it"""
+    return dict(headers or {}, **{"Content-Type": content_type,
+                                  "Accept": content_type})
+
+
+def response_data(response):
+    """Decoded body of requests/requests_async response"""
+    return loads(response.content, response.headers.get("content-type"))
+
+
+class StreamDecoder:
+    """
+    Incremental decoder of stream of messages: json lines
+    or concatenated msgpack messages
+    """
+
+    def __init__(self, content_type: str = NDJSON):
+        self.msgpack = _mime(content_type) == MSGPACK
+        if self.msgpack:
+            if msgpack is None:
+                raise ValueError("msgpack is not installed")
+            self._unpacker = msgpack.Unpacker(raw=False,
+                                              strict_map_key=False)
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> list:
+        """Messages which are completed by chunk"""
+        if self.msgpack:
+            self._unpacker.feed(chunk)
+            return list(self._unpacker)
+        lines = (self._tail + chunk).split(b"\n")
+        self._tail = lines.pop()
+        return [json.loads(line) for line in lines if line.strip()]
+
+    def close(self) -> list:
+        """Message of the last line without line break"""
+        tail, self._tail = self._tail, b""
+        if not self.msgpack and tail.strip():
+            return [json.loads(tail)]
+        return []
@@ -0,0 +1,161 @@
+import os
+import sys
+import asyncio
+import unittest
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from requests_async import ConnectionError
+from storage import wire
+from storage.hash_ring import HashRing
+from storage.async_storageclient import AsyncStorageClient, SyncStorageClient
+
+
+class Response:
+    def __init__(self, status_code, data, headers=None):
+        self.status_code = status_code
+        self.content = wire.dumps(data)
+        self.headers = dict(headers or {}, **{"content-type": wire.JSON})
+
+
+class Peers:
+    """Cluster of nodes which keep every key with value equal to key"""
+
+    def __init__(self, down=(), fail=(), nodes=None, wrong_owner=()):
+        self.down = set(down)
+        self.fail = set(fail)
+        self.nodes = nodes
+        self.wrong_owner = set(wrong_owner)
+        self.maps = 0
+        self.delays = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    async def request(self, method, node, path, json=None, headers=None):
+        if node in self.down:
+            raise ConnectionError()
+        if path == "/partitionmap":
+            self.maps += 1
+            if self.nodes is None:
+                return Response(404, {})
+            return Response(200, {"nodes": self.nodes, "vnodes": 64,
+                                  "replication_factor": 1})
+        self.requests.append((node, path, json))
+        headers = {wire.WRONG_OWNER_HEADER: "true"} \
+            if node in self.wrong_owner else None
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delays.get(node, 0.01))
+        self.in_flight -= 1
+        if path.startswith("/get"):
+            keys = [key for key in json["keys"] if key not in self.fail]
+            missing = [key for key in json["keys"] if key in self.fail]
+            return Response(404 if missing else 200,
+                            {"entries": {key: {"key": key, "value": key}
+                                         for key in keys},
+                             "not_found_keys": missing}, headers)
+        if any(key_data["key"] in self.fail for key_data in json["keys"]):
+            return Response(503, {"message": "consistency level"})
+        return Response(200, json, headers)
+
+    async def close(self):
+        pass
+
+
+class TestAsyncStorageClient(aiounittest.AsyncTestCase):
+
+    def client(self, peers):
+        client = AsyncStorageClient("127.0.0.1", 9090, api_key="token",
+                                    batch_size=10)
+        client.peers = peers
+        return client
+
+    async def test_get_many_sends_batches_concurrently(self):
+        peers = Peers(fail={"k5"})
+        keys = [f"k{i}" for i in range(95)]
+        result = await self.client(peers).get_many("db", keys)
+        self.assertEqual(len(peers.requests), 10)
+        self.assertEqual(peers.max_in_flight, 10)
+        self.assertEqual(len(result["entries"]), 94)
+        self.assertEqual(result["not_found_keys"], ["k5"])
+        self.assertEqual(result["failed_keys"], [])
+
+    async def test_set_many_reports_failed_batches(self):
+        peers = Peers(fail={"k3"})
+        items = {f"k{i}": i for i in range(25)}
+        result = await self.client(peers).set_many("db", items, "ALL")
+        self.assertEqual(len(result["keys"]), 15)
+        self.assertEqual(result["failed_keys"], [f"k{i}" for i in range(10)])
+        self.assertTrue(all(path == "/set?consistency=ALL"
+                            for _, path, _ in peers.requests))
+
+    async def test_unreachable_node_is_skipped(self):
+        peers = Peers(down={"http://127.0.0.1:9090"})
+        client = self.client(peers)
+        client.cluster_nodes.add("http://127.0.0.2:9090")
+        result = await client.get_many("db", ["a"])
+        self.assertEqual(result["entries"], {"a": {"key": "a", "value": "a"}})
+        self.assertEqual(peers.requests[0][0], "http://127.0.0.2:9090")
+
+    async def test_keys_are_sent_to_their_owners(self):
+        nodes = [f"http://127.0.0.{i}:9090" for i in range(1, 4)]
+        peers = Peers(nodes=nodes)
+        client = self.client(peers)
+        keys = [f"k{i}" for i in range(60)]
+        result = await client.get_many("db", keys)
+        self.assertEqual(len(result["entries"]), 60)
+        ring = HashRing(nodes)
+        for node, _, body in peers.requests:
+            for key in body["keys"]:
+                self.assertEqual(ring.preference_list(
+                    HashRing.key_id("token", "db", key), 1), [node])
+        self.assertEqual({node for node, _, _ in peers.requests}, set(nodes))
+
+    async def test_wrong_owner_hint_refreshes_partition_map(self):
+        nodes = ["http://127.0.0.1:9090"]
+        peers = Peers(nodes=nodes, wrong_owner=nodes)
+        client = self.client(peers)
+        await client.get_many("db", ["a"])
+        self.assertTrue(client.ring_is_stale)
+        await client.set_many("db", {"a": 1})
+        self.assertEqual(peers.maps, 2)
+
+    async def test_slow_read_is_hedged_to_other_node(self):
+        slow, fast = "http://127.0.0.1:9090", "http://127.0.0.2:9090"
+        peers = Peers()
+        client = self.client(peers)
+        client.hedged_reads = True
+        client.cluster_nodes.add(fast)
+        for _ in range(20):
+            client.health.success(slow, 0.001)
+            client.health.success(fast, 0.002)
+        peers.delays = {slow: 1.0}
+        result = await asyncio.wait_for(client.get_many("db", ["a"]), 0.5)
+        self.assertEqual(result["entries"], {"a": {"key": "a", "value": "a"}})
+        self.assertEqual([node for node, _, _ in peers.requests],
+                         [slow, fast])
+
+    async def test_keys_fail_when_no_servers_are_available(self):
+        peers = Peers(down={"http://127.0.0.1:9090"})
+        result = await self.client(peers).get_many("db", ["a", "b"])
+        self.assertEqual(result["failed_keys"], ["a", "b"])
+
+
+class TestSyncStorageClient(unittest.TestCase):
+
+    def test_blocking_calls_run_in_loop_of_client(self):
+        client = SyncStorageClient("127.0.0.1", 9090, api_key="token")
+        client.client.peers = Peers()
+        result = client.set_many("db", {"a": 1})
+        self.assertEqual(result["keys"], ["a"])
+        self.assertEqual(client.get_many("db", ["a"])["entries"]["a"]["value"],
+                         "a")
+        client.close()
+        self.assertFalse(client.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.bloom import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_added_keys_are_always_found(self):
+        bloom = BloomFilter(1000)
+        keys = [f"key{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertFalse(bloom.full)
+
+    def test_false_positive_rate_is_near_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"key{i}")
+        positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(positives, 300)
+
+    def test_filter_is_full_after_capacity(self):
+        bloom = BloomFilter(10)
+        for _ in range(3):
+            bloom.add("same")
+        self.assertEqual(bloom.count, 1)
+        for i in range(10):
+            bloom.add(f"key{i}")
+        self.assertTrue(bloom.full)
+
+    def test_filter_is_restored_from_dict(self):
+        bloom = BloomFilter(100)
+        bloom.add("key")
+        restored = BloomFilter.from_dict(bloom.to_dict())
+        self.assertIn("key", restored)
+        self.assertNotIn("other", restored)
+        self.assertEqual(restored.count, 1)
+
+
+    def test_union_contains_keys_of_all_filters(self):
+        first, second = BloomFilter(100), BloomFilter(100)
+        first.add("a")
+        second.add("b")
+        union = BloomFilter.union([first, None, second])
+        self.assertIn("a", union)
+        self.assertIn("b", union)
+        self.assertNotIn("c", union)
+        self.assertEqual(union.count, 2)
+
+    def test_union_of_different_sizes_contains_everything(self):
+        union = BloomFilter.union([BloomFilter(100), BloomFilter(1000)])
+        self.assertIn("any", union)
+        self.assertIsNone(BloomFilter.union([None]))
+
+if __name__ == '__main__':
+    unittest.main()
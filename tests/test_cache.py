@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.cache import MemoryCache
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_get_returns_put_entry(self):
+        cache = MemoryCache()
+        cache.put("token", "db", "key", {"key": "key", "value": 1})
+        self.assertEqual(cache.get("token", "db", "key")["value"], 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_get_returns_none_when_missing(self):
+        cache = MemoryCache()
+        self.assertIsNone(cache.get("token", "db", "key"))
+        self.assertEqual(cache.misses, 1)
+
+    def test_put_evicts_least_recently_used(self):
+        entry_size = MemoryCache.entry_size({"key": "k0", "value": 0})
+        cache = MemoryCache(max_bytes=entry_size * 2)
+        cache.put("token", "db", "k0", {"key": "k0", "value": 0})
+        cache.put("token", "db", "k1", {"key": "k1", "value": 1})
+        cache.get("token", "db", "k0")
+        cache.put("token", "db", "k2", {"key": "k2", "value": 2})
+
+        self.assertIsNotNone(cache.get("token", "db", "k0"))
+        self.assertIsNone(cache.get("token", "db", "k1"))
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.size <= cache.max_bytes)
+
+    def test_put_replaces_entry_size(self):
+        cache = MemoryCache()
+        cache.put("token", "db", "k", {"key": "k", "value": "long value"})
+        cache.put("token", "db", "k", {"key": "k", "value": 1})
+        self.assertEqual(cache.size,
+                         MemoryCache.entry_size({"key": "k", "value": 1}))
+
+    def test_entry_size_counts_key_and_value(self):
+        self.assertEqual(MemoryCache.entry_size(
+            {"key": "k", "value": "abc", "version": [1, 0, "a"]}), 4)
+        self.assertEqual(MemoryCache.entry_size(
+            {"key": "k", "value": {"a": 1}}), 1 + len('{"a": 1}'))
+
+    def test_hot_keys_start_from_recently_used(self):
+        cache = MemoryCache()
+        for key in ["a", "b", "c"]:
+            cache.put("token", "db", key, {"key": key, "value": 1})
+        cache.get("token", "db", "a")
+        self.assertEqual(cache.hot_keys(2), [["token", "db", "a"],
+                                             ["token", "db", "c"]])
+
+    def test_pop_removes_entry(self):
+        cache = MemoryCache()
+        cache.put("token", "db", "k", {"key": "k", "value": 1})
+        cache.pop("token", "db", "k")
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
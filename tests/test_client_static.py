@@ -2,12 +2,21 @@ import os
 import sys
 import unittest
 import json
+import time
 from json.decoder import JSONDecodeError
+from requests import ConnectionError
 
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                              os.path.pardir))
 
-from storage.storageclient import StorageClient
+from storage.storageclient import StorageClient, CachedResponse
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, url=None):
+        self.url = url
 
 
 class TestClient(unittest.TestCase):
@@ -100,6 +109,72 @@ class TestClient(unittest.TestCase):
                           TestClient.client.prepare_get_data_from_file,
                           *params)
 
+    def test_send_request_skips_unreachable_node(self):
+        client = StorageClient(TestClient.serv_host, TestClient.serv_port,
+                               blocking=False, with_checker=False)
+        client.cluster_nodes.add("http://127.0.0.2:9090")
+        calls = []
+
+        def request(url, headers):
+            calls.append(url)
+            if url == client.cluster_node_address:
+                raise ConnectionError()
+            return Response()
+
+        for _ in range(2):
+            self.assertIsNotNone(client.send_request(request))
+        # the failed node is in backoff and is not tried again
+        self.assertEqual(calls.count(client.cluster_node_address), 1)
+        self.assertFalse(client.health.available(client.cluster_node_address))
+
+    def test_hedged_read_is_answered_by_faster_node(self):
+        client = StorageClient(TestClient.serv_host, TestClient.serv_port,
+                               blocking=False, with_checker=False,
+                               hedged_reads=True)
+        slow, fast = client.cluster_node_address, "http://127.0.0.2:9090"
+        client.cluster_nodes.add(fast)
+        for _ in range(20):
+            client.health.success(slow, 0.001)
+            client.health.success(fast, 0.002)
+
+        def request(url, headers):
+            if url == slow:
+                time.sleep(0.5)
+            return Response(url)
+
+        response = client.send_request(request, hedge=True)
+        client.exit()
+        self.assertEqual(response.url, fast)
+
+    def test_near_cache_sends_only_expired_and_missing_keys(self):
+        client = StorageClient(TestClient.serv_host, TestClient.serv_port,
+                               blocking=False, with_checker=False,
+                               near_cache={"enabled": True, "ttl": 0})
+        entry = {"key": "a", "value": 1, "version": [1, 0, "n"]}
+        client.near_cache.put("db", "a", entry)
+        requests = []
+
+        def send_get(json_data):
+            requests.append(json_data)
+            return CachedResponse({"entries": {}, "not_found_keys": ["b"],
+                                   "not_modified_keys": ["a"]})
+
+        client.send_get = send_get
+        response = client.cached_get({"db_name": "db", "keys": ["a", "b"]})
+        self.assertEqual(requests[0]["keys"], ["a", "b"])
+        self.assertEqual(requests[0]["versions"], {"a": [1, 0, "n"]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["entries"], {"a": entry})
+
+    def test_fresh_near_cache_entries_are_not_requested(self):
+        client = StorageClient(TestClient.serv_host, TestClient.serv_port,
+                               blocking=False, with_checker=False,
+                               near_cache={"enabled": True, "ttl": 60})
+        client.near_cache.put("db", "a", {"key": "a", "value": 1})
+        client.send_get = None
+        response = client.cached_get({"db_name": "db", "keys": ["a"]})
+        self.assertEqual(response.status_code, 200)
+
     @classmethod
     def tearDownClass(cls) -> None:
         if os.path.exists("./correct_set_inp.json"):
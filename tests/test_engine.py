@@ -0,0 +1,267 @@
+import os
+import sys
+import unittest
+import time
+import asyncio
+import tempfile
+import shutil
+import aiounittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.engine import LogStorageEngine, FilePerKeyEngine, migrate
+from storage.engine import prefix_range, LSMStorageEngine, SSTable
+
+
+class TestLogStorageEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.engine = LogStorageEngine(self.root)
+        self.engine.load()
+
+    def test_read_returns_written_entries(self):
+        entries = [{"key": "son", "value": {"name": "Bart"}},
+                   {"key": "father", "value": {"name": "Homer"}}]
+        self.engine.write("token", "simpsons", entries)
+        founded = self.engine.read("token", "simpsons", ["son", "father"])
+        self.assertEqual(founded["son"], entries[0])
+        self.assertEqual(founded["father"], entries[1])
+
+    def test_read_returns_last_written_value(self):
+        self.engine.write("token", "db", [{"key": "k", "value": 1}])
+        self.engine.write("token", "db", [{"key": "k", "value": 2}])
+        self.assertEqual(self.engine.read("token", "db", ["k"])["k"]["value"],
+                         2)
+
+    def test_read_skips_unknown_keys(self):
+        self.engine.write("token", "db", [{"key": "k", "value": 1}])
+        self.assertEqual(self.engine.read("token", "db", ["unknown"]), {})
+        self.assertEqual(self.engine.read("token", "no_db", ["k"]), {})
+
+    def test_load_restores_index(self):
+        self.engine.write("token", "db", [{"key": "k", "value": 1}])
+        self.engine.write("token", "db", [{"key": "k", "value": 2}])
+        self.engine.close()
+
+        engine = LogStorageEngine(self.root)
+        engine.load()
+        self.assertEqual(engine.read("token", "db", ["k"])["k"]["value"], 2)
+        engine.close()
+
+    def test_write_after_torn_record_survives_restart(self):
+        self.engine.write("token", "db", [{"key": "a", "value": 1}])
+        self.engine.close()
+        with open(self.engine._segment_path("token", "db", 0), "ab") as f:
+            f.write(b'{"key": "b", "val')
+
+        engine = LogStorageEngine(self.root)
+        engine.load()
+        engine.write("token", "db", [{"key": "c", "value": 3}])
+        engine.close()
+
+        engine = LogStorageEngine(self.root)
+        engine.load()
+        self.assertEqual(sorted(engine.read("token", "db", ["a", "b", "c"])),
+                         ["a", "c"])
+        engine.close()
+
+    def test_write_rotates_segments(self):
+        engine = LogStorageEngine(self.root, segment_size=64)
+        for i in range(10):
+            engine.write("token", "db", [{"key": f"k{i}", "value": i}])
+        self.assertTrue(len(engine._segments("token", "db")) > 1)
+        founded = engine.read("token", "db", [f"k{i}" for i in range(10)])
+        self.assertEqual(len(founded), 10)
+        engine.close()
+
+    def test_load_reads_only_records_after_snapshot(self):
+        self.engine.write("token", "db", [{"key": "old", "value": 1}])
+        snapshot = self.engine.snapshot()
+        self.engine.write("token", "db", [{"key": "new", "value": 2}])
+        self.engine.close()
+
+        engine = LogStorageEngine(self.root)
+        engine.load(snapshot)
+        self.assertEqual(engine.scanned_keys, {("token", "db"): ["new"]})
+        founded = engine.read("token", "db", ["old", "new"])
+        self.assertEqual(founded["old"]["value"], 1)
+        self.assertEqual(founded["new"]["value"], 2)
+        engine.close()
+
+    def test_load_rescans_database_when_segment_is_shorter(self):
+        self.engine.write("token", "db", [{"key": "k", "value": 1}])
+        snapshot = self.engine.snapshot()
+        snapshot["sizes"]["token"]["db"]["0"] += 100
+        self.engine.close()
+
+        engine = LogStorageEngine(self.root)
+        engine.load(snapshot)
+        self.assertEqual(engine.scanned_keys, {("token", "db"): ["k"]})
+        self.assertEqual(engine.read("token", "db", ["k"])["k"]["value"], 1)
+        engine.close()
+
+    def test_scan_keys_returns_range_in_order(self):
+        self.engine.write("token", "db", [{"key": k, "value": 1}
+                                          for k in ["c", "a", "d", "b"]])
+        self.assertEqual(self.engine.scan_keys("token", "db"),
+                         ["a", "b", "c", "d"])
+        # keys written after scan are sorted by the next scan
+        self.engine.write("token", "db", [{"key": "bb", "value": 1},
+                                          {"key": "a", "value": 2}])
+        self.assertEqual(self.engine.scan_keys("token", "db", start="b",
+                                               end="d"),
+                         ["b", "bb", "c"])
+        self.assertEqual(self.engine.scan_keys("token", "db", after="b",
+                                               limit=2),
+                         ["bb", "c"])
+        self.assertEqual(self.engine.scan_keys("token", "no_db"), [])
+
+    def test_prefix_range_bounds_keys_with_prefix(self):
+        self.engine.write("token", "db", [{"key": k, "value": 1}
+                                          for k in ["user", "user:1",
+                                                    "user:2", "users"]])
+        start, end = prefix_range("user:")
+        self.assertEqual(self.engine.scan_keys("token", "db", start, end),
+                         ["user:1", "user:2"])
+        self.assertEqual(prefix_range(""), (None, None))
+
+    def test_migrate_moves_old_layout(self):
+        FilePerKeyEngine(self.root).write(
+            "token", "db", [{"key": "son", "value": "Bart"},
+                            {"key": "father", "value": "Homer"}])
+        self.assertEqual(migrate(self.root, remove=True), 2)
+
+        engine = LogStorageEngine(self.root)
+        engine.load()
+        founded = engine.read("token", "db", ["son", "father"])
+        self.assertEqual(founded["son"]["value"], "Bart")
+        self.assertEqual(founded["father"]["value"], "Homer")
+        self.assertEqual(list(FilePerKeyEngine(self.root).keys("token", "db")),
+                         [])
+        engine.close()
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        shutil.rmtree(self.root)
+
+
+
+class TestLSMStorageEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.engine = LSMStorageEngine(self.root, index_interval=4,
+                                       compaction_threshold=3)
+        self.engine.load()
+
+    def write(self, values: dict):
+        self.engine.write("token", "db", [{"key": key, "value": value}
+                                          for key, value in values.items()])
+
+    def test_read_finds_keys_in_memtable_and_tables(self):
+        self.write({f"k{i:02d}": i for i in range(20)})
+        self.engine.flush()
+        self.write({"k05": "new", "m": 1})
+        founded = self.engine.read("token", "db", ["k05", "k19", "m", "x"])
+        self.assertEqual(founded["k05"]["value"], "new")
+        self.assertEqual(founded["k19"]["value"], 19)
+        self.assertEqual(founded["m"]["value"], 1)
+        self.assertNotIn("x", founded)
+
+    def test_newest_table_wins(self):
+        for value in range(2):
+            self.write({"k": value})
+            self.engine.flush()
+        self.assertEqual(self.engine.read("token", "db", ["k"])["k"]["value"],
+                         1)
+
+    def test_load_restores_tables(self):
+        self.write({"k": 1})
+        self.engine.close()
+        self.engine = LSMStorageEngine(self.root)
+        self.engine.load()
+        self.assertEqual(self.engine.read("token", "db", ["k"])["k"]["value"],
+                         1)
+        self.assertEqual(list(self.engine.databases()), [("token", "db")])
+        table = self.engine.tables[("token", "db")][0]
+        self.assertIn("k", table.bloom)
+        self.assertIsNone(table.get("absent"))
+
+    def test_compaction_merges_tables(self):
+        for value in range(3):
+            self.write({"k": value, f"k{value}": value})
+            self.engine.flush()
+        self.assertEqual(self.engine.compactions, 1)
+        self.assertEqual(len(self.engine.tables[("token", "db")]), 1)
+        self.assertEqual(self.engine.read("token", "db", ["k"])["k"]["value"],
+                         2)
+        self.assertEqual(list(self.engine.keys("token", "db")),
+                         ["k", "k0", "k1", "k2"])
+        self.assertEqual(len(os.listdir(os.path.join(self.root, "token",
+                                                     "db"))), 1)
+
+    def test_scan_keys_merges_memtable_and_tables(self):
+        self.write({f"k{i:02d}": i for i in range(0, 20, 2)})
+        self.engine.flush()
+        self.write({f"k{i:02d}": i for i in range(1, 20, 2)})
+        self.assertEqual(self.engine.scan_keys("token", "db", start="k03",
+                                               end="k08"),
+                         ["k03", "k04", "k05", "k06", "k07"])
+        self.assertEqual(self.engine.scan_keys("token", "db", after="k16",
+                                               limit=2),
+                         ["k17", "k18"])
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        shutil.rmtree(self.root)
+
+
+class TestLSMFlush(aiounittest.AsyncTestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.engine = LSMStorageEngine(self.root, memtable_size=10)
+        self.engine.load()
+
+    async def test_flush_does_not_block_event_loop(self):
+        write = SSTable.write
+
+        def slow_write(*args, **kwargs):
+            time.sleep(0.3)
+            return write(*args, **kwargs)
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        with mock.patch.object(SSTable, "write", side_effect=slow_write):
+            started = time.monotonic()
+            # memtable is full, so write starts flush
+            self.engine.write("token", "db", [{"key": "k", "value": "v" * 20}])
+            self.assertLess(time.monotonic() - started, 0.1)
+            self.assertEqual(self.engine.memtables, {})
+            # immutable memtable is read until its table is added
+            self.assertEqual(self.engine.read("token", "db", ["k"])["k"]
+                             ["value"], "v" * 20)
+            await self.engine.flushed()
+        ticker.cancel()
+        self.assertGreater(ticks, 10)
+        self.assertEqual(len(self.engine.tables[("token", "db")]), 1)
+        self.assertEqual(self.engine.read("token", "db", ["k"])["k"]["value"],
+                         "v" * 20)
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        shutil.rmtree(self.root)
+
+
+if __name__ == '__main__':
+    unittest.main()
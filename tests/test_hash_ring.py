@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.hash_ring import HashRing
+
+
+class TestHashRing(unittest.TestCase):
+    nodes = [f"http://127.0.0.1:{port}" for port in range(3031, 3036)]
+    keys = [HashRing.key_id("token", "db", f"key{i}") for i in range(1000)]
+
+    def test_preference_list_returns_different_nodes(self):
+        ring = HashRing(TestHashRing.nodes)
+        replicas = ring.preference_list("token/db/key", 3)
+        self.assertEqual(len(replicas), 3)
+        self.assertEqual(len(set(replicas)), 3)
+
+    def test_preference_list_is_limited_by_number_of_nodes(self):
+        ring = HashRing(TestHashRing.nodes[:2])
+        self.assertEqual(len(ring.preference_list("token/db/key", 3)), 2)
+        self.assertEqual(HashRing().preference_list("token/db/key", 3), [])
+
+    def test_adding_node_moves_only_its_keys(self):
+        ring = HashRing(TestHashRing.nodes[:4])
+        before = {key: ring.preference_list(key, 1)[0]
+                  for key in TestHashRing.keys}
+        ring.add(TestHashRing.nodes[4])
+        after = {key: ring.preference_list(key, 1)[0]
+                 for key in TestHashRing.keys}
+
+        moved = [key for key in TestHashRing.keys
+                 if before[key] != after[key]]
+        self.assertTrue(all(after[key] == TestHashRing.nodes[4]
+                            for key in moved))
+        self.assertTrue(len(moved) < len(TestHashRing.keys) / 2)
+
+    def test_removing_node_moves_only_its_keys(self):
+        ring = HashRing(TestHashRing.nodes)
+        before = {key: ring.preference_list(key, 1)[0]
+                  for key in TestHashRing.keys}
+        ring.remove(TestHashRing.nodes[0])
+        for key in TestHashRing.keys:
+            if before[key] != TestHashRing.nodes[0]:
+                self.assertEqual(ring.preference_list(key, 1)[0],
+                                 before[key])
+
+    def test_update_makes_ring_of_given_nodes(self):
+        ring = HashRing(TestHashRing.nodes[:3])
+        ring.update(TestHashRing.nodes[2:])
+        self.assertEqual(ring.nodes, set(TestHashRing.nodes[2:]))
+        self.assertEqual(len(ring._hashes), 3 * ring.vnodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
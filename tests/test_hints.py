@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+import asyncio
+import tempfile
+import shutil
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.hints import HintQueue
+
+
+class TestHintQueue(aiounittest.AsyncTestCase):
+    node = "http://127.0.0.1:3032"
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.hints = HintQueue(self.root, batch_size=2)
+
+    async def test_read_returns_hints_in_batches(self):
+        for i in range(3):
+            await self.hints.add(self.node, "token", "db", [{"key": f"k{i}"}])
+        self.assertEqual(self.hints.nodes(), [self.node])
+
+        batch, offset = self.hints.read(self.node)
+        self.assertEqual([hint["keys"][0]["key"] for hint in batch],
+                         ["k0", "k1"])
+        self.hints.commit(self.node, offset)
+
+        batch, offset = self.hints.read(self.node)
+        self.assertEqual([hint["keys"][0]["key"] for hint in batch], ["k2"])
+        self.hints.commit(self.node, offset)
+        self.assertEqual(self.hints.nodes(), [])
+
+    async def test_add_drops_hints_over_limit(self):
+        hints = HintQueue(self.root, max_bytes=100)
+        self.assertTrue(await hints.add(self.node, "token", "db",
+                                        [{"key": "k"}]))
+        self.assertFalse(await hints.add(self.node, "token", "db",
+                                         [{"key": "k" * 100}]))
+        self.assertEqual(hints.dropped, 1)
+
+    async def test_concurrent_hints_are_written_by_one_commit(self):
+        await asyncio.gather(*[
+            self.hints.add(self.node, "token", "db", [{"key": f"k{i}"}])
+            for i in range(5)])
+        self.assertEqual(self.hints.commits, 1)
+        batch, _ = HintQueue(self.root).read(self.node)
+        self.assertEqual(len(batch), 5)
+
+    async def test_uncommitted_hints_are_read_again(self):
+        await self.hints.add(self.node, "token", "db", [{"key": "k"}])
+        self.hints.read(self.node)
+        batch, _ = HintQueue(self.root).read(self.node)
+        self.assertEqual(len(batch), 1)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+
+if __name__ == '__main__':
+    unittest.main()
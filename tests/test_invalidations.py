@@ -0,0 +1,49 @@
+import os
+import sys
+import asyncio
+import unittest
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.invalidations import InvalidationLog
+
+
+class TestInvalidationLog(aiounittest.AsyncTestCase):
+
+    async def test_keys_of_token_after_seq_are_returned(self):
+        log = InvalidationLog()
+        log.add("token", "db", ["a", "b"])
+        log.add("other", "db", ["c"])
+        log.add("token", "db2", ["d"])
+        answer = log.since("token", log.epoch, 1)
+        self.assertEqual(answer["keys"], [["db", "b"], ["db2", "d"]])
+        self.assertEqual(answer["seq"], 4)
+
+    async def test_unknown_epoch_or_lost_records_reset_client(self):
+        log = InvalidationLog(max_size=2)
+        log.add("token", "db", ["a", "b", "c"])
+        self.assertTrue(log.since("token", "", 3)["reset"])
+        self.assertTrue(log.since("token", log.epoch, 0)["reset"])
+        self.assertEqual(log.since("token", log.epoch, 1)["keys"],
+                         [["db", "b"], ["db", "c"]])
+
+    async def test_wait_returns_when_key_is_written(self):
+        log = InvalidationLog()
+        log.add("token", "db", ["a"])
+        waiter = asyncio.ensure_future(log.wait("token", log.epoch, 1, 5))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiter.done())
+        log.add("token", "db", ["b"])
+        answer = await asyncio.wait_for(waiter, 1)
+        self.assertEqual(answer["keys"], [["db", "b"]])
+
+    async def test_wait_returns_empty_answer_after_timeout(self):
+        log = InvalidationLog()
+        answer = await log.wait("token", log.epoch, 0, 0.01)
+        self.assertEqual(answer["keys"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
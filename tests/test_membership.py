@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.membership import Membership, ALIVE, SUSPECT, DEAD
+
+
+class TestMembership(unittest.TestCase):
+    node = "http://127.0.0.1:3032"
+
+    def setUp(self) -> None:
+        self.changes = []
+        self.membership = Membership(
+            "http://127.0.0.1:3031", suspect_timeout=0.01,
+            on_change=lambda node, state: self.changes.append((node, state)))
+        self.membership.join(TestMembership.node)
+
+    def test_suspected_node_is_dead_after_timeout(self):
+        self.membership.suspect(TestMembership.node)
+        self.assertEqual(self.membership.state(TestMembership.node), SUSPECT)
+        time.sleep(0.02)
+        self.membership.expire_suspects()
+        self.assertEqual(self.membership.state(TestMembership.node), DEAD)
+        self.assertEqual(self.changes[-1], (TestMembership.node, DEAD))
+        self.assertEqual(self.membership.live_nodes(), set())
+
+    def test_alive_with_greater_incarnation_overrides_suspect(self):
+        self.membership.apply([{"node": TestMembership.node,
+                                "state": SUSPECT, "incarnation": 0}])
+        self.membership.apply([{"node": TestMembership.node,
+                                "state": ALIVE, "incarnation": 0}])
+        self.assertEqual(self.membership.state(TestMembership.node), SUSPECT)
+        self.membership.apply([{"node": TestMembership.node,
+                                "state": ALIVE, "incarnation": 1}])
+        self.assertEqual(self.membership.state(TestMembership.node), ALIVE)
+
+    def test_suspicion_about_self_is_refuted(self):
+        self.membership.apply([{"node": "http://127.0.0.1:3031",
+                                "state": SUSPECT, "incarnation": 0}])
+        self.assertEqual(self.membership.self_update()["incarnation"], 1)
+
+    def test_apply_adds_unknown_nodes(self):
+        self.membership.apply([{"node": "http://127.0.0.1:3033",
+                                "state": ALIVE, "incarnation": 0}])
+        self.assertEqual(self.membership.live_nodes(),
+                         {TestMembership.node, "http://127.0.0.1:3033"})
+
+    def test_updates_are_retransmitted_limited_times(self):
+        sent = 0
+        while self.membership.updates():
+            sent += 1
+        self.assertTrue(0 < sent < 20)
+
+    def test_next_target_returns_every_live_node(self):
+        self.membership.join("http://127.0.0.1:3033")
+        targets = {self.membership.next_target() for _ in range(2)}
+        self.assertEqual(targets, self.membership.live_nodes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.merkle import MerkleTree
+
+
+class TestMerkleTree(unittest.TestCase):
+
+    def test_trees_with_same_entries_are_equal(self):
+        first, second = MerkleTree(4), MerkleTree(4)
+        for i in range(10):
+            first.add(f"k{i}", [i, 0, "a"])
+        for i in reversed(range(10)):
+            second.add(f"k{i}", [i, 0, "a"])
+        self.assertEqual(first.root(), second.root())
+        self.assertEqual(first.diff(second.hex_leaves()), [])
+
+    def test_diff_returns_bucket_of_changed_key(self):
+        first, second = MerkleTree(4), MerkleTree(4)
+        for tree in (first, second):
+            for i in range(10):
+                tree.add(f"k{i}", [i, 0, "a"])
+        second.remove("k3", [3, 0, "a"])
+        second.add("k3", [4, 0, "a"])
+        self.assertNotEqual(first.root(), second.root())
+        self.assertEqual(first.diff(second.hex_leaves()),
+                         [first.bucket("k3")])
+
+    def test_remove_restores_tree(self):
+        tree = MerkleTree(4)
+        empty_root = tree.root()
+        tree.add("k", None)
+        tree.remove("k", None)
+        self.assertEqual(tree.root(), empty_root)
+
+    def test_merged_trees_equal_tree_of_all_keys(self):
+        whole, first, second = MerkleTree(4), MerkleTree(4), MerkleTree(4)
+        for i in range(20):
+            whole.add(f"k{i}", [i, 0, "a"])
+            (first if i % 2 else second).add(f"k{i}", [i, 0, "a"])
+        first.merge(second.hex_leaves())
+        self.assertEqual(first.root(), whole.root())
+
+    def test_leaves_of_other_depth_are_rejected(self):
+        tree = MerkleTree(4)
+        with self.assertRaises(ValueError):
+            tree.diff(MerkleTree(3).hex_leaves())
+        with self.assertRaises(ValueError):
+            tree.merge(["0"])
+
+    def test_levels_end_with_root(self):
+        levels = MerkleTree(3).levels()
+        self.assertEqual([len(level) for level in levels], [8, 4, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.near_cache import NearCache
+
+
+class TestNearCache(unittest.TestCase):
+
+    @staticmethod
+    def entry(key, version=1):
+        return {"key": key, "value": key, "version": [version, 0, "a"]}
+
+    def test_fresh_entries_are_hits(self):
+        cache = NearCache()
+        cache.put("db", "a", self.entry("a"))
+        fresh, expired, missing = cache.lookup("db", ["a", "b"])
+        self.assertEqual(fresh, {"a": self.entry("a")})
+        self.assertEqual(expired, {})
+        self.assertEqual(missing, ["b"])
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_expired_entries_are_validated(self):
+        cache = NearCache(ttl=0.01)
+        cache.put("db", "a", self.entry("a"))
+        cache.put("db", "b", {"key": "b", "value": 1})
+        time.sleep(0.02)
+        fresh, expired, missing = cache.lookup("db", ["a", "b"])
+        self.assertEqual(list(expired), ["a"])
+        # entry without version can not be validated
+        self.assertEqual(missing, ["b"])
+
+    def test_update_keeps_not_modified_entries(self):
+        cache = NearCache(ttl=0.01)
+        cache.put("db", "a", self.entry("a"))
+        cache.put("db", "b", self.entry("b"))
+        time.sleep(0.02)
+        _, expired, _ = cache.lookup("db", ["a", "b"])
+        cache.invalidate("db", "a")
+        not_modified = cache.update(
+            "db", {"entries": {"b": self.entry("b", 2)},
+                   "not_found_keys": [], "not_modified_keys": ["a"]},
+            expired)
+        self.assertEqual(not_modified, {"a": self.entry("a")})
+        fresh, _, _ = cache.lookup("db", ["a", "b"])
+        self.assertEqual(fresh["b"]["version"], [2, 0, "a"])
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = NearCache(max_entries=2)
+        cache.put("db", "a", self.entry("a"))
+        cache.put("db", "b", self.entry("b"))
+        cache.lookup("db", ["a"])
+        cache.put("db", "c", self.entry("c"))
+        self.assertEqual(len(cache), 2)
+        _, _, missing = cache.lookup("db", ["a", "b", "c"])
+        self.assertEqual(missing, ["b"])
+
+    def test_not_found_keys_are_invalidated(self):
+        cache = NearCache()
+        cache.put("db", "a", self.entry("a"))
+        cache.update("db", {"entries": {}, "not_found_keys": ["a"]}, {})
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
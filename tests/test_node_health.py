@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.node_health import NodeHealth
+
+
+class TestNodeHealth(unittest.TestCase):
+
+    def test_order_prefers_the_fastest_node(self):
+        health = NodeHealth()
+        health.success("slow", 0.5)
+        health.success("fast", 0.01)
+        health.success("medium", 0.1)
+        self.assertEqual(health.order(["slow", "medium", "fast"]),
+                         ["fast", "medium", "slow"])
+
+    def test_latency_is_moving_average(self):
+        health = NodeHealth(alpha=0.5)
+        health.success("a", 1.0)
+        health.success("a", 0.0)
+        self.assertAlmostEqual(health.stats()["a"]["latency"], 0.5)
+
+    def test_failed_node_is_tried_last_during_backoff(self):
+        health = NodeHealth(backoff=10)
+        health.success("a", 0.01)
+        health.success("b", 0.5)
+        health.failure("a")
+        self.assertFalse(health.available("a"))
+        self.assertEqual(health.order(["a", "b"]), ["b", "a"])
+
+    def test_backoff_grows_exponentially(self):
+        health = NodeHealth(backoff=1, max_backoff=3)
+        delays = []
+        for _ in range(4):
+            health.failure("a")
+            delays.append(health.nodes["a"]["retry_at"] - time.monotonic())
+        self.assertAlmostEqual(delays[0], 1, places=1)
+        self.assertAlmostEqual(delays[1], 2, places=1)
+        self.assertAlmostEqual(delays[3], 3, places=1)
+
+    def test_success_ends_backoff(self):
+        health = NodeHealth(backoff=10)
+        health.failure("a")
+        health.success("a", 0.01)
+        self.assertTrue(health.available("a"))
+
+    def test_node_with_many_errors_is_not_healthy(self):
+        health = NodeHealth(alpha=0.5, backoff=0)
+        health.success("a", 0.01)
+        health.success("b", 0.5)
+        health.failure("a")
+        health.failure("a")
+        self.assertFalse(health.healthy("a"))
+        self.assertEqual(health.order(["a", "b"]), ["b", "a"])
+
+    def test_percentile_needs_enough_samples(self):
+        health = NodeHealth(min_samples=10)
+        for i in range(9):
+            health.success("a", i / 100)
+        self.assertIsNone(health.percentile("a"))
+        for i in range(9, 100):
+            health.success("a", i / 100)
+        self.assertAlmostEqual(health.percentile("a", 95), 0.94)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import sys
+import unittest
+import tempfile
+import shutil
+import asyncio
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.node_info import NodeInfo
+from storage.engine import LogStorageEngine
+from storage.cache import MemoryCache
+from storage.hlc import HybridLogicalClock
+from storage.hash_ring import HashRing
+
+
+class TestNodeInfo(unittest.TestCase):
+
+    def test_required_acks_returns_one_for_one(self):
+        self.assertEqual(NodeInfo.required_acks("ONE", 5), 1)
+
+    def test_required_acks_returns_majority_for_quorum(self):
+        self.assertEqual(NodeInfo.required_acks("QUORUM", 1), 1)
+        self.assertEqual(NodeInfo.required_acks("QUORUM", 4), 3)
+        self.assertEqual(NodeInfo.required_acks("QUORUM", 5), 3)
+
+    def test_required_acks_returns_all_replicas_for_all(self):
+        self.assertEqual(NodeInfo.required_acks("ALL", 5), 5)
+
+    def test_required_acks_raises_value_err_when_unknown_level(self):
+        self.assertRaises(ValueError, NodeInfo.required_acks, "TWO", 5)
+
+    def test_partition_map_lets_client_find_replicas(self):
+        NodeInfo.set_self_url("http://127.0.0.1:3031")
+        NodeInfo.cluster_nodes = {f"http://127.0.0.1:{port}"
+                                  for port in range(3032, 3036)}
+        data = NodeInfo.partition_map()
+        ring = HashRing(data["nodes"], data["vnodes"])
+        for key in [f"k{i}" for i in range(20)]:
+            replicas = ring.preference_list(
+                HashRing.key_id("token", "db", key),
+                data["replication_factor"])
+            self.assertEqual(replicas, NodeInfo.replicas("token", "db", key))
+            self.assertEqual(NodeInfo.owns("token", "db", [key]),
+                             NodeInfo.self_url in replicas)
+        self.assertFalse(NodeInfo.owns("token", "db",
+                                       [f"k{i}" for i in range(20)]))
+        NodeInfo.cluster_nodes = set()
+
+    def test_older_cluster_view_is_ignored(self):
+        NodeInfo.cluster_nodes = set()
+        NodeInfo.cluster_view = ["epoch", 0]
+        self.assertTrue(NodeInfo.apply_cluster_view(["http://a"],
+                                                    ["epoch", 2]))
+        self.assertFalse(NodeInfo.apply_cluster_view([], ["epoch", 1]))
+        self.assertEqual(NodeInfo.cluster_nodes, {"http://a"})
+        # view of restarted worker has new epoch
+        self.assertTrue(NodeInfo.apply_cluster_view([], ["other", 0]))
+        self.assertEqual(NodeInfo.get_cluster_view(),
+                         {"nodes": [], "view": ["other", 0]})
+
+
+class TestNodeInfoVersions(aiounittest.AsyncTestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        NodeInfo.engine = LogStorageEngine(self.root)
+        NodeInfo.storage = MemoryCache()
+        NodeInfo.wal = None
+        NodeInfo.filters = {}
+        NodeInfo.trees_ring = None
+
+    async def test_add_keys_skips_older_version(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "new", "version": [2, 0, "a"]}])
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "old", "version": [1, 0, "b"]}])
+        data = await NodeInfo.get_values("token", "db", ["k"])
+        self.assertEqual(data["entries"]["k"]["value"], "new")
+
+    async def test_add_keys_checks_versions_on_disk(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "new", "version": [2, 0, "a"]}])
+        NodeInfo.storage.clear()
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "old", "version": [2, 0, "a"]}])
+        data = await NodeInfo.get_values("token", "db", ["k"])
+        self.assertEqual(data["entries"]["k"]["value"], "new")
+
+    async def test_add_keys_writes_newer_version(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "old", "version": [1, 0, "a"]}])
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "new", "version": [1, 1, "a"]}])
+        data = await NodeInfo.get_values("token", "db", ["k"])
+        self.assertEqual(data["entries"]["k"]["value"], "new")
+
+    async def test_import_keys_goes_past_memory_tier(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "old", "version": [1, 0, "a"]}])
+        NodeInfo.import_keys("token", "db", [
+            {"key": "k", "value": "new", "version": [2, 0, "a"]},
+            {"key": "n", "value": "n", "version": [2, 0, "a"]}])
+        self.assertEqual(len(NodeInfo.storage), 0)
+        data = await NodeInfo.get_values("token", "db", ["k", "n"])
+        self.assertEqual(data["entries"]["k"]["value"], "new")
+        self.assertEqual(data["entries"]["n"]["value"], "n")
+
+    async def test_scan_returns_entries_from_memory_and_disk(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": f"k{i}", "value": i, "version": [1, 0, "a"]}
+            for i in range(5)])
+        NodeInfo.storage.clear()
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k1", "value": "new", "version": [2, 0, "a"]}])
+        entries = await NodeInfo.scan("token", "db", after="k0", limit=2)
+        self.assertEqual(entries, [
+            {"key": "k1", "value": "new", "version": [2, 0, "a"]},
+            {"key": "k2", "value": 2, "version": [1, 0, "a"]}])
+
+    async def test_filter_skips_disk_for_absent_keys(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": 1, "version": [1, 0, "a"]}])
+        NodeInfo.storage.clear()
+        negatives = NodeInfo.bloom_negatives
+        data = await NodeInfo.get_values("token", "db", ["k", "absent"])
+        self.assertEqual(list(data["entries"]), ["k"])
+        self.assertEqual(data["not_found_keys"], ["absent"])
+        self.assertEqual(NodeInfo.bloom_negatives, negatives + 1)
+
+    async def test_filters_are_loaded_from_engine(self):
+        await NodeInfo.add_keys("token", "db", [
+            {"key": f"k{i}", "value": i} for i in range(1500)])
+        NodeInfo.load_filters()
+        self.assertTrue(all(NodeInfo.may_contain("token", "db", f"k{i}")
+                            for i in range(1500)))
+        self.assertFalse(NodeInfo.may_contain("token", "other", "k0"))
+
+    async def test_snapshot_restores_filters_and_hot_keys(self):
+        NodeInfo.snapshot_path = os.path.join(self.root, "snapshot")
+        await NodeInfo.add_keys("token", "db", [
+            {"key": f"k{i}", "value": i} for i in range(3)])
+        await NodeInfo.write_snapshot()
+        NodeInfo.engine.write("token", "db", [{"key": "late", "value": 1}])
+        NodeInfo.engine.close()
+
+        state = NodeInfo.read_snapshot()
+        NodeInfo.engine = LogStorageEngine(self.root)
+        NodeInfo.engine.load(state["engine"])
+        NodeInfo.load_filters(state["filters"])
+        self.assertTrue(NodeInfo.may_contain("token", "db", "k0"))
+        self.assertTrue(NodeInfo.may_contain("token", "db", "late"))
+
+        NodeInfo.storage = MemoryCache()
+        NodeInfo.hot_keys = state["hot_keys"]
+        NodeInfo.ready = False
+        await NodeInfo.prewarm(batch_size=2)
+        self.assertTrue(NodeInfo.ready)
+        self.assertEqual(NodeInfo.storage.hot_keys(),
+                         [["token", "db", "k2"], ["token", "db", "k1"],
+                          ["token", "db", "k0"]])
+
+    async def test_merkle_trees_are_updated_by_writes(self):
+        NodeInfo.set_self_url("http://127.0.0.1:3031")
+        NodeInfo.cluster_nodes = {"http://127.0.0.1:3032"}
+        await NodeInfo.merkle_trees()
+        for version in range(3):
+            await NodeInfo.add_keys("token", "db", [
+                {"key": f"k{i}", "value": i, "version": [version, i, "a"]}
+                for i in range(20)])
+        updated = NodeInfo.merkle_tree("token", "db", "http://127.0.0.1:3032")
+
+        NodeInfo.trees_ring = None
+        rebuilt = (await NodeInfo.merkle_trees())[("token", "db")]
+        self.assertEqual(updated.root(),
+                         rebuilt["http://127.0.0.1:3032"].root())
+        NodeInfo.cluster_nodes = set()
+
+    async def test_keys_written_during_rebuild_are_added_to_trees(self):
+        NodeInfo.set_self_url("http://127.0.0.1:3031")
+        NodeInfo.cluster_nodes = {"http://127.0.0.1:3032"}
+        await NodeInfo.add_keys("token", "db", [
+            {"key": f"k{i}", "value": i, "version": [1, i, "a"]}
+            for i in range(20)])
+        rebuild = asyncio.ensure_future(NodeInfo.merkle_trees())
+        while NodeInfo.trees_dirty is None:
+            await asyncio.sleep(0)
+        # rebuild runs in executor while keys are written
+        await NodeInfo.add_keys("token", "db", [
+            {"key": f"k{i}", "value": i, "version": [2, i, "a"]}
+            for i in range(10, 30)])
+        updated = (await rebuild)[("token", "db")]["http://127.0.0.1:3032"]
+
+        NodeInfo.trees_ring = None
+        rebuilt = (await NodeInfo.merkle_trees())[("token", "db")]
+        self.assertEqual(updated.root(),
+                         rebuilt["http://127.0.0.1:3032"].root())
+        entries = await NodeInfo.bucket_entries(
+            "token", "db", "http://127.0.0.1:3032",
+            [updated.bucket("k25")])
+        self.assertEqual(entries["k25"]["version"], [2, 25, "a"])
+        NodeInfo.cluster_nodes = set()
+
+    def test_newest_returns_entry_with_max_version(self):
+        entries = [None, {"key": "k", "version": [1, 5, "a"]},
+                   {"key": "k", "version": [2, 0, "b"]}, {"key": "k"}]
+        self.assertEqual(NodeInfo.newest(entries)["version"], [2, 0, "b"])
+        self.assertIsNone(NodeInfo.newest([None]))
+
+    def test_clock_never_goes_back(self):
+        clock = HybridLogicalClock("a")
+        first = clock.now()
+        clock.update([first[0] + 10000, 7, "b"])
+        second = clock.now()
+        self.assertTrue(second > first)
+        self.assertTrue(second > [first[0] + 10000, 7, "b"])
+
+    def test_clock_rejects_version_far_in_future(self):
+        clock = HybridLogicalClock("a", max_drift_ms=1000)
+        first = clock.now()
+        with self.assertRaises(ValueError):
+            clock.update([first[0] + 3600 * 1000, 0, "b"])
+        self.assertLess(clock.now()[0], first[0] + 1000)
+
+    async def test_add_keys_skips_version_far_in_future(self):
+        far = [HybridLogicalClock.physical_time() + 3600 * 1000, 0, "b"]
+        await NodeInfo.add_keys("token", "db", [
+            {"key": "k", "value": "future", "version": far}])
+        data = await NodeInfo.get_values("token", "db", ["k"])
+        self.assertEqual(data["not_found_keys"], ["k"])
+        self.assertLess(NodeInfo.clock.now()[0], far[0])
+
+    def tearDown(self) -> None:
+        NodeInfo.engine.close()
+        shutil.rmtree(self.root)
+
+
+if __name__ == '__main__':
+    unittest.main()
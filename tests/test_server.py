@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import unittest
 import shutil
 
@@ -8,19 +9,27 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
 
 from storage.servernode import app
 from storage.servernode import memory
+from storage.servernode import peer_auth
+from storage.bloom import BloomFilter
 
 
 class TestServer(unittest.TestCase):
     token = "my_api_key"
     headers = {"Authorization": token}
+    cluster_secret = "my_cluster_secret"
+    peer_headers = {"X-Cluster-Secret": cluster_secret}
 
     @classmethod
     def setUpClass(cls) -> None:
-        base_data = {
-            "my_database": {"hello": {"key": "hello", "value": "world"}}}
-        memory.self_url = "http://localhost:3333"
-        app.test_client.post('/registerkey', json={"token": TestServer.token})
-        memory.storage[TestServer.token] = base_data
+        memory.set_self_url("http://localhost:3333")
+        memory.configure()
+        # every node keeps every key
+        memory.replication_factor = 100
+        peer_auth.secret_key = TestServer.cluster_secret
+        app.test_client.post('/registerkey', json={"token": TestServer.token},
+                             headers=TestServer.peer_headers)
+        memory.storage.put(TestServer.token, "my_database", "hello",
+                           {"key": "hello", "value": "world"})
 
     def test_auth_register_client(self):
         _, response = app.test_client.post('/auth')
@@ -74,11 +83,36 @@ class TestServer(unittest.TestCase):
         assert response_data["value"] == "go fast"
         assert response.status == 200
 
+    def test_get_returns_503_when_consistency_is_not_reached(self):
+        data = {"db_name": "my_database", "keys": ["hello"]}
+        memory.cluster_nodes.add("http://127.0.0.3:4444")
+        _, response = app.test_client.post('/get?consistency=ALL',
+                                           json=data,
+                                           headers=TestServer.headers)
+        memory.cluster_nodes.discard("http://127.0.0.3:4444")
+        assert response.status == 503
+
+    def test_get_does_not_count_peer_filter_as_answer(self):
+        data = {"db_name": "my_database", "keys": ["hello"]}
+        node = "http://127.0.0.3:4444"
+        memory.cluster_nodes.add(node)
+        memory.bloom_skip_peers = True
+        # fresh filter of unreachable replica tells that key is absent
+        memory.peer_filters[(node, TestServer.token, "my_database")] = (
+            BloomFilter(1), time.monotonic())
+        _, response = app.test_client.post('/get?consistency=QUORUM',
+                                           json=data,
+                                           headers=TestServer.headers)
+        memory.bloom_skip_peers = False
+        memory.peer_filters = {}
+        memory.cluster_nodes.discard(node)
+        assert response.status == 503
+
     def test_get_from_file(self):
         data = {"db_name": "my_database",
                 "keys": [{"key": "no_in_RAM", "value": "value is on disk"}]}
         app.test_client.post('/set', json=data, headers=TestServer.headers)
-        memory.storage[TestServer.token]["my_database"].pop("no_in_RAM")
+        memory.storage.pop(TestServer.token, "my_database", "no_in_RAM")
 
         get_data = {"db_name": "my_database", "keys": ["no_in_RAM"]}
         _, response = app.test_client.post('/get',
@@ -90,6 +124,29 @@ class TestServer(unittest.TestCase):
         assert response_data["value"] == "value is on disk"
         assert response.status == 200
 
+    def test_set_returns_503_when_consistency_is_not_reached(self):
+        data = {"db_name": "my_database",
+                "keys": [{"key": "Sanic", "value": "go fast"}]}
+        memory.cluster_nodes.add("http://127.0.0.3:4444")
+        _, response = app.test_client.post('/set?consistency=ALL',
+                                           json=data,
+                                           headers=TestServer.headers)
+        memory.cluster_nodes.discard("http://127.0.0.3:4444")
+        assert response.status == 503
+
+    def test_set_duplicated_key_is_acked_once(self):
+        data = {"db_name": "my_database",
+                "keys": [{"key": "dup", "value": "first"},
+                         {"key": "dup", "value": "second"}]}
+        memory.cluster_nodes.add("http://127.0.0.3:4444")
+        _, response = app.test_client.post('/set?consistency=QUORUM',
+                                           json=data,
+                                           headers=TestServer.headers)
+        memory.cluster_nodes.discard("http://127.0.0.3:4444")
+        # only this node of two replicas has the key
+        assert response.status == 503
+        assert "['dup']" in response.json["message"]
+
     def test_set_returns_500_when_incorrect_request(self):
         data = {"db_name": "my_database", "keys": [{"value": "some_value"}]}
         _, response = app.test_client.post('/set',
@@ -97,6 +154,11 @@ class TestServer(unittest.TestCase):
                                            headers=TestServer.headers)
         assert response.status == 500
 
+    def test_stats_returns_cache_counters(self):
+        _, response = app.test_client.get('/stats')
+        self.assertTrue("hits" in response.json["cache"])
+        assert response.status == 200
+
     def test_clusterinfo_returns_correct_urls(self):
         _, response = app.test_client.get('/clusterinfo')
         self.assertTrue("http://localhost:3333" in response.json["addresses"])
@@ -137,10 +199,45 @@ class TestServer(unittest.TestCase):
 
     def test_register_key_returns_200(self):
         data = {"token": "some_token"}
-        _, response = app.test_client.post('/registerkey', json=data)
+        _, response = app.test_client.post('/registerkey', json=data,
+                                           headers=TestServer.peer_headers)
         self.assertTrue("some_token" in memory.api_keys)
         assert response.status == 200
 
+    def test_register_key_without_cluster_secret_returns_401(self):
+        record = dict(memory.api_keys.record(TestServer.token), revoked=True)
+        _, response = app.test_client.post('/registerkey',
+                                           json={"records": [record]})
+        self.assertTrue(TestServer.token in memory.api_keys)
+        assert response.status == 401
+
+    def test_token_sync_without_cluster_secret_returns_401(self):
+        data = {"leaves": memory.api_keys.tree.hex_leaves()}
+        _, response = app.test_client.post('/tokensync', json=data)
+        assert response.status == 401
+
+    def test_replica_set_without_cluster_secret_returns_401(self):
+        data = {"db_name": "my_database",
+                "keys": [{"key": "hello", "value": "future",
+                          "version": [2 ** 50, 0, "http://other"]}]}
+        _, response = app.test_client.post('/set?is_endpoint=True',
+                                           json=data,
+                                           headers=TestServer.headers)
+        assert response.status == 401
+
+    def test_replica_bulk_set_skips_memory_tier(self):
+        data = {"db_name": "my_database",
+                "keys": [{"key": "imported", "value": "on disk"}]}
+        headers = dict(TestServer.headers, **TestServer.peer_headers)
+        _, response = app.test_client.post('/set?is_endpoint=True&bulk=True',
+                                           json=data, headers=headers)
+        assert response.status == 200
+        self.assertIsNone(memory.storage.peek(TestServer.token,
+                                              "my_database", "imported"))
+        founded = memory.engine.read(TestServer.token, "my_database",
+                                     ["imported"])
+        assert founded["imported"]["value"] == "on disk"
+
     def test_quorum_get_returns_200_when_key_in_node(self):
         data = {"db_name": "my_database",
                 "keys": ["hello"],
@@ -0,0 +1,107 @@
+import os
+import sys
+import asyncio
+import unittest
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.tcp_server import StorageProtocol
+from storage.invalidations import InvalidationLog
+from storage.shards import Shards, ShardError, ForwardedInvalidations
+from storage.shards import shard_of, handlers
+
+
+class TestShardOf(unittest.TestCase):
+
+    def test_keys_are_spread_over_workers(self):
+        owners = [shard_of("token", "db", f"key{i}", 4) for i in range(1000)]
+        self.assertEqual(set(owners), {0, 1, 2, 3})
+        self.assertTrue(all(owners.count(i) > 150 for i in range(4)))
+        self.assertEqual(owners, [shard_of("token", "db", f"key{i}", 4)
+                                  for i in range(1000)])
+
+    def test_single_worker_owns_every_key(self):
+        self.assertEqual(shard_of("token", "db", "key", 1), 0)
+
+
+class TestShards(aiounittest.AsyncTestCase):
+
+    async def serve(self, methods: dict):
+        """Worker 1 of two workers, this test is worker 0"""
+        loop = asyncio.get_event_loop()
+        self.shards = Shards(0, 2, secret="secret", timeout=1.0)
+        server = await loop.create_server(
+            lambda: StorageProtocol(handlers(methods), self.shards.verify),
+            "127.0.0.1", 0)
+        # worker 1 listens port + 1
+        self.shards.port = server.sockets[0].getsockname()[1] - 1
+        return server
+
+    async def close(self, server):
+        self.shards.close()
+        server.close()
+        await server.wait_closed()
+
+    async def test_keys_are_routed_to_their_workers(self):
+        stored = {0: [], 1: []}
+
+        async def add_keys(token, db_name, keys):
+            stored[1].extend(keys)
+            return len(keys)
+
+        def local(token, db_name, keys):
+            stored[0].extend(keys)
+            return len(keys)
+
+        server = await self.serve({"add_keys": add_keys})
+        keys = [f"key{i}" for i in range(50)]
+        results = await self.shards.route("add_keys", local, "token", "db",
+                                          keys)
+        self.assertEqual(sum(results), 50)
+        for index in (0, 1):
+            self.assertTrue(stored[index])
+            self.assertTrue(all(self.shards.owner("token", "db", key) ==
+                                index for key in stored[index]))
+        await self.close(server)
+
+    async def test_each_runs_operation_on_every_worker(self):
+        server = await self.serve({"count": lambda: 1})
+        results = await self.shards.each("count", lambda: 2, {})
+        self.assertEqual(results, [2, 1])
+        await self.close(server)
+
+    async def test_failed_operation_raises_shard_error(self):
+        def fail():
+            raise KeyError("key")
+
+        server = await self.serve({"fail": fail})
+        with self.assertRaises(ShardError):
+            await self.shards.call(1, "fail", {})
+        self.shards.secret = "wrong"
+        with self.assertRaises(ShardError):
+            await self.shards.call(1, "unknown", {})
+        await self.close(server)
+
+    async def test_unreachable_worker_raises_shard_error(self):
+        shards = Shards(0, 2, port=1, secret="secret")
+        with self.assertRaises(ShardError):
+            await shards.call(1, "count", {})
+
+    async def test_invalidations_are_kept_by_other_worker(self):
+        log = InvalidationLog()
+        server = await self.serve({"invalidate": log.add,
+                                   "invalidations": log.wait})
+        # worker 1 keeps the log in this test
+        forwarded = ForwardedInvalidations(self.shards, owner=1)
+        waiter = asyncio.ensure_future(
+            forwarded.wait("token", log.epoch, 0, 1.0))
+        forwarded.add("token", "db", ["a", "b"])
+        answer = await asyncio.wait_for(waiter, 2)
+        self.assertEqual(answer["keys"], [["db", "a"], ["db", "b"]])
+        await self.close(server)
+
+
+if __name__ == '__main__':
+    unittest.main()
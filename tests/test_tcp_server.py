@@ -0,0 +1,90 @@
+import os
+import sys
+import asyncio
+import unittest
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage import wire
+from storage.tcp_server import StorageProtocol, encode_frame, read_frame
+
+
+async def verify(token):
+    return token == "secret"
+
+
+async def echo(request):
+    await asyncio.sleep(0.001 * (request["id"] % 5))
+    return {"keys": request["keys"]}, 200
+
+
+class TestStorageProtocol(aiounittest.AsyncTestCase):
+
+    async def serve(self, max_pipeline=1024):
+        loop = asyncio.get_event_loop()
+        server = await loop.create_server(
+            lambda: StorageProtocol({"get": echo}, verify,
+                                    max_pipeline=max_pipeline),
+            "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        return server, reader, writer
+
+    @staticmethod
+    async def close(server, writer):
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+    async def answers(self, reader, count):
+        answers = {}
+        for _ in range(count):
+            answer, _ = await read_frame(reader)
+            answers[answer["id"]] = answer
+        return answers
+
+    async def test_pipelined_requests_are_answered_by_id(self):
+        server, reader, writer = await self.serve()
+        writer.write(b"".join(
+            encode_frame({"id": i, "op": "get", "token": "secret",
+                          "keys": [str(i)]}) for i in range(200)))
+        answers = await self.answers(reader, 200)
+        await self.close(server, writer)
+        self.assertEqual(set(answers), set(range(200)))
+        self.assertEqual(answers[7]["data"], {"keys": ["7"]})
+        self.assertEqual(answers[7]["status"], 200)
+
+    async def test_reading_is_paused_at_max_pipeline(self):
+        server, reader, writer = await self.serve(max_pipeline=4)
+        writer.write(b"".join(
+            encode_frame({"id": i, "op": "get", "token": "secret",
+                          "keys": []}) for i in range(50)))
+        answers = await self.answers(reader, 50)
+        await self.close(server, writer)
+        self.assertEqual(len(answers), 50)
+
+    async def test_invalid_token_and_unknown_op(self):
+        server, reader, writer = await self.serve()
+        writer.write(encode_frame({"id": 1, "op": "get", "token": "bad",
+                                   "keys": []}) +
+                     encode_frame({"id": 2, "op": "drop", "token": "secret"}))
+        answers = await self.answers(reader, 2)
+        await self.close(server, writer)
+        self.assertEqual(answers[1]["status"], 401)
+        self.assertEqual(answers[2]["status"], 400)
+
+    @unittest.skipIf(wire.msgpack is None, "msgpack is not installed")
+    async def test_answer_has_format_of_request(self):
+        server, reader, writer = await self.serve()
+        writer.write(encode_frame({"id": 1, "op": "get", "token": "secret",
+                                   "keys": ["a"]}, wire.MSGPACK))
+        answer, content_type = await read_frame(reader)
+        await self.close(server, writer)
+        self.assertEqual(content_type, wire.MSGPACK)
+        self.assertEqual(answer["data"], {"keys": ["a"]})
+
+
+if __name__ == '__main__':
+    unittest.main()
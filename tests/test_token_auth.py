@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.token_auth import SanicTokenAuth
+
+
+class Request:
+    def __init__(self, token, header="Authorization"):
+        self.headers = {header: token} if token is not None else {}
+
+
+class TestSanicTokenAuth(aiounittest.AsyncTestCase):
+
+    def setUp(self) -> None:
+        self.tokens = {"a"}
+        self.calls = 0
+        self.generation = 0
+
+        async def verifier(token):
+            self.calls += 1
+            return token in self.tokens
+
+        self.auth = SanicTokenAuth(token_verifier=verifier,
+                                   generation=lambda: self.generation,
+                                   cache_size=2)
+
+    async def test_result_is_cached_until_generation_changes(self):
+        self.assertTrue(await self.auth._is_authenticated(Request("a")))
+        self.assertTrue(await self.auth._is_authenticated(Request("a")))
+        self.assertEqual(self.calls, 1)
+        self.tokens.clear()
+        self.generation += 1
+        self.assertFalse(await self.auth._is_authenticated(Request("a")))
+        self.assertEqual(self.calls, 2)
+
+    async def test_least_recently_used_result_is_evicted(self):
+        for token in ["a", "b", "a", "c"]:
+            await self.auth._is_authenticated(Request(token))
+        self.assertEqual(list(self.auth.cache), ["a", "c"])
+
+
+class TestSecretAuth(aiounittest.AsyncTestCase):
+
+    async def test_request_with_secret_is_authenticated(self):
+        auth = SanicTokenAuth(header="X-Cluster-Secret", secret_key="s")
+        self.assertTrue(await auth._is_authenticated(
+            Request("s", "X-Cluster-Secret")))
+        self.assertFalse(await auth._is_authenticated(
+            Request("other", "X-Cluster-Secret")))
+        self.assertFalse(await auth._is_authenticated(
+            Request(None, "X-Cluster-Secret")))
+
+    async def test_nobody_is_authenticated_without_secret(self):
+        auth = SanicTokenAuth(header="X-Cluster-Secret")
+        self.assertFalse(await auth._is_authenticated(
+            Request(None, "X-Cluster-Secret")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import asyncio
+import unittest
+import tempfile
+import shutil
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.token_log import TokenLog, TokenBatcher, hash_token
+
+
+class TestTokenLog(aiounittest.AsyncTestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "api_keys.log")
+
+    async def test_tokens_are_restored_after_restart(self):
+        log = TokenLog(self.path)
+        log.load()
+        await log.add(["a", "b"])
+        await log.add(["b", "c"])
+        log.close()
+
+        log = TokenLog(self.path)
+        log.load()
+        self.assertEqual(set(log), {hash_token(token) for token in "abc"})
+        self.assertEqual(log.lines, 3)
+        self.assertIn("a", log)
+        log.close()
+
+    async def test_raw_tokens_are_not_written(self):
+        log = TokenLog(self.path)
+        log.load()
+        await log.add(["secret"])
+        log.close()
+        with open(self.path) as f:
+            self.assertNotIn("secret", f.read())
+
+    async def test_torn_last_line_is_ignored(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"token": "a"}) + "\n" + '{"tok')
+        log = TokenLog(self.path)
+        log.load()
+        self.assertEqual(set(log), {hash_token("a")})
+        await log.add(["b"])
+        log.close()
+        log = TokenLog(self.path)
+        log.load()
+        self.assertIn("b", log)
+        log.close()
+
+    async def test_legacy_json_is_moved_to_log(self):
+        legacy_path = os.path.join(self.root, "api_keys.json")
+        with open(legacy_path, "w") as f:
+            f.write(json.dumps({"api_keys": ["a", "b"]}))
+        log = TokenLog(self.path)
+        log.load(legacy_path)
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertIn("a", log)
+        self.assertEqual(len(log), 2)
+        with open(self.path) as f:
+            self.assertNotIn('"token"', f.read())
+        log.close()
+
+    async def test_revoked_token_is_invalid_after_restart(self):
+        log = TokenLog(self.path)
+        log.load()
+        await log.add(["a", "b"])
+        await log.revoke(["a"])
+        log.close()
+
+        log = TokenLog(self.path)
+        log.load()
+        self.assertNotIn("a", log)
+        self.assertIn("b", log)
+        # registration does not resurrect revoked token
+        self.assertEqual(await log.add(["a"]), [])
+        self.assertNotIn("a", log)
+        log.close()
+
+    async def test_expired_tokens_are_dropped(self):
+        log = TokenLog(self.path, compact_min_lines=0)
+        log.load()
+        await log.add(["a"], ttl=0.05)
+        await log.add(["b"])
+        self.assertIn("a", log)
+        generation = log.refresh()
+        await asyncio.sleep(0.06)
+        self.assertNotIn("a", log)
+        self.assertNotEqual(log.refresh(), generation)
+        self.assertEqual(len(log), 1)
+        log.compact()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        log.close()
+
+    async def test_records_of_other_process_are_read(self):
+        log = TokenLog(self.path, refresh_interval=0)
+        log.load()
+        other = TokenLog(self.path, refresh_interval=0)
+        other.load()
+        await other.add(["a"])
+        generation = log.generation
+        self.assertNotEqual(log.refresh(), generation)
+        self.assertIn("a", log)
+        await log.revoke(["a"])
+        other.refresh()
+        self.assertNotIn("a", other)
+        # compaction replaces file, the other process rereads it
+        log.compact()
+        await other.add(["b"])
+        log.refresh()
+        self.assertIn("b", log)
+        self.assertNotIn("a", log)
+        log.close()
+        other.close()
+
+    async def test_sync_sends_records_of_differing_buckets(self):
+        first = TokenLog(self.path)
+        first.load()
+        second = TokenLog(os.path.join(self.root, "other.log"))
+        second.load()
+        await first.add([f"t{i}" for i in range(100)])
+        await second.add([f"t{i}" for i in range(100)] + ["new"])
+        buckets = second.tree.diff(first.tree.hex_leaves())
+        self.assertEqual(buckets, [first.tree.bucket(hash_token("new"))])
+        records = second.records(buckets)
+        self.assertLess(len(records), 10)
+        await first.apply(records)
+        self.assertIn("new", first)
+        self.assertEqual(first.tree.root(), second.tree.root())
+        first.close()
+        second.close()
+
+    async def test_compaction_keeps_one_line_per_token(self):
+        with open(self.path, "w") as f:
+            for _ in range(4):
+                f.write(json.dumps({"hash": hash_token("a"),
+                                    "expires": None}) + "\n")
+        log = TokenLog(self.path, compact_min_lines=0)
+        log.load()
+        await log.add(["b"])
+        self.assertEqual(log.lines, 2)
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        log.close()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+
+class TestTokenBatcher(aiounittest.AsyncTestCase):
+
+    async def test_concurrent_tokens_are_flushed_together(self):
+        batches = []
+
+        async def flush(tokens):
+            batches.append(tokens)
+
+        batcher = TokenBatcher(flush, interval=0.01, max_size=3)
+        await asyncio.gather(*[batcher.add(f"t{i}") for i in range(5)])
+        self.assertEqual(batches, [["t0", "t1", "t2"], ["t3", "t4"]])
+
+    async def test_flush_error_is_raised_to_every_waiter(self):
+        async def flush(tokens):
+            raise ConnectionError("no nodes")
+
+        batcher = TokenBatcher(flush, interval=0.01)
+        results = await asyncio.gather(batcher.add("a"), batcher.add("b"),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ConnectionError)
+                            for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
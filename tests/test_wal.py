@@ -0,0 +1,57 @@
+import os
+import sys
+import asyncio
+import unittest
+import tempfile
+import shutil
+import aiounittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage.wal import WriteAheadLog
+
+
+class TestWriteAheadLog(aiounittest.AsyncTestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "wal.log")
+
+    async def test_concurrent_appends_are_committed_by_one_write(self):
+        wal = WriteAheadLog(self.path, fsync="always")
+        wal.open()
+        await asyncio.gather(*[wal.append({"key": i}) for i in range(100)])
+        wal.close()
+        self.assertEqual(wal.commits, 1)
+        self.assertEqual([r["key"] for r in wal.replay()], list(range(100)))
+
+    async def test_replay_skips_torn_tail(self):
+        wal = WriteAheadLog(self.path, fsync="os")
+        wal.open()
+        await wal.append({"key": 1})
+        wal.close()
+        with open(self.path, "a") as f:
+            f.write('{"key": 2')
+        self.assertEqual(list(wal.replay()), [{"key": 1}])
+
+    async def test_checkpoint_truncates_log(self):
+        checkpoints = []
+        wal = WriteAheadLog(self.path, fsync="interval", checkpoint_size=1,
+                            on_checkpoint=lambda: checkpoints.append(1))
+        wal.open()
+        await wal.append({"key": 1})
+        await asyncio.sleep(0.01)
+        wal.close()
+        self.assertEqual(len(checkpoints), 1)
+        self.assertEqual(list(wal.replay()), [])
+
+    def test_unknown_policy_raises_value_err(self):
+        self.assertRaises(ValueError, WriteAheadLog, self.path, "never")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+
+if __name__ == '__main__':
+    unittest.main()
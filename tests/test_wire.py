@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.path.pardir))
+
+from storage import wire
+
+
+class TestWire(unittest.TestCase):
+    data = {"db_name": "db",
+            "keys": [{"key": "a", "value": {"nested": [1, 2.5, None]},
+                      "version": [1600000000000, 0, "http://node:1"]}]}
+
+    def test_json_round_trip(self):
+        body = wire.dumps(self.data, wire.JSON)
+        self.assertEqual(wire.loads(body, "application/json; charset=utf-8"),
+                         self.data)
+
+    @unittest.skipIf(wire.msgpack is None, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        body = wire.dumps(self.data, wire.MSGPACK)
+        self.assertEqual(wire.loads(body, wire.MSGPACK), self.data)
+        self.assertLess(len(body), len(wire.dumps(self.data, wire.JSON)))
+
+    def test_unknown_content_type_is_parsed_as_json(self):
+        body = wire.dumps(self.data, wire.JSON)
+        self.assertEqual(wire.loads(body, "application/octet-stream"),
+                         self.data)
+        self.assertIsNone(wire.loads(b"", wire.JSON))
+
+    @unittest.skipIf(wire.msgpack is None, "msgpack is not installed")
+    def test_negotiate_answers_in_accepted_format(self):
+        self.assertEqual(wire.negotiate("application/json, "
+                                        "application/msgpack"),
+                         wire.MSGPACK)
+        self.assertEqual(wire.negotiate("*/*"), wire.JSON)
+        self.assertEqual(wire.negotiate(None), wire.JSON)
+
+    def test_msgpack_falls_back_to_json_without_library(self):
+        with mock.patch.object(wire, "msgpack", None):
+            self.assertEqual(wire.content_type("msgpack"), wire.JSON)
+            self.assertEqual(wire.negotiate(wire.MSGPACK), wire.JSON)
+            with self.assertRaises(ValueError):
+                wire.loads(b"\x80", wire.MSGPACK)
+
+    def test_unknown_format_raises(self):
+        with self.assertRaises(ValueError):
+            wire.content_type("xml")
+
+    def test_headers_keep_authorization(self):
+        headers = wire.headers(wire.MSGPACK, {"Authorization": "token"})
+        self.assertEqual(headers, {"Authorization": "token",
+                                   "Content-Type": wire.MSGPACK,
+                                   "Accept": wire.MSGPACK})
+
+
+    def test_stream_decoder_joins_lines_split_by_chunks(self):
+        decoder = wire.StreamDecoder(wire.NDJSON)
+        self.assertEqual(decoder.feed(b'{"key": "a"}\n{"ke'), [{"key": "a"}])
+        self.assertEqual(decoder.feed(b'y": "b"}\n\n{"key"'),
+                         [{"key": "b"}])
+        self.assertEqual(decoder.feed(b': "c"}'), [])
+        self.assertEqual(decoder.close(), [{"key": "c"}])
+
+    @unittest.skipIf(wire.msgpack is None, "msgpack is not installed")
+    def test_stream_decoder_reads_concatenated_msgpack(self):
+        body = wire.dumps({"key": "a"}, wire.MSGPACK) + \
+            wire.dumps({"key": "b"}, wire.MSGPACK)
+        decoder = wire.StreamDecoder(wire.MSGPACK)
+        self.assertEqual(decoder.feed(body[:5]), [])
+        self.assertEqual(decoder.feed(body[5:]), [{"key": "a"}, {"key": "b"}])
+        self.assertEqual(decoder.close(), [])
+
+if __name__ == '__main__':
+    unittest.main()